@@ -196,8 +196,9 @@ from twisted.internet.defer import Deferred, maybeDeferred, fail
 
 # MODIFIED
 # parseproto
+from parseproto.amp.sansio import BoxParser
 from parseproto.basic.protocol import Int16StringReceiver
-import parseproto.amp
+from parseproto.basic.sansio import Int16StringParser
 
 
 
@@ -761,7 +762,6 @@ class BoxDispatcher:
             box[ASK] = tag
         box._sendTo(self.boxSender)
         if requiresAnswer:
-            print("_sendBox command tag:", tag)
             result = self._outstandingRequests[tag] = Deferred()
         else:
             result = None
@@ -861,7 +861,6 @@ class BoxDispatcher:
         and L{ERROR_DESCRIPTION} keys.
         """
         question = self._outstandingRequests.pop(box[ERROR])
-        print("Inside _errorReceived", box[ERROR])
         question.addErrback(self.unhandledError)
         errorCode = box[ERROR_CODE]
         description = box[ERROR_DESCRIPTION]
@@ -1426,10 +1425,8 @@ class ListOf(Argument):
         Convert the serialized form of a list of instances of some type back
         into that list.
         """
-        strings = []
-        parser = Int16StringReceiver()
-        parser.stringReceived = strings.append
-        parser.dataReceived(inString)
+        strings = [event.string
+                   for event in Int16StringParser().feed(inString)]
         return map(self.elementType.fromString, strings)
 
 
@@ -2060,7 +2057,7 @@ class _DescriptorExchanger(object):
 
 
 
-class BinaryBoxProtocol(Int16StringReceiver, _DescriptorExchanger):
+class BinaryBoxProtocol(BoxParser, Int16StringReceiver, _DescriptorExchanger):
     """
     A protocol for receiving L{AmpBox}es - key/value pairs - via length-prefixed
     strings.  A box is composed of:
@@ -2107,9 +2104,6 @@ class BinaryBoxProtocol(Int16StringReceiver, _DescriptorExchanger):
     innerProtocol = None
     innerProtocolClientFactory = None
 
-    _parsleyGrammarName = 'amp'
-    _parsleyGrammarPKG = parseproto.amp
-
     def __init__(self, boxReceiver):
         _DescriptorExchanger.__init__(self)
         self.boxReceiver = boxReceiver
@@ -2168,7 +2162,8 @@ class BinaryBoxProtocol(Int16StringReceiver, _DescriptorExchanger):
         if self.innerProtocol is not None:
             self.innerProtocol.dataReceived(data)
             return
-        print("dataReceived: ", data)
+        if self._keyLengthLimitExceeded:
+            return
         return Int16StringReceiver.dataReceived(self, data)
 
 
@@ -2194,17 +2189,6 @@ class BinaryBoxProtocol(Int16StringReceiver, _DescriptorExchanger):
         self.boxReceiver.stopReceivingBoxes(failReason)
 
 
-    # The longest key allowed
-    MAX_KEY_LENGTH = 255
-
-    # The longest value allowed (this is somewhat redundant, as longer values
-    # cannot be encoded - ah well).
-    MAX_VALUE_LENGTH = 65535
-
-    # The first thing received is a key.
-    MAX_LENGTH = MAX_KEY_LENGTH
-
-
     def proto_boxReceived(self, kv):
         # I want to know the current parsed position, so that I can correctly handle
         # the unparsed data to the switched protocol.
@@ -2212,16 +2196,17 @@ class BinaryBoxProtocol(Int16StringReceiver, _DescriptorExchanger):
         currentBox = AmpBox()
         for key, value in kv:
             currentBox[key] = value
-            print("parsed k,v: ", key, ":", value)
         self.boxReceiver.ampBoxReceived(currentBox)
 
 
     def lengthLimitExceeded(self, length):
         """
         The key length limit was exceeded.  Disconnect the transport and make
-        sure a meaningful exception is reported.
+        sure a meaningful exception is reported.  The data received from now
+        on is ignored, as what follows cannot be told apart from garbage.
         """
         self._keyLengthLimitExceeded = True
+        self._trampolinedParser.clear()
         self.transport.loseConnection()
 
 
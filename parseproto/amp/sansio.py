@@ -0,0 +1,49 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+"""
+A sans-I/O parser of AMP boxes.
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+
+import parseproto.amp
+from parseproto.basic.sansio import Int16StringParser
+
+
+
+class BoxReceived(namedtuple('BoxReceived', 'box')):
+    """
+    An AMP box was received.
+
+    @ivar box: The keys and values of the box.
+    @type box: C{dict}
+    """
+    __slots__ = ()
+
+
+
+class BoxParser(Int16StringParser):
+    """
+    A parser of AMP boxes: sequences of keys and values prefixed by their
+    16-bit length, ending with an empty key.
+
+    Keys longer than C{MAX_KEY_LENGTH} and values longer than
+    C{MAX_VALUE_LENGTH} become L{LengthLimitExceeded
+    <parseproto.basic.sansio.LengthLimitExceeded>} events.
+    """
+    _parsleyGrammarName = 'amp'
+    _parsleyGrammarPKG = parseproto.amp
+
+    # The longest key allowed
+    MAX_KEY_LENGTH = 255
+
+    # The longest value allowed (this is somewhat redundant, as longer values
+    # cannot be encoded - ah well).
+    MAX_VALUE_LENGTH = 65535
+
+    # The first thing received is a key.
+    MAX_LENGTH = MAX_KEY_LENGTH
+
+    def proto_boxReceived(self, kv):
+        self.eventReceived(BoxReceived(dict(kv)))
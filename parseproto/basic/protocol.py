@@ -1,5 +1,6 @@
-import functools, os
-from struct import pack, calcsize
+from struct import pack
+
+from zope.interface import directlyProvides, providedBy
 
 # Twisted imports
 from twisted.internet import error, protocol
@@ -7,64 +8,270 @@ from twisted.internet import error, protocol
 from twisted.protocols.basic import _PauseableMixin, StringTooLongError
 # from twisted.protocols.basic import _RecvdCompatHack
 
-# Parsley imports
-from ometa.grammar import OMeta
+# Parseproto
+from parseproto.basic.sansio import (
+    LineOnlyParser, LineParser, IntNStringParser, Int32StringParser,
+    Int16StringParser, Int8StringParser, Int32LEStringParser,
+    Int16LEStringParser, VarintStringParser, NetstringParser)
+from parseproto.util.sansio import Parser
 
 
-# Parseproto
-import parseproto.basic
-from ometa.tube import TrampolinedParser
+class _CorkedTransport(object):
+    """
+    A transport holding back the writes made to it until the end of the
+    current reactor iteration, to write them to the transport it wraps in a
+    single C{writeSequence} call.
+
+    Everything but writing is delegated to the wrapped transport, which
+    provides the same interfaces.  What was written is written first before
+    losing the connection, starting TLS or registering a producer, which all
+    change how later writes are handled.
+    """
+
+    def __init__(self, transport, clock):
+        self._transport = transport
+        self._clock = clock
+        self._pending = []
+        self._flushCall = None
+        directlyProvides(self, providedBy(transport))
+
 
-# ParserProtocol currently only supports terml based grammar
-def getGrammar(pkg, name):
-    base = os.path.dirname(os.path.abspath(pkg.__file__))
-    src = open(os.path.join(base, name + ".parsley")).read()
-    return OMeta(src).parseGrammar(name)
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
 
 
-class _ReceiverMixin(object):
-    _trampolinedParser = None
-    _parsleyGrammarName = b''
-    _parsleyGrammarPKG = None
-    _bindings = {}
-    currentRule = "initial"
+    def write(self, data):
+        self._pending.append(data)
+        self._scheduleFlush()
 
-    def _initializeParserProtocol(self):
-        self._trampolinedParser = TrampolinedParser(
-            grammar=getGrammar(self._parsleyGrammarPKG, self._parsleyGrammarName),
-            receiver=self,
-            bindings=self._bindings
-        )
 
-    # this is a utility function.
-    def showArg(self, *args):
-        print(args)
+    def writeSequence(self, data):
+        self._pending.extend(data)
+        self._scheduleFlush()
+
+
+    def _scheduleFlush(self):
+        if self._flushCall is None:
+            self._flushCall = self._clock.callLater(0, self.flush)
+
+
+    def flush(self):
+        """
+        Write everything held back now.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._transport.writeSequence(pending)
 
 
-class BaseReceiver(_ReceiverMixin, protocol.Protocol):
+    def loseConnection(self):
+        self.flush()
+        return self._transport.loseConnection()
+
+
+    def startTLS(self, *args, **kwargs):
+        self.flush()
+        return self._transport.startTLS(*args, **kwargs)
+
+
+    def registerProducer(self, producer, streaming):
+        self.flush()
+        return self._transport.registerProducer(producer, streaming)
+
+
+
+class BaseReceiver(Parser, protocol.Protocol):
     """
     This class act as the base receiver for stream oriented protocol.
+
+    A receiver is the sans-I/O parser of its protocol hooked to a transport:
+    it overrides the callbacks of the parser to act on the connection.
+
+    @cvar corkOutput: Whether the writes made to the transport during a
+        reactor iteration are coalesced into one, at the end of the
+        iteration.
+    @ivar clock: The reactor scheduling the writes of a corked output and
+        timing flow control, if not the global reactor.
     """
+    corkOutput = False
+    clock = None
+
+    def _getClock(self):
+        if self.clock is None:
+            from twisted.internet import reactor
+            return reactor
+        return self.clock
+
+
+    def makeConnection(self, transport):
+        if self.corkOutput:
+            transport = _CorkedTransport(transport, self._getClock())
+        protocol.Protocol.makeConnection(self, transport)
 
 
-class LineOnlyReceiver(BaseReceiver):
+class _FlowControlMixin(object):
     """
-    A protocol that receives only lines.
+    Pause the transport while the receiver is falling behind, and resume it
+    once it caught up.
+
+    The receiver is falling behind when it holds more than C{highWatermark}
+    bytes not parsed yet, or more than C{highPendingWatermark} events
+    pending, and caught up when both are back to their low watermarks.  A
+    high watermark of C{None} is not checked.
+
+    The bytes not parsed yet are only counted while the receiver is paused
+    or has events pending.  Otherwise they are the start of a message, whose
+    end could never be received if the transport were paused for it.
+
+    @ivar pendingEvents: The number of events given to L{trackPending} not
+        handled yet.
+    @ivar pauseCount: The number of times the transport was paused for
+        falling behind.
+    @ivar pausedTime: The time the transport was paused for falling behind,
+        in seconds, not counting the current pause.
+    @ivar _pausedSince: When the current pause started, or C{None}.
+    """
+    highWatermark = None
+    lowWatermark = 0
+    highPendingWatermark = None
+    lowPendingWatermark = 0
+    pendingEvents = 0
+    pauseCount = 0
+    pausedTime = 0.0
+    _pausedSince = None
 
-    This is purely a speed optimisation over LineReceiver, for the
-    cases that raw mode is known to be unnecessary.
+    def dataReceived(self, data):
+        super(_FlowControlMixin, self).dataReceived(data)
+        if (self.highWatermark is not None or
+                self.highPendingWatermark is not None):
+            self._checkWatermarks()
+
+
+    def resumeProducing(self):
+        self.paused = False
+        if self._pausedSince is None:
+            self.transport.resumeProducing()
+        self.dataReceived(b'')
+
+
+    def trackPending(self, deferred):
+        """
+        Count the handling of an event as pending until C{deferred} fires.
+
+        @type deferred: L{Deferred<twisted.internet.defer.Deferred>}
+        @return: C{deferred}
+        """
+        self.pendingEvents += 1
+        self._checkWatermarks()
 
+        def handled(result):
+            self.pendingEvents -= 1
+            self._checkWatermarks()
+            return result
+        return deferred.addBoth(handled)
+
+
+    def _checkWatermarks(self):
+        """
+        Pause or resume the transport, depending on the watermarks.
+        """
+        if self.transport is None:
+            return
+        buffered = 0
+        if (self._trampolinedParser is not None and
+                (self.paused or self.pendingEvents)):
+            buffered = self._trampolinedParser.remaining
+        if self._pausedSince is None:
+            if ((self.highWatermark is not None and
+                    buffered > self.highWatermark) or
+                    (self.highPendingWatermark is not None and
+                     self.pendingEvents > self.highPendingWatermark)):
+                self._pausedSince = self._getClock().seconds()
+                self.pauseCount += 1
+                self.transport.pauseProducing()
+        elif (buffered <= self.lowWatermark and
+                self.pendingEvents <= self.lowPendingWatermark):
+            self.pausedTime += self._getClock().seconds() - self._pausedSince
+            self._pausedSince = None
+            if not self.paused:
+                self.transport.resumeProducing()
+
+
+
+class _LineBatchingMixin(object):
+    """
+    Deliver the lines found in one call of C{dataReceived} in a single call of
+    C{linesReceived}, if the receiver defines it.
+
+    @ivar _lines: The lines parsed but not delivered yet, while parsing.
     """
-    MAX_LENGTH = 16384
-    _parsleyGrammarPKG = parseproto.basic
-    _parsleyGrammarName = 'line_only_receiver'
+    linesReceived = None
+    _lines = None
 
     def dataReceived(self, data):
-        if self._trampolinedParser is None:
-            self._initializeParserProtocol()
-        return self._trampolinedParser.receive(data)
+        if self.linesReceived is None or self._lines is not None:
+            return super(_LineBatchingMixin, self).dataReceived(data)
+        self._lines = []
+        # The callbacks of the grammar are shadowed for the time of the parse,
+        # so that no Python function is called per line and the lines found
+        # before anything else are delivered first.
+        self.lineReceived = self._lines.append
+        self.lineLengthExceeded = self._flushingLines(self.lineLengthExceeded)
+        if hasattr(self, 'rawDataReceived'):
+            self.rawDataReceived = self._flushingLines(self.rawDataReceived)
+        try:
+            super(_LineBatchingMixin, self).dataReceived(data)
+        finally:
+            for name in ('lineReceived', 'lineLengthExceeded',
+                         'rawDataReceived'):
+                self.__dict__.pop(name, None)
+            lines, self._lines = self._lines, None
+        if lines:
+            rule = self.currentRule
+            self.linesReceived(lines)
+            if self.currentRule != rule:
+                # The data after the last line was partially parsed in the
+                # previous mode.
+                rest = self._trampolinedParser.clear()
+                if rest:
+                    self.dataReceived(rest)
+
+
+    def _flushLines(self):
+        """
+        Deliver the lines parsed so far.
+        """
+        if self._lines:
+            lines = self._lines[:]
+            del self._lines[:]
+            self.linesReceived(lines)
+
+
+    def _flushingLines(self, callback):
+        def flushThenCall(data):
+            self._flushLines()
+            return callback(data)
+        return flushThenCall
+
 
 
+class LineOnlyReceiver(_LineBatchingMixin, LineOnlyParser, BaseReceiver):
+    """
+    A protocol that receives only lines.
+
+    This is purely a speed optimisation over LineReceiver, for the
+    cases that raw mode is known to be unnecessary.
+
+    @ivar linesReceived: If set, a callable called instead of
+        L{lineReceived} with the list of the lines found in the data of a
+        call of C{dataReceived}, saving a call per line.  A line too long is
+        reported after the lines found before it.
+    """
+
     def lineReceived(self, line):
         """
         Override this for when each line is received.
@@ -87,6 +294,21 @@ class LineOnlyReceiver(BaseReceiver):
         return self.transport.writeSequence((line, '\r\n'))
 
 
+    def sendLines(self, lines):
+        """
+        Sends lines to the other end of the connection, in one write.
+
+        @param lines: The lines to send, not including the delimiter.
+        @type lines: An iterable of C{bytes}
+        """
+        data = []
+        for line in lines:
+            data.append(line)
+            data.append('\r\n')
+        if data:
+            return self.transport.writeSequence(data)
+
+
     def lineLengthExceeded(self, line):
         """
         Called when the maximum line length has been reached.
@@ -95,7 +317,8 @@ class LineOnlyReceiver(BaseReceiver):
         return error.ConnectionLost('Line length exceeded')
 
 
-class LineReceiver(BaseReceiver, _PauseableMixin):
+class LineReceiver(_FlowControlMixin, _LineBatchingMixin, LineParser,
+                   BaseReceiver, _PauseableMixin):
     """
     A protocol that receives lines and/or raw data, depending on mode.
 
@@ -111,114 +334,13 @@ class LineReceiver(BaseReceiver, _PauseableMixin):
     @cvar MAX_LENGTH: The maximum length of a line to allow (If a
                       sent line is longer than this, the connection is dropped).
                       Default is 16384.
+    @ivar linesReceived: If set, a callable called instead of
+        L{lineReceived} with the list of the lines found in the data of a
+        call of C{dataReceived}, saving a call per line.  The lines are
+        delivered before any raw data or line too long following them, and
+        switching modes or pausing from C{linesReceived} applies to the data
+        after the last of them.
     """
-    _parsleyGrammarPKG = parseproto.basic
-    _parsleyGrammarName = 'line_receiver'
-    _buffer = b''
-    _busyReceiving = False
-    delimiter = b'\r\n'
-    MAX_LENGTH = 16384
-
-    _mode = 1
-    # make sure object is in this class's mro
-    @property
-    def line_mode(self):
-        return self._mode
-
-    @line_mode.setter
-    def line_mode(self, val):
-        self._mode = val
-        if self._trampolinedParser is not None:
-            self.currentRule = "line" if self._mode else "data"
-
-    @line_mode.deleter
-    def line_mode(self):
-        del self._mode
-
-
-    def clearLineBuffer(self):
-        """
-        Clear buffered data.
-
-        @return: All of the cleared buffered data.
-        @rtype: C{bytes}
-        """
-        b, self._buffer = self._buffer, b""
-        return b
-
-
-    def dataReceived(self, data):
-        """
-        Translates bytes into lines, and calls lineReceived (or
-        rawDataReceived, depending on mode.)
-        """
-        if self._busyReceiving:
-            self._buffer += data
-            return
-
-        try:
-            self._busyReceiving = True
-            self._buffer += data
-            while self._buffer and not self.paused:
-                if self._trampolinedParser is None:
-                    self._initializeParserProtocol()
-                buf, self._buffer = self._buffer, b''
-                self._trampolinedParser.receive(buf)
-            # while self._buffer and not self.paused:
-            #     if self.line_mode:
-            #         try:
-            #             line, self._buffer = self._buffer.split(
-            #                 self.delimiter, 1)
-            #         except ValueError:
-            #             if len(self._buffer) > self.MAX_LENGTH:
-            #                 line, self._buffer = self._buffer, b''
-            #                 return self.lineLengthExceeded(line)
-            #             return
-            #         else:
-            #             lineLength = len(line)
-            #             if lineLength > self.MAX_LENGTH:
-            #                 exceeded = line + self._buffer
-            #                 self._buffer = b''
-            #                 return self.lineLengthExceeded(exceeded)
-            #             why = self.lineReceived(line)
-            #             if (why or self.transport and
-            #                 self.transport.disconnecting):
-            #                 return why
-            #     else:
-            #         data = self._buffer
-            #         self._buffer = b''
-            #         why = self.rawDataReceived(data)
-            #         if why:
-            #             return why
-        finally:
-            self._busyReceiving = False
-
-
-    def setLineMode(self, extra=b''):
-        """
-        Sets the line-mode of this receiver.
-
-        If you are calling this from a rawDataReceived callback,
-        you can pass in extra unhandled data, and that data will
-        be parsed for lines.  Further data received will be sent
-        to lineReceived rather than rawDataReceived.
-
-        Do not pass extra data if calling this function from
-        within a lineReceived callback.
-        """
-        self.line_mode = 1
-        if extra:
-            return self.dataReceived(extra)
-
-
-    def setRawMode(self):
-        """
-        Sets the raw mode of this receiver.
-        Further data received will be sent to rawDataReceived rather
-        than lineReceived.
-        """
-        self.line_mode = 0
-
 
     def rawDataReceived(self, data):
         """
@@ -247,6 +369,22 @@ class LineReceiver(BaseReceiver, _PauseableMixin):
         return self.transport.write(line + self.delimiter)
 
 
+    def sendLines(self, lines):
+        """
+        Sends lines to the other end of the connection, in one write.
+
+        @param lines: The lines to send, not including the delimiter.
+        @type lines: An iterable of C{bytes}
+        """
+        data = []
+        delimiter = self.delimiter
+        for line in lines:
+            data.append(line)
+            data.append(delimiter)
+        if data:
+            return self.transport.writeSequence(data)
+
+
     def lineLengthExceeded(self, line):
         """
         Called when the maximum line length has been reached.
@@ -265,11 +403,16 @@ class LineReceiver(BaseReceiver, _PauseableMixin):
 #         return oself._unprocessed[:]
 
 
-class IntNStringReceiver(BaseReceiver, _PauseableMixin):
-    MAX_LENGTH = 99999
-    _unprocessed = b''
-    _parsleyGrammarPKG = parseproto.basic
-    _parsleyGrammarName = 'intn_string_receiver'
+class IntNStringReceiver(_FlowControlMixin, IntNStringParser, BaseReceiver,
+                         _PauseableMixin):
+    """
+    A receiver of strings prefixed by their length.
+
+    With C{streaming} set, strings are not buffered whole to be passed to
+    L{stringReceived}, but passed on as they are received to
+    L{stringStarted}, L{stringChunkReceived} and L{stringFinished}, so that
+    strings larger than the memory can be received.
+    """
     # recvd = _RecvdCompatHack()
 
     def stringReceived(self, string):
@@ -283,6 +426,36 @@ class IntNStringReceiver(BaseReceiver, _PauseableMixin):
         raise NotImplementedError
 
 
+    def stringStarted(self, length):
+        """
+        Override this for notification when the length prefix of a string is
+        received, in streaming mode.
+
+        @param length: The length of the string.
+        @type length: C{int}
+        """
+        raise NotImplementedError
+
+
+    def stringChunkReceived(self, chunk):
+        """
+        Override this for notification when a part of the string started
+        last is received, in streaming mode.
+
+        @param chunk: The part of the string.
+        @type chunk: C{bytes}
+        """
+        raise NotImplementedError
+
+
+    def stringFinished(self):
+        """
+        Override this for notification when the whole of the string started
+        last was received, in streaming mode.
+        """
+        raise NotImplementedError
+
+
     def lengthLimitExceeded(self, length):
         """
         Callback invoked when a length prefix greater than C{MAX_LENGTH} is
@@ -296,26 +469,6 @@ class IntNStringReceiver(BaseReceiver, _PauseableMixin):
         self.transport.loseConnection()
 
 
-    def dataReceived(self, data):
-        """
-        Convert int prefixed strings into calls to stringReceived.
-        """
-        if self._trampolinedParser is None:
-            self._initializeParserProtocol()
-        self._unprocessed += data
-        if self.paused:
-            return
-        #if 'recvd' in self.__dict__:
-        #    alldata = self.__dict__.pop('recvd')
-        #    print("if I were ever in")
-        #    # self._unprocessed += alldata
-        # need a second thought here.
-        # self._compatibilityOffset = len(self._unprocessed)
-        # self._unprocessed, unprocessed = b'', self._unprocessed
-        self._trampolinedParser.receive(self._unprocessed)
-        self._unprocessed = b''
-
-
     def sendString(self, string):
         """
         Send a prefixed string to the other end of the connection.
@@ -324,26 +477,54 @@ class IntNStringReceiver(BaseReceiver, _PauseableMixin):
             prefix, etc) will be added.
         @type string: C{bytes}
         """
-        if len(string) >= 2 ** (8 * self.prefixLength):
+        if len(string) >= self._maxLength():
             raise StringTooLongError(
                 "Try to send %s bytes whereas maximum is %s" % (
-                len(string), 2 ** (8 * self.prefixLength)))
-        return self.transport.write(pack(self.structFormat, len(string)) + string)
+                len(string), self._maxLength()))
+        return self.transport.write(self._packLength(len(string)) + string)
+
 
+    def sendStrings(self, strings):
+        """
+        Send prefixed strings to the other end of the connection, in one
+        write.
+
+        @param strings: The strings to send.
+        @type strings: An iterable of C{bytes}
 
-    def getStringLength(self, slen):
-        length = 0
-        for s in slen:
-            length = length << 8 | ord(s)
-        return length
+        @raise StringTooLongError: If one of the strings is too long to be
+            sent, in which case none is.
+        """
+        data = []
+        limit = self._maxLength()
+        for string in strings:
+            if len(string) >= limit:
+                raise StringTooLongError(
+                    "Try to send %s bytes whereas maximum is %s" % (
+                    len(string), limit))
+            data.append(self._packLength(len(string)))
+            data.append(string)
+        if data:
+            return self.transport.writeSequence(data)
+
+
+    def _maxLength(self):
+        """
+        The length of the shortest string too long for its length to fit in
+        the prefix, which is not sent.
+        """
+        return 2 ** (8 * self.prefixLength)
 
 
-    def checkStringLength(self, length):
-        return length < self.MAX_LENGTH
+    def _packLength(self, length):
+        """
+        Encode the length prefix of a string of C{length} bytes.
+        """
+        return pack(self.structFormat, length)
 
 
 
-class Int32StringReceiver(IntNStringReceiver):
+class Int32StringReceiver(Int32StringParser, IntNStringReceiver):
     """
     A receiver for int32-prefixed strings.
 
@@ -352,12 +533,10 @@ class Int32StringReceiver(IntNStringReceiver):
 
     This class publishes the same interface as NetstringReceiver.
     """
-    structFormat = "!I"
-    prefixLength = calcsize(structFormat)
 
 
 
-class Int16StringReceiver(IntNStringReceiver):
+class Int16StringReceiver(Int16StringParser, IntNStringReceiver):
     """
     A receiver for int16-prefixed strings.
 
@@ -366,12 +545,10 @@ class Int16StringReceiver(IntNStringReceiver):
 
     This class publishes the same interface as NetstringReceiver.
     """
-    structFormat = "!H"
-    prefixLength = calcsize(structFormat)
 
 
 
-class Int8StringReceiver(IntNStringReceiver):
+class Int8StringReceiver(Int8StringParser, IntNStringReceiver):
     """
     A receiver for int8-prefixed strings.
 
@@ -380,6 +557,108 @@ class Int8StringReceiver(IntNStringReceiver):
 
     This class publishes the same interface as NetstringReceiver.
     """
-    structFormat = "!B"
-    prefixLength = calcsize(structFormat)
 
+
+
+class Int32LEStringReceiver(Int32LEStringParser, IntNStringReceiver):
+    """
+    A receiver for strings prefixed by 4 bytes, the 32-bit length of the
+    string encoded in little-endian byte order.
+
+    This class publishes the same interface as NetstringReceiver.
+    """
+
+
+
+class Int16LEStringReceiver(Int16LEStringParser, IntNStringReceiver):
+    """
+    A receiver for strings prefixed by 2 bytes, the 16-bit length of the
+    string encoded in little-endian byte order.
+
+    This class publishes the same interface as NetstringReceiver.
+    """
+
+
+
+class VarintStringReceiver(VarintStringParser, IntNStringReceiver):
+    """
+    A receiver for strings prefixed by their length as a varint, as the
+    length-delimited messages of protocol buffers are.
+
+    This class publishes the same interface as NetstringReceiver.
+    """
+
+    def _maxLength(self):
+        # Each byte of the prefix carries seven bits of the length.
+        return 2 ** (7 * self.prefixLength)
+
+
+    def _packLength(self, length):
+        prefix = bytearray()
+        while length > 0x7f:
+            prefix.append(length & 0x7f | 0x80)
+            length >>= 7
+        prefix.append(length)
+        return bytes(prefix)
+
+
+
+class NetstringReceiver(_FlowControlMixin, NetstringParser, BaseReceiver,
+                        _PauseableMixin):
+    """
+    A protocol that sends and receives netstrings.
+
+    See U{http://cr.yp.to/proto/netstrings.txt} for the specification of
+    netstrings. Every netstring starts with digits that specify the length
+    of the data. This length specification is separated from the data by
+    a colon. The data is terminated with a comma.
+
+    Override L{stringReceived} to handle received netstrings. The connection
+    is lost if an illegal netstring, or one longer than C{MAX_LENGTH}, is
+    received.
+    """
+
+    def stringReceived(self, string):
+        """
+        Override this for notification when each complete string is received.
+
+        @param string: The complete string which was received with all
+            framing (length prefix, etc) removed.
+        @type string: C{bytes}
+        """
+        raise NotImplementedError
+
+
+    def invalidNetstring(self):
+        """
+        Called when the data received is not a netstring, or one too long.
+        The default implementation disconnects the transport.
+        """
+        self.transport.loseConnection()
+
+
+    def sendString(self, string):
+        """
+        Sends a netstring.
+
+        @param string: The string to send.  The necessary framing (length
+            prefix, etc) will be added.
+        @type string: C{bytes}
+        """
+        return self.transport.write(b'%d:%s,' % (len(string), string))
+
+
+    def sendStrings(self, strings):
+        """
+        Sends netstrings, in one write.
+
+        @param strings: The strings to send.
+        @type strings: An iterable of C{bytes}
+        """
+        data = []
+        for string in strings:
+            data.append(b'%d:' % (len(string),))
+            data.append(string)
+            data.append(b',')
+        if data:
+            return self.transport.writeSequence(data)
@@ -0,0 +1,486 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+"""
+Sans-I/O parsers of lines and of length-prefixed strings.
+
+These are the parsers of L{parseproto.basic.protocol}'s receivers: their
+grammars and state, without the transport.
+"""
+
+from __future__ import absolute_import
+
+import math
+from collections import namedtuple
+from struct import Struct, calcsize
+
+import parseproto.basic
+from parseproto.util.sansio import Parser
+
+
+
+# The delimiters of lines in universal newlines mode: a line may end with any
+# of them, as text files read with universal newlines do.
+UNIVERSAL_NEWLINES = (b'\r\n', b'\r', b'\n')
+
+
+
+class LineReceived(namedtuple('LineReceived', 'line')):
+    """
+    A line was received.
+
+    @ivar line: The line, without its delimiter.
+    """
+    __slots__ = ()
+
+
+
+class LineLengthExceeded(namedtuple('LineLengthExceeded', 'line')):
+    """
+    A line longer than the C{MAX_LENGTH} of the parser was received.
+
+    @ivar line: The data which was dropped, starting with the line.
+    """
+    __slots__ = ()
+
+
+
+class RawDataReceived(namedtuple('RawDataReceived', 'data')):
+    """
+    Data was received in raw mode.
+    """
+    __slots__ = ()
+
+
+
+class StringReceived(namedtuple('StringReceived', 'string')):
+    """
+    A length-prefixed string was received.
+
+    @ivar string: The string, without its length prefix.
+    """
+    __slots__ = ()
+
+
+
+class StringStarted(namedtuple('StringStarted', 'length')):
+    """
+    The length prefix of a string was received, in streaming mode.
+
+    @ivar length: The length of the string.
+    """
+    __slots__ = ()
+
+
+
+class StringChunkReceived(namedtuple('StringChunkReceived', 'chunk')):
+    """
+    A part of the string started last was received, in streaming mode.
+    """
+    __slots__ = ()
+
+
+
+class StringFinished(namedtuple('StringFinished', '')):
+    """
+    The whole of the string started last was received, in streaming mode.
+    """
+    __slots__ = ()
+
+
+
+class LengthLimitExceeded(namedtuple('LengthLimitExceeded', 'length')):
+    """
+    The length prefix of a string was larger than the C{MAX_LENGTH} of the
+    parser.
+
+    @ivar length: The length prefix received.
+    """
+    __slots__ = ()
+
+
+
+class InvalidNetstring(namedtuple('InvalidNetstring', '')):
+    """
+    The data received is not a netstring, or one longer than the
+    C{MAX_LENGTH} of the parser: the data received from then on is ignored.
+    """
+    __slots__ = ()
+
+
+
+class LineOnlyParser(Parser):
+    """
+    A parser of C{b'\\r\\n'}-delimited lines.
+
+    @cvar MAX_LENGTH: The length of the longest line accepted.
+    """
+    MAX_LENGTH = 16384
+    _parsleyGrammarPKG = parseproto.basic
+    _parsleyGrammarName = 'line_only_receiver'
+
+    def lineReceived(self, line):
+        self.eventReceived(LineReceived(line))
+
+
+    def lineLengthExceeded(self, line):
+        self.eventReceived(LineLengthExceeded(line))
+
+
+
+class LineParser(Parser):
+    """
+    A parser of lines and/or raw data, depending on mode.
+
+    In line mode, each line becomes a L{LineReceived} event.  In raw mode,
+    each chunk of data becomes a L{RawDataReceived} event.  The
+    L{setLineMode} and L{setRawMode} methods switch between the two modes.
+
+    With C{delimiters} set, lines may end with any of them, such as both
+    C{b'\\r\\n'} and a bare C{b'\\n'} with L{UNIVERSAL_NEWLINES}, and are
+    passed with the delimiter which ended them to L{delimitedLineReceived}.
+
+    @cvar delimiter: The line-ending delimiter to use.
+    @cvar delimiters: The line-ending delimiters accepted, or C{None} to
+        only accept C{delimiter}.  It is to be set before any data is
+        received, or followed by L{setLineMode}.
+    @cvar MAX_LENGTH: The length of the longest line accepted.
+    """
+    _parsleyGrammarPKG = parseproto.basic
+    _parsleyGrammarName = 'line_receiver'
+    _busyReceiving = False
+    delimiter = b'\r\n'
+    delimiters = None
+    MAX_LENGTH = 16384
+
+    _mode = 1
+    # make sure object is in this class's mro
+    @property
+    def line_mode(self):
+        return self._mode
+
+    @line_mode.setter
+    def line_mode(self, val):
+        self._mode = val
+        if not self._mode:
+            self.currentRule = "data"
+        elif self.delimiters is None:
+            self.currentRule = "line"
+        else:
+            self.currentRule = "anyLine"
+
+    @line_mode.deleter
+    def line_mode(self):
+        del self._mode
+
+
+    def clearLineBuffer(self):
+        """
+        Clear buffered data.
+
+        @return: All of the cleared buffered data.
+        @rtype: C{bytes}
+        """
+        if self._trampolinedParser is None:
+            return b""
+        return self._trampolinedParser.clear()
+
+
+    def _initializeParserProtocol(self):
+        if self.delimiters is not None and self.currentRule == "initial":
+            self.currentRule = "anyLine"
+        super(LineParser, self)._initializeParserProtocol()
+
+
+    def dataReceived(self, data):
+        """
+        Translates bytes into lines, and calls lineReceived (or
+        rawDataReceived, depending on mode.)
+        """
+        if self._trampolinedParser is None:
+            self._initializeParserProtocol()
+        self._trampolinedParser.feed(data)
+        if self._busyReceiving:
+            return
+
+        try:
+            self._busyReceiving = True
+            self._trampolinedParser.parse()
+        finally:
+            self._busyReceiving = False
+
+
+    def setLineMode(self, extra=b''):
+        """
+        Sets the line-mode of this parser.
+
+        If you are calling this from a rawDataReceived callback,
+        you can pass in extra unhandled data, and that data will
+        be parsed for lines.  Further data received will be sent
+        to lineReceived rather than rawDataReceived.
+
+        Do not pass extra data if calling this function from
+        within a lineReceived callback.
+        """
+        self.line_mode = 1
+        if extra:
+            return self.dataReceived(extra)
+
+
+    def setRawMode(self):
+        """
+        Sets the raw mode of this parser.
+        Further data received will be sent to rawDataReceived rather
+        than lineReceived.
+        """
+        self.line_mode = 0
+
+
+    def lineReceived(self, line):
+        self.eventReceived(LineReceived(line))
+
+
+    def delimitedLineReceived(self, line, delimiter):
+        """
+        Called with a line and the delimiter which ended it, when
+        C{delimiters} is set.  Override this to know the delimiter; by
+        default the line is passed to L{lineReceived}.
+        """
+        self.lineReceived(line)
+
+
+    def rawDataReceived(self, data):
+        self.eventReceived(RawDataReceived(data))
+
+
+    def lineLengthExceeded(self, line):
+        self.eventReceived(LineLengthExceeded(line))
+
+
+
+class IntNStringParser(Parser):
+    """
+    A parser of strings prefixed by their length, as an unsigned integer in
+    network byte order.
+
+    In streaming mode, a string is not buffered but passed on as it is
+    received: its length as a L{StringStarted} event, its data as
+    L{StringChunkReceived} events, and its end as a L{StringFinished} event.
+
+    @cvar structFormat: The format of the length prefix for L{struct}.
+    @cvar prefixLength: The length of the prefix, in bytes.
+    @cvar MAX_LENGTH: The length of the longest string accepted.
+    @ivar streaming: Whether the strings are streamed.  It is to be set before
+        any data is received.
+    @ivar _lengthStruct: C{structFormat} compiled, with which the prefix is
+        decoded in the input buffer.
+    @ivar _streamRemaining: The length of the string being streamed which
+        was not received yet.
+    """
+    MAX_LENGTH = 99999
+    _parsleyGrammarPKG = parseproto.basic
+    _parsleyGrammarName = 'intn_string_receiver'
+    structFormat = None
+    streaming = False
+    _streamRemaining = 0
+    _lengthStruct = None
+
+    def _initializeParserProtocol(self):
+        if self.streaming:
+            self.currentRule = 'streaming'
+        if self.structFormat is not None:
+            self._lengthStruct = Struct(self.structFormat)
+        super(IntNStringParser, self)._initializeParserProtocol()
+
+
+    def dataReceived(self, data):
+        if self._streamRemaining:
+            parser = self._trampolinedParser
+            if getattr(self, 'paused', False):
+                parser.feed(data)
+                return
+            if parser.remaining:
+                # Received while paused.
+                data = parser.clear() + data
+            data = self._streamChunk(data)
+            if not data:
+                return
+        super(IntNStringParser, self).dataReceived(data)
+
+
+    def _streamString(self, length):
+        """
+        Start streaming a string, with the data received after its prefix.
+        """
+        self.stringStarted(length)
+        if not length:
+            self.stringFinished()
+            return
+        self._streamRemaining = length
+        rest = self._streamChunk(self._trampolinedParser.clear())
+        if rest:
+            self._trampolinedParser.receive(rest)
+
+
+    def _streamChunk(self, data):
+        """
+        Pass on the part of C{data} belonging to the string being streamed.
+
+        @return: The rest of C{data}.
+        """
+        if len(data) <= self._streamRemaining:
+            chunk, rest = data, b''
+        else:
+            chunk = data[:self._streamRemaining]
+            rest = data[self._streamRemaining:]
+        self._streamRemaining -= len(chunk)
+        if chunk:
+            self.stringChunkReceived(chunk)
+        if not self._streamRemaining:
+            self.stringFinished()
+        return rest
+
+
+    def stringReceived(self, string):
+        self.eventReceived(StringReceived(string))
+
+
+    def stringStarted(self, length):
+        self.eventReceived(StringStarted(length))
+
+
+    def stringChunkReceived(self, chunk):
+        self.eventReceived(StringChunkReceived(chunk))
+
+
+    def stringFinished(self):
+        self.eventReceived(StringFinished())
+
+
+    def lengthLimitExceeded(self, length):
+        self.eventReceived(LengthLimitExceeded(length))
+
+
+    def checkStringLength(self, length):
+        return length < self.MAX_LENGTH
+
+
+
+class Int32StringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their 32-bit length.
+    """
+    structFormat = "!I"
+    prefixLength = calcsize(structFormat)
+
+
+
+class Int16StringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their 16-bit length.
+    """
+    structFormat = "!H"
+    prefixLength = calcsize(structFormat)
+
+
+
+class Int8StringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their 8-bit length.
+    """
+    structFormat = "!B"
+    prefixLength = calcsize(structFormat)
+
+
+
+class Int32LEStringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their 32-bit length, in little-endian
+    byte order.
+    """
+    structFormat = "<I"
+    prefixLength = calcsize(structFormat)
+
+
+
+class Int16LEStringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their 16-bit length, in little-endian
+    byte order.
+    """
+    structFormat = "<H"
+    prefixLength = calcsize(structFormat)
+
+
+
+class VarintStringParser(IntNStringParser):
+    """
+    A parser of strings prefixed by their length as a varint, the base 128
+    encoding of protocol buffers: seven bits per byte, least significant
+    first, with the high bit set on every byte but the last one.
+
+    @cvar prefixLength: The length of the longest prefix, in bytes.  A
+        longer prefix is taken as a length over C{MAX_LENGTH}.
+    """
+    _parsleyGrammarName = 'varint_string_receiver'
+    prefixLength = 10
+
+
+
+class NetstringParser(Parser):
+    """
+    A parser of netstrings: strings prefixed by their length in decimal
+    digits and a colon, and followed by a comma.
+
+    See U{http://cr.yp.to/proto/netstrings.txt}.
+
+    @cvar MAX_LENGTH: The length of the longest string accepted.
+    @ivar brokenPeer: Whether invalid data was received.
+    """
+    MAX_LENGTH = 99999
+    _parsleyGrammarPKG = parseproto.basic
+    _parsleyGrammarName = 'netstring_receiver'
+    brokenPeer = 0
+
+    def dataReceived(self, data):
+        if not self.brokenPeer:
+            super(NetstringParser, self).dataReceived(data)
+
+
+    def stringReceived(self, string):
+        self.eventReceived(StringReceived(string))
+
+
+    def _maxLengthSize(self):
+        """
+        The number of digits of a length prefix after which it is certainly
+        longer than C{MAX_LENGTH}.
+        """
+        return int(math.ceil(math.log10(self.MAX_LENGTH))) + 1
+
+
+    def _extractLength(self, digits):
+        """
+        Get the length a length prefix specifies.
+
+        @return: The length, or C{None} if C{digits} is not a length in
+            decimal digits without leading zeros, or is a length longer than
+            C{MAX_LENGTH}.
+        """
+        if not digits.isdigit() or (digits[0] == b'0' and len(digits) > 1):
+            return None
+        length = int(digits)
+        if length > self.MAX_LENGTH:
+            return None
+        return length
+
+
+    def _handleParseError(self):
+        """
+        Ignore the data received from now on.
+        """
+        self.brokenPeer = 1
+        self._trampolinedParser.clear()
+        self.invalidNetstring()
+
+
+    def invalidNetstring(self):
+        self.eventReceived(InvalidNetstring())
@@ -17,133 +17,8 @@ from twisted.python import log, failure
 from twisted.internet import protocol, defer
 from twisted.internet.error import CannotListenError
 
-# Parsley imports
-from ometa.grammar import loadGrammar
-from parsley import wrapGrammar
-from ometa.runtime import ParseError
-
-
 # Parseproto
-import parseproto.dns
-
-
-class DNSParser(object):
-
-    def __init__(self, *args, **kwargs):
-        self.bindings = self.setupBindings()
-        self.grammar = wrapGrammar(loadGrammar(parseproto.dns, "grammar",
-                                               self.bindings))
-
-
-    def updateData(self, data=b''):
-        self.data = data
-        self.parser = self.grammar(data)
-
-
-    def setupBindings(self):
-        bindings = {}
-        items = dns.__dict__.iterkeys()
-        for record in [x for x in items if x.startswith('Record_')]:
-            recordType = getattr(dns, record)
-            bindings[record[len('Record_'):]] = recordType
-        bindings['Parser'] = self
-        bindings['UnknownRecord'] = dns.UnknownRecord
-        bindings['Query'] = dns.Query
-        bindings['RRHeader'] = dns.RRHeader
-        # some trivial settings as we cannot modify twisted.names.dns
-        bindings['A'] = self.record_AFromRawData
-        bindings['A6'] = self.record_A6FromRawData
-        bindings['AAAA'] = self.record_AAAAFromRawData
-        bindings['WKS'] = self.record_WKSFromRawData
-        bindings['Message'] = self.messageFromRawData
-        bindings['Name'] = self.nameFromRawData
-        bindings['getPayloadName'] = lambda t: dns.QUERY_TYPES.get(t, "UnknownRecord")
-        return bindings
-
-
-    def nameFromRawData(self, labels, offset=None):
-        name = b'.'.join(labels)
-        if offset is None:
-            return dns.Name(name=name)
-        visited = set()
-        visited.add(offset)
-        while 1:
-            l = ord(self.data[offset])
-            offset += 1
-            if l == 0:
-                return dns.Name(name)
-            if (l >> 6) == 3:
-                offset = (l & 63) << 8 | ord(self.data[offset])
-                if offset in visited:
-                    raise ValueError("Compression loop in compressed name")
-                visited.add(offset)
-                continue
-            label = self.data[offset: offset+l]
-            offset += l
-            if name == b'':
-                name = label
-            else:
-                name = name + b'.' + label
-
-
-    @staticmethod
-    def messageFromRawData(id, answer, opCode, auth, trunc, recDes, recAv,
-                           rCode, nqueries, rrhnans, rrhnns, rrhnadd):
-        m = dns.Message()
-        m.maxSize = 0
-        m.id, m.answer, m.opCode, m.auth, m.trunc, m.recDes, m.recAv, m.rCode = (
-            id, answer, opCode, auth, trunc, recDes, recAv, rCode)
-        # by default nqueries, rrhnans... would be '' when matches nothing
-        # we should fix it in parsley instead of here
-        m.queries = nqueries or []
-        m.answers = rrhnans or []
-        m.authority = rrhnns or []
-        m.additional = rrhnadd or []
-        return m
-
-
-    @staticmethod
-    def record_AFromRawData(address, ttl=None):
-        record_A = dns.Record_A(ttl=ttl)
-        record_A.address = address
-        return record_A
-
-    @staticmethod
-    def record_A6FromRawData(ttl, prefixLen, suffix, prefix):
-        record_A6 = dns.Record_A6(ttl=ttl, prefixLen=prefixLen)
-        record_A6.bytes = int((128 - prefixLen) / 8.0)
-        if record_A6.bytes:
-            record_A6.suffix = suffix
-        if record_A6.prefixLen:
-            record_A6.prefix = prefix
-        return record_A6
-
-
-    @staticmethod
-    def record_AAAAFromRawData(address, ttl):
-        record_AAAA = dns.Record_AAAA(ttl=ttl)
-        record_AAAA.address = address
-        return record_AAAA
-
-
-    @staticmethod
-    def record_WKSFromRawData(address, protocol, map, ttl):
-        record_WKS = dns.Record_WKS(protocol=protocol, map=map, ttl=ttl)
-        record_WKS.address = address
-        return record_WKS
-
-
-    def __getattr__(self, item):
-        """
-        @param item: item is the rule to be invoked.
-        """
-        return getattr(self.parser, item)
-
-
-    # a helper
-    def showArgs(self, *args, **kwargs):
-        print(args, kwargs)
-
+from parseproto.dns.sansio import DNSParser, DNSStreamParser
 
 
 class DNSDatagramProtocol(dns.DNSMixin, protocol.DatagramProtocol):
@@ -188,10 +63,20 @@ class DNSDatagramProtocol(dns.DNSMixin, protocol.DatagramProtocol):
         """
         Read a datagram, extract the message in it and trigger the associated
         Deferred.
+
+        The records of the message are only decoded once it is known to be
+        delivered: an answer to a query which was sent again is dropped
+        unread.  A truncated message is delivered undecoded, since the query
+        is sent again over TCP: the records which fit in it are decoded when
+        first read, and its sections are empty if they cannot be.
         """
-        self.parser.updateData(data)
+        from ometa.runtime import ParseError
         try:
-            m = self.parser.message()
+            m = self.parser.parseMessage(data, lazy=True)
+            if m.id not in self.liveMessages and m.id in self.resends:
+                return
+            if not m.trunc:
+                m.decodeRecords()
         except ParseError:
             log.msg("Encountered ParseError from %s" % (addr,))
             return
@@ -209,8 +94,7 @@ class DNSDatagramProtocol(dns.DNSMixin, protocol.DatagramProtocol):
             except:
                 log.err()
         else:
-            if m.id not in self.resends:
-                self.controller.messageReceived(m, self, addr)
+            self.controller.messageReceived(m, self, addr)
 
 
     def removeResend(self, id):
@@ -252,12 +136,10 @@ class DNSDatagramProtocol(dns.DNSMixin, protocol.DatagramProtocol):
         return self._query(queries, timeout, id, writeMessage)
 
 
-class DNSProtocol(dns.DNSMixin, protocol.Protocol):
+class DNSProtocol(dns.DNSMixin, DNSStreamParser, protocol.Protocol):
     """
     DNS protocol over TCP.
     """
-    length = None
-    buffer = b''
 
 
     def __init__(self, *args, **kwargs):
@@ -290,36 +172,19 @@ class DNSProtocol(dns.DNSMixin, protocol.Protocol):
         self.controller.connectionLost(self)
 
 
-    def dataReceived(self, data):
-        self.buffer += data
-
-        while self.buffer:
-            if self.length is None and len(self.buffer) >= 2:
-                self.length = struct.unpack('!H', self.buffer[:2])[0]
-                self.buffer = self.buffer[2:]
-
-            if len(self.buffer) >= self.length:
-                myChunk = self.buffer[:self.length]
-                self.parser.updateData(myChunk)
-                m = self.parser.message()
-
-                try:
-                    d, canceller = self.liveMessages[m.id]
-                except KeyError:
-                    self.controller.messageReceived(m, self)
-                else:
-                    del self.liveMessages[m.id]
-                    canceller.cancel()
-                    # XXX we shouldn't need this hack
-                    try:
-                        d.callback(m)
-                    except:
-                        log.err()
-
-                self.buffer = self.buffer[self.length:]
-                self.length = None
-            else:
-                break
+    def messageReceived(self, m):
+        try:
+            d, canceller = self.liveMessages[m.id]
+        except KeyError:
+            self.controller.messageReceived(m, self)
+        else:
+            del self.liveMessages[m.id]
+            canceller.cancel()
+            # XXX we shouldn't need this hack
+            try:
+                d.callback(m)
+            except:
+                log.err()
 
 
     def query(self, queries, timeout=60):
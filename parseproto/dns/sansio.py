@@ -0,0 +1,384 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Sans-I/O parsers of DNS messages, sent as datagrams or over a stream.
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+from struct import Struct
+
+# Twisted imports
+from twisted.names import dns
+
+# Parseproto
+import parseproto.dns
+from parseproto.basic.sansio import Int16StringParser
+from parseproto.dns.wire import LazyMessage, decodeMessage, decompressName
+
+
+
+class MessageReceived(namedtuple('MessageReceived', 'message')):
+    """
+    A DNS message was received.
+
+    @type message: L{dns.Message}
+    """
+    __slots__ = ()
+
+
+
+# The counts of the sections of a message, after its id and flags.
+_sectionCounts = Struct('!4H')
+
+# The size of the smallest question, and of the smallest resource record: both
+# begin with a name, of at least one byte.
+_MIN_QUERY_SIZE = 5
+_MIN_RR_SIZE = 11
+
+
+
+# The rule of the DNS grammar reading the payload of each type of record, and
+# the arguments it takes before the TTL of the record and the size of the
+# payload.  The payload of a type missing from QUERY_TYPES is unknown, and the
+# grammar reads that of no other type.
+_payloadRules = {
+    dns.A: ('payloadA', ()),
+    dns.A6: ('payloadA6', ()),
+    dns.AAAA: ('payloadAAAA', ()),
+    dns.AFSDB: ('payloadAFSDB', ()),
+    dns.CNAME: ('payloadName', (dns.Record_CNAME,)),
+    dns.DNAME: ('payloadName', (dns.Record_DNAME,)),
+    dns.HINFO: ('payloadHINFO', ()),
+    dns.MB: ('payloadName', (dns.Record_MB,)),
+    dns.MD: ('payloadName', (dns.Record_MD,)),
+    dns.MF: ('payloadName', (dns.Record_MF,)),
+    dns.MG: ('payloadName', (dns.Record_MG,)),
+    dns.MINFO: ('payloadMINFO', ()),
+    dns.MR: ('payloadName', (dns.Record_MR,)),
+    dns.MX: ('payloadMX', ()),
+    dns.NAPTR: ('payloadNAPTR', ()),
+    dns.NS: ('payloadName', (dns.Record_NS,)),
+    dns.NULL: ('payloadNULL', ()),
+    dns.PTR: ('payloadName', (dns.Record_PTR,)),
+    dns.RP: ('payloadRP', ()),
+    dns.SOA: ('payloadSOA', ()),
+    dns.SPF: ('payloadText', (dns.Record_SPF,)),
+    dns.SRV: ('payloadSRV', ()),
+    dns.TXT: ('payloadText', (dns.Record_TXT,)),
+    dns.WKS: ('payloadWKS', ()),
+}
+
+_unknownPayload = ('payloadUnknown', ())
+
+
+
+# The names bound in the DNS grammar, and the parser class generated from it,
+# shared by every DNSParser.  Both are built on first use, so that importing
+# this module does not import Parsley.
+_bindings = None
+_grammar = None
+
+
+
+def _getGrammar():
+    """
+    Get the parser class of the DNS grammar, building it on first use.
+
+    @return: The class, wrapped by L{parsley.wrapGrammar}.
+    """
+    global _bindings, _grammar
+    if _grammar is None:
+        from ometa.runtime import OMetaBase
+        from parsley import wrapGrammar
+        from parseproto.util.grammar import getParserClass
+
+        class DNSGrammarBase(OMetaBase):
+            """
+            The base of the parser class of the DNS grammar, whose instances
+            parse one message each.
+
+            @ivar names: The names already read in the message, by offset.
+            """
+            def __init__(self, *args, **kwargs):
+                OMetaBase.__init__(self, *args, **kwargs)
+                self.names = {}
+
+
+            def rule_payload(self, type, ttl, rdl):
+                """
+                Read the payload of a record with the rule of its type in
+                L{_payloadRules}.
+
+                @param type: The type of the record.
+                @param ttl: The TTL of the record.
+                @param rdl: The size of the payload.
+                """
+                rule = _payloadRules.get(type)
+                if rule is None:
+                    if type in dns.QUERY_TYPES:
+                        raise self.input.nullError()
+                    rule = _unknownPayload
+                name, args = rule
+                return self._apply(getattr(self, 'rule_' + name), name,
+                                   args + (ttl, rdl))
+
+        _bindings = DNSParser.setupBindings()
+        _grammar = wrapGrammar(getParserClass(parseproto.dns, "grammar",
+                                              _bindings, DNSGrammarBase))
+    return _grammar
+
+
+
+class DNSParser(object):
+    """
+    A parser of DNS messages.
+
+    All the parsers share the bindings of the grammar and the parser class
+    generated from it, and L{parseMessage} keeps no state in the parser, so
+    that one parser can parse any number of messages at once.
+
+    @cvar debug: Whether a message which cannot be parsed raises the full
+        L{ParseError<ometa.runtime.ParseError>} of OMeta, or whatever else the
+        grammar raised, rather than a L{ParseFailure
+        <parseproto.util.tube.ParseFailure>}.
+
+    @ivar bindings: The shared names bound in the DNS grammar.
+    @ivar grammar: The shared parser class of the DNS grammar.
+    @ivar data: The data given to L{updateData}.
+    @ivar parser: The parser of C{data}, whose rules are also reachable as
+        attributes of this parser.
+    """
+    debug = False
+
+    def __init__(self, *args, **kwargs):
+        self.grammar = _getGrammar()
+        self.bindings = _bindings
+
+
+    def updateData(self, data=b''):
+        self.data = data
+        self.parser = self.grammar(data)
+
+
+    @classmethod
+    def setupBindings(cls):
+        """
+        Build the names bound in the DNS grammar.
+
+        @return: A C{dict} of the names.
+        """
+        bindings = {}
+        items = list(dns.__dict__)
+        for record in [x for x in items if x.startswith('Record_')]:
+            recordType = getattr(dns, record)
+            bindings[record[len('Record_'):]] = recordType
+        bindings['UnknownRecord'] = dns.UnknownRecord
+        bindings['Query'] = dns.Query
+        bindings['RRHeader'] = dns.RRHeader
+        # some trivial settings as we cannot modify twisted.names.dns
+        bindings['A'] = cls.record_AFromRawData
+        bindings['A6'] = cls.record_A6FromRawData
+        bindings['AAAA'] = cls.record_AAAAFromRawData
+        bindings['WKS'] = cls.record_WKSFromRawData
+        bindings['Message'] = cls.messageFromRawData
+        bindings['Name'] = cls.nameFromRawData
+        return bindings
+
+
+    @staticmethod
+    def nameFromRawData(labels, offset=None, data=None, names=None):
+        """
+        Build a name from its labels, and from the compressed name they are
+        followed by, if any.
+
+        @param labels: The labels read before the end of the name.
+        @param offset: The offset in C{data} of the compressed rest of the
+            name, if any.
+        @param data: The whole message the name was read from.
+        @param names: The names already read in C{data}, by offset, as
+            L{decompressName<parseproto.dns.wire.decompressName>} remembers
+            them.
+
+        @rtype: L{dns.Name}
+        @raise ValueError: If the compressed name points back into itself.
+        @raise IndexError: If the compressed name points out of C{data}.
+        """
+        name = b'.'.join(labels)
+        if offset is None:
+            return dns.Name(name=name)
+        rest = decompressName(data, offset, {} if names is None else names)
+        if name and rest:
+            return dns.Name(name + b'.' + rest)
+        return dns.Name(name or rest)
+
+
+    @staticmethod
+    def messageFromRawData(id, answer, opCode, auth, trunc, recDes, recAv,
+                           rCode, nqueries, rrhnans, rrhnns, rrhnadd):
+        m = dns.Message()
+        m.maxSize = 0
+        m.id, m.answer, m.opCode, m.auth, m.trunc, m.recDes, m.recAv, m.rCode = (
+            id, answer, opCode, auth, trunc, recDes, recAv, rCode)
+        # by default nqueries, rrhnans... would be '' when matches nothing
+        # we should fix it in parsley instead of here
+        m.queries = nqueries or []
+        m.answers = rrhnans or []
+        m.authority = rrhnns or []
+        m.additional = rrhnadd or []
+        return m
+
+
+    @staticmethod
+    def record_AFromRawData(address, ttl=None):
+        record_A = dns.Record_A(ttl=ttl)
+        record_A.address = address
+        return record_A
+
+    @staticmethod
+    def record_A6FromRawData(ttl, prefixLen, suffix, prefix):
+        record_A6 = dns.Record_A6(ttl=ttl, prefixLen=prefixLen)
+        record_A6.bytes = int((128 - prefixLen) / 8.0)
+        if record_A6.bytes:
+            record_A6.suffix = suffix
+        if record_A6.prefixLen:
+            record_A6.prefix = prefix
+        return record_A6
+
+
+    @staticmethod
+    def record_AAAAFromRawData(address, ttl):
+        record_AAAA = dns.Record_AAAA(ttl=ttl)
+        record_AAAA.address = address
+        return record_AAAA
+
+
+    @staticmethod
+    def record_WKSFromRawData(address, protocol, map, ttl):
+        record_WKS = dns.Record_WKS(protocol=protocol, map=map, ttl=ttl)
+        record_WKS.address = address
+        return record_WKS
+
+
+    def message(self):
+        """
+        Parse the data given to L{updateData} as a DNS message.
+
+        @see: L{parseMessage}
+        """
+        return self._message(self.data, self.parser)
+
+
+    def parseMessage(self, data, lazy=False):
+        """
+        Parse a DNS message, leaving the data of this parser alone.
+
+        Unless debugging, a message whose header counts more records than the
+        data can hold is rejected before being parsed, and a message which
+        L{decodeMessage<parseproto.dns.wire.decodeMessage>} decodes is not
+        parsed by the grammar.
+
+        @param data: The message.
+        @param lazy: Whether to only decode the header and the queries of the
+            message at once, leaving its records to be decoded when they are
+            first read.
+
+        @rtype: L{dns.Message}, or a L{LazyMessage
+            <parseproto.dns.wire.LazyMessage>} if C{lazy} is set.
+        @raise ometa.runtime.ParseError: If the data is not a DNS message: a
+            L{ParseFailure<parseproto.util.tube.ParseFailure>} at the offset
+            of the data where parsing failed, unless debugging.  If C{lazy}
+            is set, only what is decoded at once is checked: the records are
+            checked when decoded.
+        """
+        if lazy:
+            return LazyMessage(data, self._message, not self.debug)
+        return self._message(data)
+
+
+    def _message(self, data, parser=None):
+        """
+        Parse a DNS message, with the parser of its data if there is one
+        already.
+        """
+        if self.debug:
+            if parser is None:
+                parser = self.grammar(data)
+            return parser.message()
+        from ometa.runtime import ParseError
+        from parseproto.util.tube import ParseFailure
+        if len(data) >= 12:
+            nq, nans, nns, nadd = _sectionCounts.unpack_from(data, 4)
+            if (12 + nq * _MIN_QUERY_SIZE + (nans + nns + nadd) * _MIN_RR_SIZE
+                    > len(data)):
+                raise ParseFailure(4, 'message')
+        message = decodeMessage(data)
+        if message is not None:
+            return message
+        if parser is None:
+            parser = self.grammar(data)
+        try:
+            return parser.message()
+        except ParseError as e:
+            raise ParseFailure(e.position, 'message')
+        except (IndexError, ValueError):
+            # A compressed name pointing out of the message, or in a loop.
+            raise ParseFailure(
+                int(parser._grammar.input.position.real), 'message')
+
+
+    def __getattr__(self, item):
+        """
+        @param item: item is the rule to be invoked.
+        """
+        return getattr(self.parser, item)
+
+
+    # a helper
+    def showArgs(self, *args, **kwargs):
+        print(args, kwargs)
+
+
+
+class DNSDatagramParser(object):
+    """
+    A parser of DNS messages sent as datagrams, one message per datagram.
+    """
+
+    def __init__(self):
+        self.parser = DNSParser()
+
+
+    def feed(self, datagram):
+        """
+        Parse a datagram.
+
+        @raise ometa.runtime.ParseError: If the datagram is not a DNS message.
+
+        @return: The L{MessageReceived} event of the message in the datagram.
+        @rtype: C{list}
+        """
+        return [MessageReceived(self.parser.parseMessage(datagram))]
+
+
+
+class DNSStreamParser(Int16StringParser):
+    """
+    A parser of DNS messages sent over a stream, each prefixed by its 16-bit
+    length.
+    """
+    MAX_LENGTH = 2 ** 16
+
+    def __init__(self):
+        self.parser = DNSParser()
+
+
+    def stringReceived(self, string):
+        self.messageReceived(self.parser.parseMessage(string))
+
+
+    def messageReceived(self, message):
+        self.eventReceived(MessageReceived(message))
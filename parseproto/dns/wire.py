@@ -0,0 +1,498 @@
+# -*- test-case-name: parseproto.test.test_dns -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+A decoder of the DNS messages most resolvers receive, which does not go
+through the grammar.
+
+It decodes the header and the records of the usual types with L{struct},
+and builds the same L{dns.Message} as the grammar does.  Anything else, from
+a record of another type to a malformed message, is left to the grammar, so
+that the two never disagree on what a message holds or on how it is
+rejected.
+"""
+
+from __future__ import absolute_import
+
+import struct
+from struct import Struct
+
+# Twisted imports
+from twisted.names import dns
+from twisted.python import log
+
+
+
+_header = Struct('!H2B4H')
+_sections = Struct('!3H')
+_queryFields = Struct('!2H')
+_rrFields = Struct('!2HIH')
+_short = Struct('!H')
+_srvFields = Struct('!3H')
+_soaFields = Struct('!5I')
+
+# The fields of a message, which Message.compareAttributes does not list on
+# every release of Twisted the package supports.
+_messageFields = ('id', 'answer', 'opCode', 'auth', 'trunc', 'recDes',
+                  'recAv', 'rCode', 'maxSize', 'queries', 'answers',
+                  'authority', 'additional')
+
+# The value of a byte of a message, which indexing the message gives on
+# Python 3.
+if bytes is str:
+    _octet = ord
+else:
+    def _octet(value):
+        return value
+
+
+
+class _Unsupported(Exception):
+    """
+    The message holds something only the grammar decodes.
+    """
+
+
+
+def decompressName(data, offset, names):
+    """
+    Read the name a compression pointer points to, as
+    L{DNSParser.nameFromRawData
+    <parseproto.dns.sansio.DNSParser.nameFromRawData>} reads it.
+
+    The name read from the offset of each label on the way is remembered in
+    C{names}, so that the suffixes the names of a message share are only read
+    once.
+
+    @param data: The message.
+    @param offset: The offset the pointer points to.
+    @param names: The names already read in C{data}, by offset.
+    @type names: C{dict}
+
+    @return: The name.
+    @rtype: C{bytes}
+    @raise ValueError: If the name points back into itself.
+    @raise IndexError: If the name points out of C{data}.
+    """
+    name = names.get(offset)
+    if name is not None:
+        return name
+    visited = set([offset])
+    # The offsets of the labels and pointers read, and the labels.
+    labels = []
+    while 1:
+        name = names.get(offset)
+        if name is not None:
+            break
+        l = _octet(data[offset])
+        if l == 0:
+            name = names[offset] = b''
+            break
+        if (l >> 6) == 3:
+            labels.append((offset, None))
+            offset = (l & 63) << 8 | _octet(data[offset + 1])
+            if offset in visited:
+                raise ValueError("Compression loop in compressed name")
+            visited.add(offset)
+            continue
+        labels.append((offset, data[offset + 1:offset + 1 + l]))
+        offset += 1 + l
+    for start, label in reversed(labels):
+        if label is not None:
+            name = label + b'.' + name if name else label
+        names[start] = name
+    return name
+
+
+
+def _readName(data, offset, names):
+    """
+    Read a name.
+
+    @param names: The names already read in C{data}, by offset.
+
+    @return: The name, and the offset following it.
+    @raise _Unsupported: If the grammar would not read it.
+    """
+    labels = []
+    while 1:
+        l = _octet(data[offset])
+        if l == 0:
+            return b'.'.join(labels), offset + 1
+        if l < 64:
+            start = offset + 1
+            offset = start + l
+            if offset > len(data):
+                raise _Unsupported()
+            labels.append(data[start:offset])
+        elif (l >> 6) == 3:
+            pointer = (l & 63) << 8 | _octet(data[offset + 1])
+            name = names.get(pointer)
+            if name is None:
+                name = decompressName(data, pointer, names)
+            if labels:
+                if name:
+                    labels.append(name)
+                name = b'.'.join(labels)
+            return name, offset + 2
+        else:
+            raise _Unsupported()
+
+
+
+def _decodeAddress(recordType, size):
+    """
+    Make a decoder of the records of an address type.
+
+    @param recordType: The record class.
+    @param size: The size of the address.
+    """
+    def decode(data, offset, end, ttl, names):
+        if end - offset != size:
+            raise _Unsupported()
+        record = recordType(ttl=ttl)
+        record.address = data[offset:end]
+        return record, end
+    return decode
+
+
+
+def _decodeName(recordType):
+    """
+    Make a decoder of the records of a type holding one name.
+
+    @param recordType: The record class.
+    """
+    def decode(data, offset, end, ttl, names):
+        name, offset = _readName(data, offset, names)
+        return recordType(ttl=ttl, name=name), offset
+    return decode
+
+
+
+def _decodeMX(data, offset, end, ttl, names):
+    preference, = _short.unpack_from(data, offset)
+    name, offset = _readName(data, offset + 2, names)
+    return dns.Record_MX(ttl=ttl, preference=preference, name=name), offset
+
+
+
+def _decodeSOA(data, offset, end, ttl, names):
+    mname, offset = _readName(data, offset, names)
+    rname, offset = _readName(data, offset, names)
+    serial, refresh, retry, expire, minimum = _soaFields.unpack_from(
+        data, offset)
+    return dns.Record_SOA(
+        ttl=ttl, mname=mname, rname=rname, serial=serial, refresh=refresh,
+        retry=retry, expire=expire, minimum=minimum), offset + 20
+
+
+
+def _decodeSRV(data, offset, end, ttl, names):
+    priority, weight, port = _srvFields.unpack_from(data, offset)
+    target, offset = _readName(data, offset + 6, names)
+    return dns.Record_SRV(ttl=ttl, priority=priority, weight=weight,
+                          port=port, target=target), offset
+
+
+
+def _decodeTXT(data, offset, end, ttl, names):
+    strings = []
+    while offset < end:
+        start = offset + 1
+        offset = start + _octet(data[offset])
+        strings.append(data[start:offset])
+    return dns.Record_TXT(*strings, ttl=ttl), offset
+
+
+
+# The decoders of the payloads of the usual record types.  Each is called with
+# the message, the offsets of the payload and of its end, the TTL of the record
+# and the names already read in the message, and returns the record and the
+# offset following it.
+_payloadDecoders = {
+    dns.A: _decodeAddress(dns.Record_A, 4),
+    dns.AAAA: _decodeAddress(dns.Record_AAAA, 16),
+    dns.CNAME: _decodeName(dns.Record_CNAME),
+    dns.MX: _decodeMX,
+    dns.NS: _decodeName(dns.Record_NS),
+    dns.PTR: _decodeName(dns.Record_PTR),
+    dns.SOA: _decodeSOA,
+    dns.SRV: _decodeSRV,
+    dns.TXT: _decodeTXT,
+}
+
+
+
+def _decodeRecords(data, offset, count, auth, records, names):
+    """
+    Decode the records of a section.
+
+    @param records: The list the records are appended to.
+    @param names: The names already read in C{data}, by offset.
+
+    @return: The offset following the records.
+    """
+    for i in range(count):
+        name, offset = _readName(data, offset, names)
+        type, cls, ttl, rdlength = _rrFields.unpack_from(data, offset)
+        offset += 10
+        decode = _payloadDecoders.get(type)
+        if decode is None:
+            raise _Unsupported()
+        end = offset + rdlength
+        payload, offset = decode(data, offset, end, ttl, names)
+        # The grammar reads what the type calls for, whatever rdlength says.
+        if offset != end:
+            raise _Unsupported()
+        records.append(dns.RRHeader(name, type, cls, ttl, payload, auth))
+    return offset
+
+
+
+def _skipName(data, offset):
+    """
+    Skip a name, without following its pointer.
+
+    @return: The offset following the name.
+    @raise _Unsupported: If the grammar would not read it.
+    """
+    while 1:
+        l = _octet(data[offset])
+        if l == 0:
+            return offset + 1
+        if l < 64:
+            offset += 1 + l
+        elif (l >> 6) == 3:
+            return offset + 2
+        else:
+            raise _Unsupported()
+
+
+
+def _skipRecords(data, offset, counts, truncated):
+    """
+    Find the records of each section, without decoding them.
+
+    @param offset: The offset of the first record.
+    @param counts: The numbers of records of the sections, from the header.
+    @param truncated: Whether the message is truncated, and only holds the
+        records which fit in it.  The first record which does not fit, and
+        the records following it, are left out, as L{dns.Message.fromStr}
+        leaves them out.
+
+    @return: The offset and the number of the records of each section, and
+        the offset following the last record.
+    @raise _Unsupported: If a record does not fit in a message which is not
+        truncated, or is followed by trailing data.
+    """
+    spans = []
+    for count in counts:
+        start = offset
+        for i in range(count):
+            try:
+                end = _skipName(data, offset)
+                rdlength, = _short.unpack_from(data, end + 8)
+            except (IndexError, struct.error):
+                end = len(data) + 1
+            else:
+                end += 10 + rdlength
+            if end > len(data):
+                if not truncated:
+                    raise _Unsupported()
+                spans.append((start, i))
+                spans.extend([(offset, 0)] * (len(counts) - len(spans)))
+                return spans, offset
+            offset = end
+        spans.append((start, count))
+    if offset != len(data) and not truncated:
+        raise _Unsupported()
+    return spans, offset
+
+
+
+def _decodeHeader(m, data, names):
+    """
+    Decode the header and the queries of a message.
+
+    @param m: The L{dns.Message} they are decoded into.
+    @param names: The names already read in C{data}, by offset.
+
+    @return: The offset following the queries, and the numbers of answers,
+        authority records and additional records from the header.
+    """
+    (id, byte3, byte4,
+     nqueries, nans, nns, nadd) = _header.unpack_from(data)
+    m.maxSize = 0
+    m.id = id
+    m.answer = byte3 >> 7 & 1
+    # Like the grammar, only read the lowest bit of the opcode.
+    m.opCode = byte3 >> 3 & 1
+    m.auth = byte3 >> 2 & 1
+    m.trunc = byte3 >> 1 & 1
+    m.recDes = byte3 & 1
+    m.recAv = byte4 >> 7 & 1
+    m.rCode = byte4 & 0xf
+    offset = 12
+    queries = m.queries = []
+    for i in range(nqueries):
+        name, offset = _readName(data, offset, names)
+        type, cls = _queryFields.unpack_from(data, offset)
+        offset += 4
+        queries.append(dns.Query(name, type, cls))
+    return offset, (nans, nns, nadd)
+
+
+
+def decodeMessage(data):
+    """
+    Decode a DNS message holding only queries, and records of the types
+    A, AAAA, CNAME, MX, NS, PTR, SOA, SRV and TXT.
+
+    @param data: The message.
+    @type data: C{bytes}
+
+    @return: The message, as the grammar decodes it, or C{None} if the
+        message holds anything else or is malformed, for the grammar to
+        decode or reject.
+    @rtype: L{dns.Message}
+    """
+    m = dns.Message()
+    names = {}
+    try:
+        offset, counts = _decodeHeader(m, data, names)
+        m.answers, m.authority, m.additional = sections = [], [], []
+        for records, count in zip(sections, counts):
+            offset = _decodeRecords(data, offset, count, m.auth, records,
+                                    names)
+    except (_Unsupported, IndexError, ValueError, struct.error):
+        return None
+    if offset != len(data):
+        return None
+    return m
+
+
+
+def _section(name):
+    """
+    Make the property of a section of a L{LazyMessage}, whose records are
+    decoded when it is first read or set.
+
+    @param name: The name of the attribute holding the records once decoded.
+    """
+    def get(self):
+        if self._spans is not None:
+            self._decodeSections()
+        return getattr(self, name)
+
+    def set(self, records):
+        if self._spans is not None:
+            self._decodeSections()
+        setattr(self, name, records)
+
+    return property(get, set)
+
+
+
+class LazyMessage(dns.Message, object):
+    """
+    A DNS message whose header and queries are decoded at once, and whose
+    records are decoded when first read.
+
+    Its sections are properties, which L{dns.Message}, an old-style class on
+    Python 2, only supports through C{object} as a base.
+
+    Until then, its records are only skipped over, to find the sections in
+    the message.  A message with the C{trunc} bit set only holds the records
+    which fit in it, as L{dns.Message.fromStr} decodes it.
+
+    Reading or setting a section of a message whose records are not decoded
+    yet decodes them, and leaves every section empty if they cannot be, as
+    a truncated answer's may not: call L{decodeRecords} first to reject such
+    a message instead.
+
+    @ivar _data: The message, or, if it is truncated, as much of it as holds
+        whole records, with the counts of its header changed to match.
+    @ivar _parse: The function decoding messages that L{decodeMessage} does
+        not decode.
+    @ivar _spans: The offset and the number of the records of each section,
+        or C{None} once the records are decoded.
+    @ivar _names: The names already read in the message, by offset, until
+        the records are decoded.
+    """
+    answers = _section('_answers')
+    authority = _section('_authority')
+    additional = _section('_additional')
+
+    def __init__(self, data, parse, fast=True):
+        """
+        @param data: The message.
+        @param parse: A function decoding the whole message, used to decode
+            what L{decodeMessage} does not, and raising
+            L{ParseError<ometa.runtime.ParseError>} if it is not a message.
+        @param fast: Whether to decode anything L{decodeMessage} does without
+            calling C{parse}.
+
+        @raise ometa.runtime.ParseError: If the header or the queries of the
+            message cannot be decoded, or, unless it is truncated, its
+            records cannot be found.
+        """
+        self._spans = None
+        dns.Message.__init__(self)
+        self._data = data
+        self._parse = parse
+        self._names = {}
+        if fast:
+            try:
+                offset, counts = _decodeHeader(self, data, self._names)
+                spans, end = _skipRecords(data, offset, counts, self.trunc)
+            except (_Unsupported, IndexError, ValueError, struct.error):
+                pass
+            else:
+                found = [n for start, n in spans]
+                if end != len(data) or found != list(counts):
+                    self._data = (data[:6] + _sections.pack(*found) +
+                                  data[12:end])
+                self._spans = spans
+                return
+        message = parse(data)
+        for name in _messageFields:
+            setattr(self, name, getattr(message, name))
+
+
+    def decodeRecords(self):
+        """
+        Decode the records of the message, unless they are already.
+
+        @raise ometa.runtime.ParseError: If they cannot be decoded.
+        """
+        spans = self._spans
+        if spans is None:
+            return
+        data = self._data
+        sections = [], [], []
+        try:
+            for (offset, count), records in zip(spans, sections):
+                _decodeRecords(data, offset, count, self.auth, records,
+                               self._names)
+        except (_Unsupported, IndexError, ValueError, struct.error):
+            message = self._parse(data)
+            sections = message.answers, message.authority, message.additional
+        self._spans = self._names = None
+        self._answers, self._authority, self._additional = sections
+
+
+    def _decodeSections(self):
+        """
+        Decode the records of the message when a section is first read or
+        set, leaving the sections empty if they cannot be decoded.
+        """
+        from ometa.runtime import ParseError
+        try:
+            self.decodeRecords()
+        except ParseError:
+            log.msg("Dropped the malformed records of DNS message %d"
+                    % (self.id,))
+            self._spans = self._names = None
+            self._answers, self._authority, self._additional = [], [], []
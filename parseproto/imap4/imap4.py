@@ -50,7 +50,7 @@ import twisted.cred.credentials
 
 # parseproto import
 import parseproto.basic.protocol as proto_basic
-import parseproto.imap4
+from parseproto.imap4.sansio import IMAP4Parser
 
 # locale-independent month names to use instead of strftime's
 _MONTH_NAMES = dict(zip(
@@ -474,7 +474,8 @@ _nonAtomChars = r'(){%*"\]' + _SP + _CTL
 # This is all the bytes that match the ATOM-CHAR from the grammar in the RFC.
 _atomChars = ''.join(chr(ch) for ch in range(0x100) if chr(ch) not in _nonAtomChars)
 
-class IMAP4Server(proto_basic.LineReceiver, policies.TimeoutMixin):
+class IMAP4Server(policies.TimeoutMixin, IMAP4Parser,
+                  proto_basic.LineReceiver):
     """
     Protocol implementation for an IMAP4rev1 server.
 
@@ -533,10 +534,6 @@ class IMAP4Server(proto_basic.LineReceiver, policies.TimeoutMixin):
 
     parseState = 'command'
 
-    _parsleyGrammarPKG = parseproto.imap4
-
-    _parsleyGrammarName = 'imap4'
-
     def __init__(self, chal = None, contextFactory = None, scheduler = None):
         if chal is None:
             chal = {}
@@ -947,17 +944,17 @@ class IMAP4Server(proto_basic.LineReceiver, policies.TimeoutMixin):
             self.sendLine('+')
 
     def _respond(self, state, tag, message):
+        lines = []
         if state in ('OK', 'NO', 'BAD') and self._queuedAsync:
-            lines = self._queuedAsync
+            lines.extend(['* ' + msg for msg in self._queuedAsync])
             self._queuedAsync = []
-            for msg in lines:
-                self._respond(msg, None, None)
         if not tag:
             tag = '*'
         if message:
-            self.sendLine(' '.join((tag, state, message)))
+            lines.append(' '.join((tag, state, message)))
         else:
-            self.sendLine(' '.join((tag, state)))
+            lines.append(' '.join((tag, state)))
+        self.sendLines(lines)
 
     def listCapabilities(self):
         caps = ['IMAP4rev1']
@@ -1452,8 +1449,7 @@ class IMAP4Server(proto_basic.LineReceiver, policies.TimeoutMixin):
     select_EXPUNGE = (do_EXPUNGE,)
 
     def __cbExpunge(self, result, tag):
-        for e in result:
-            self.sendUntaggedResponse('%d EXPUNGE' % e)
+        self.sendLines(['* %d EXPUNGE' % e for e in result])
         self.sendPositiveResponse(tag, 'EXPUNGE completed')
 
     def __ebExpunge(self, failure, tag):
@@ -0,0 +1,120 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+"""
+A sans-I/O parser of the commands an IMAP4 client sends.
+"""
+
+from __future__ import absolute_import
+
+import re
+from collections import namedtuple
+
+import parseproto.imap4
+from parseproto.basic.sansio import LineParser
+
+
+# A line ending with a literal: the literal is sent after the line.
+_literalPattern = re.compile(br'\{(\d+)\+?\}$')
+
+
+
+class CommandReceived(namedtuple('CommandReceived', 'tag command rest')):
+    """
+    A command was received.
+
+    @ivar tag: The tag of the command.
+    @ivar command: The name of the command, in upper case.
+    @ivar rest: The arguments of the command, up to the end of the line.
+    """
+    __slots__ = ()
+
+
+
+class LiteralReceived(namedtuple('LiteralReceived', 'data')):
+    """
+    A literal announced at the end of the previous line was received.
+    """
+    __slots__ = ()
+
+
+
+class ContinuationReceived(namedtuple('ContinuationReceived', 'line')):
+    """
+    A line continuing a command was received: the rest of the command after a
+    literal, or the line ending an C{IDLE} command.
+    """
+    __slots__ = ()
+
+
+
+class IMAP4Parser(LineParser):
+    """
+    A parser of the commands of an IMAP4 session.
+
+    The literals announced at the end of a line, as C{{<size>}} or as
+    C{{<size>+}}, are read as L{LiteralReceived} events whether the server
+    would have accepted them or not.
+
+    @ivar parseState: C{'command'}, C{'pending'} after a literal, or
+        C{'idle'} after an C{IDLE} command.
+    """
+    _parsleyGrammarPKG = parseproto.imap4
+    _parsleyGrammarName = 'imap4'
+    parseState = 'command'
+    blocked = None
+    _literal = None
+    _literalSize = 0
+
+    def resetTimeout(self):
+        pass
+
+
+    def parse_command(self, tag, cmd, rest):
+        cmd = cmd.upper()
+        self.eventReceived(CommandReceived(tag, cmd, rest))
+        if cmd == b'IDLE':
+            self.parseState = 'idle'
+        else:
+            self._literalFollows(rest)
+
+
+    def parse_pending(self, line):
+        self.parseState = 'command'
+        self.eventReceived(ContinuationReceived(line))
+        self._literalFollows(line)
+
+
+    def parse_idle(self, line):
+        self.parseState = 'command'
+        self.eventReceived(ContinuationReceived(line))
+
+
+    def _literalFollows(self, line):
+        """
+        Read the literal announced at the end of C{line}, if any, and parse
+        the line which follows as the rest of the command.
+        """
+        match = _literalPattern.search(line)
+        if match is None:
+            return
+        self.parseState = 'pending'
+        self._literalSize = int(match.group(1))
+        self._literal = []
+        if self._literalSize:
+            self.setRawMode()
+        else:
+            self._literal = None
+            self.eventReceived(LiteralReceived(b''))
+
+
+    def rawDataReceived(self, data):
+        self._literalSize -= len(data)
+        if self._literalSize > 0:
+            self._literal.append(data)
+            return
+        passon = b''
+        if self._literalSize:
+            data, passon = data[:self._literalSize], data[self._literalSize:]
+        self._literal.append(data)
+        literal, self._literal = b''.join(self._literal), None
+        self.eventReceived(LiteralReceived(literal))
+        self.setLineMode(passon)
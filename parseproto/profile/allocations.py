@@ -0,0 +1,104 @@
+"""
+Compare the per-line cost of Parsley's TrampolinedParser, which builds a new
+interpreter and copies the unparsed input after every rule, with the
+rewinding parser of parseproto.util.tube.
+
+    python parseproto/profile/allocations.py [LINES]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ometa import interp, tube as ometa_tube
+
+import parseproto.basic
+from parseproto.util import tube
+from parseproto.util.grammar import getGrammar
+
+
+class Counters(object):
+    interpreters = 0
+    bytesFed = 0
+
+
+def count():
+    """
+    Count interpreters built and bytes fed to them.
+    """
+    originalInit = interp.TrampolinedGrammarInterpreter.__init__
+    originalReceive = interp.TrampolinedGrammarInterpreter.receive
+    originalRewindableInit = tube._RewindableInterpreter.__init__
+    originalFeed = tube._RewindableInterpreter.feed
+
+    def init(self, *a, **kw):
+        Counters.interpreters += 1
+        originalInit(self, *a, **kw)
+
+    def receive(self, buf):
+        Counters.bytesFed += len(buf)
+        return originalReceive(self, buf)
+
+    def rewindableInit(self, *a, **kw):
+        Counters.interpreters += 1
+        originalRewindableInit(self, *a, **kw)
+
+    def feed(self, data):
+        Counters.bytesFed += len(data)
+        originalFeed(self, data)
+
+    interp.TrampolinedGrammarInterpreter.__init__ = init
+    interp.TrampolinedGrammarInterpreter.receive = receive
+    tube._RewindableInterpreter.__init__ = rewindableInit
+    tube._RewindableInterpreter.feed = feed
+
+
+class Receiver(object):
+    MAX_LENGTH = 16384
+    currentRule = 'initial'
+
+    def __init__(self):
+        self.lines = 0
+
+    def lineReceived(self, line):
+        self.lines += 1
+
+
+def run(parserClass, lines, chunkSize=65536):
+    grammar = getGrammar(parseproto.basic, 'line_only_receiver')
+    data = b''.join(b'line %d of the log\r\n' % (i,) for i in range(lines))
+    receiver = Receiver()
+    Counters.interpreters = Counters.bytesFed = 0
+    blocks = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    parser = parserClass(grammar, receiver, {})
+    for i in range(0, len(data), chunkSize):
+        parser.receive(data[i:i + chunkSize])
+    elapsed = time.time() - start
+    if tracemalloc is not None:
+        blocks = sum(stat.count for stat in
+                     tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+    assert receiver.lines == lines
+    print("%-30s %8.1f us/line %6.2f interpreters/line "
+          "%8.1f bytes fed/line%s" % (
+              parserClass.__module__ + '.' + parserClass.__name__,
+              elapsed / lines * 1e6,
+              Counters.interpreters / float(lines),
+              Counters.bytesFed / float(lines),
+              '' if blocks is None else
+              ' %6.1f live blocks/line' % (blocks / float(lines),)))
+
+
+if __name__ == '__main__':
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    count()
+    run(ometa_tube.TrampolinedParser, lines)
+    run(tube.TrampolinedParser, lines)
@@ -0,0 +1,716 @@
+"""
+Benchmark the protocols of parseproto against their Twisted counterparts.
+
+Every protocol is fed the same stream of messages, split into chunks of 1
+byte, of an Ethernet MTU and of 64 KiB, and the throughput, the time per
+message and, when tracemalloc is available, the memory allocated per message
+are measured.  DNS messages are datagrams and are parsed whole.
+
+The sans-I/O parsers the protocols of parseproto are built on are measured
+too, as the C{sansio} implementation: the difference with C{parseproto} is the
+overhead of the Twisted adapters.  Where asyncio is available, they are also
+measured behind L{parseproto.util.aio.BufferedParserProtocol}, on an event
+loop reading the stream from one end of a socket pair while it is written to
+the other end, a chunk per iteration of the loop: the loop is uvloop's when it
+is installed, and the implementation is named after it.
+
+The Twisted protocols of parseproto for AMP, SMTP and IMAP4, and the DNS
+grammar the C{debug} implementation parses with, run on Python 2 only: on
+Python 3, the rows of the other implementations are measured all the same.
+
+Besides short answers, DNS is fed responses of 60 records whose names share
+their suffixes, as a mail exchanger or a delegation would be answered: the
+C{debug} implementation parses them with the grammar alone.
+
+How fast malformed input is rejected is measured as well, with random bytes
+sent as SMTP command lines, to AMP connections and as DNS datagrams: the
+C{debug} implementation is parseproto with the full parse errors of OMeta.
+
+    python parseproto/profile/benchmark.py [-n MESSAGES] [-o RESULTS.json]
+    python parseproto/profile/benchmark.py --compare OLD.json NEW.json
+
+Results are written as JSON, along with the commit they were measured at, so
+that two runs can be compared with C{--compare}.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import asyncio
+    from parseproto.util import aio
+except ImportError:
+    asyncio = aio = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from twisted.internet import defer
+from twisted.mail import imap4 as twisted_imap4, smtp as twisted_smtp
+from twisted.names import dns
+from twisted.protocols import amp as twisted_amp, basic as twisted_basic
+from twisted.test import proto_helpers
+
+from parseproto.amp import sansio as amp_sansio
+from parseproto.basic import (
+    protocol as parseproto_basic, sansio as basic_sansio)
+from parseproto.dns.protocol import DNSParser
+from parseproto.imap4 import sansio as imap4_sansio
+from parseproto.smtp import sansio as smtp_sansio
+from parseproto.util.tube import TrampolinedParser
+
+if bytes is str:
+    from parseproto.amp import amp as parseproto_amp
+    from parseproto.imap4 import imap4 as parseproto_imap4
+    from parseproto.smtp import smtp as parseproto_smtp
+else:
+    parseproto_amp = parseproto_imap4 = parseproto_smtp = None
+
+
+CHUNK_SIZES = [1, 1500, 65536]
+
+# A DNS message is a datagram, so it is not split into chunks.
+DATAGRAM = 0
+
+# Whether parse errors can be debugged: the DNS grammar runs on Python 2 only,
+# OMeta not parsing bytes on Python 3.
+DEBUGGING = bytes is str
+
+
+
+class Counter(object):
+    """
+    Count the messages a protocol received.
+    """
+    def __init__(self):
+        self.count = 0
+
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+
+def countingReceiver(base, callback):
+    """
+    Make a receiver counting the calls of one of its callbacks.
+    """
+    counter = Counter()
+    protocol = base()
+    setattr(protocol, callback, counter)
+    return protocol, counter
+
+
+
+def lines(n):
+    return b''.join(b'line %d of the stream, long enough for a log\r\n' % (i,)
+                    for i in range(n))
+
+
+
+def lineOnlyReceiver(impl):
+    return countingReceiver(impl.LineOnlyReceiver, 'lineReceived')
+
+
+
+def lineReceiver(impl):
+    return countingReceiver(impl.LineReceiver, 'lineReceived')
+
+
+
+def strings(prefix):
+    def messages(n):
+        return b''.join(struct.pack(prefix, 64) + b'%064d' % (i,)
+                        for i in range(n))
+    return messages
+
+
+
+def intNStringReceiver(name):
+    def make(impl):
+        return countingReceiver(getattr(impl, name), 'stringReceived')
+    return make
+
+
+
+def netstrings(n):
+    return b''.join(b'64:%064d,' % (i,) for i in range(n))
+
+
+
+def netstringReceiver(impl):
+    return countingReceiver(impl.NetstringReceiver, 'stringReceived')
+
+
+
+def boxes(n):
+    return b''.join(twisted_amp.AmpBox({
+        b'_command': b'Sum', b'_ask': b'%d' % (i,),
+        b'a': b'%d' % (i,), b'b': b'42'}).serialize() for i in range(n))
+
+
+
+class BoxCounter(Counter):
+    """
+    A box receiver counting the boxes it receives.
+    """
+    def startReceivingBoxes(self, sender):
+        pass
+
+
+    def stopReceivingBoxes(self, reason):
+        pass
+
+
+    def ampBoxReceived(self, box):
+        self.count += 1
+
+
+
+def binaryBoxProtocol(impl):
+    counter = BoxCounter()
+    return impl.BinaryBoxProtocol(counter), counter
+
+
+
+class DiscardingMessage(object):
+    """
+    A message discarding its lines.
+    """
+    def lineReceived(self, line):
+        pass
+
+
+    def eomReceived(self):
+        return defer.succeed(None)
+
+
+    def connectionLost(self):
+        pass
+
+
+
+class CountingDelivery(Counter):
+    """
+    A message delivery discarding the messages it counts.
+    """
+    def receivedHeader(self, helo, origin, recipients):
+        return None
+
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+
+    def validateTo(self, user):
+        self.count += 1
+        return DiscardingMessage
+
+
+
+def mails(n):
+    mail = (b'MAIL FROM:<alice@example.com>\r\n'
+            b'RCPT TO:<bob@example.com>\r\n'
+            b'DATA\r\n'
+            b'Subject: benchmark\r\n'
+            b'\r\n' +
+            b'A line of the body of the message.\r\n' * 8 +
+            b'.\r\n')
+    return b'HELO example.com\r\n' + mail * n
+
+
+
+def smtpServer(impl):
+    counter = CountingDelivery()
+    server = impl.SMTP(counter)
+    server.timeout = None
+    return server, counter
+
+
+
+def imapCommands(n):
+    return b''.join(b'a%d NOOP\r\n' % (i,) for i in range(n))
+
+
+
+def imapServer(impl):
+    counter = Counter()
+    server = impl.IMAP4Server()
+    server.timeOut = None
+    server.unauth_NOOP = (lambda *args: counter(),)
+    return server, counter
+
+
+
+def dnsMessages(n):
+    message = dns.Message(id=1234, answer=1, recDes=1, recAv=1)
+    message.queries = [dns.Query(b'example.com', dns.A)]
+    message.answers = [
+        dns.RRHeader(b'example.com', dns.A, ttl=60,
+                     payload=dns.Record_A('10.0.0.%d' % (i,), ttl=60))
+        for i in range(4)]
+    return [message.toStr()] * n
+
+
+
+def dnsResponses(n):
+    """
+    Make C{n} responses of 60 records, most names in which are compressed.
+    """
+    message = dns.Message(id=1234, answer=1, recDes=1, recAv=1, maxSize=0)
+    message.queries = [dns.Query(b'example.com', dns.MX)]
+    message.answers = [
+        dns.RRHeader(b'example.com', dns.MX, ttl=300,
+                     payload=dns.Record_MX(10 * i, b'mx%d.mail.example.com'
+                                           % (i,), ttl=300))
+        for i in range(20)]
+    message.authority = [
+        dns.RRHeader(b'example.com', dns.NS, ttl=300,
+                     payload=dns.Record_NS(b'ns%d.dns.example.com' % (i,),
+                                           ttl=300))
+        for i in range(20)]
+    message.additional = [
+        dns.RRHeader(b'%s%d.%s.example.com' % (host, i % 10, domain),
+                     dns.A, ttl=300,
+                     payload=dns.Record_A('10.0.%d.%d' % (i // 10, i % 10),
+                                          ttl=300))
+        for i, (host, domain) in enumerate([(b'mx', b'mail')] * 10 +
+                                           [(b'ns', b'dns')] * 10)]
+    return [message.toStr()] * n
+
+
+
+def parseprotoDNS(datagrams):
+    parser = DNSParser()
+    for datagram in datagrams:
+        parser.parseMessage(datagram)
+
+
+
+def twistedDNS(datagrams):
+    for datagram in datagrams:
+        dns.Message().fromStr(datagram)
+
+
+
+def garbage(n, size):
+    """
+    Make C{n} strings of C{size} random bytes, the same ones on every run.
+    """
+    rng = random.Random(size)
+    return [bytes(bytearray(rng.randrange(256) for i in range(size)))
+            for i in range(n)]
+
+
+
+def garbageLines(n):
+    return b''.join(
+        junk.replace(b'\r', b' ').replace(b'\n', b' ') + b'\r\n'
+        for junk in garbage(n, 60))
+
+
+
+def rejectedCommands(impl, data):
+    """
+    Send garbage command lines to an SMTP server.
+
+    @return: The number of replies to them.
+    """
+    server, counter = smtpServer(impl)
+    transport = proto_helpers.StringTransport()
+    server.makeConnection(transport)
+    greeting = transport.value().count(b'\r\n')
+    for i in range(0, len(data), 1500):
+        server.dataReceived(data[i:i + 1500])
+    return transport.value().count(b'\r\n') - greeting
+
+
+
+def rejectedConnections(impl, data):
+    """
+    Send garbage to AMP connections, a string of it to each.
+
+    @return: The number of connections dropped or failing.
+    """
+    rejected = 0
+    for junk in data:
+        protocol, counter = binaryBoxProtocol(impl)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        try:
+            protocol.dataReceived(junk)
+        except Exception:
+            rejected += 1
+        else:
+            rejected += transport.disconnecting
+    return rejected
+
+
+
+def rejectedDatagrams(impl, data):
+    """
+    Parse garbage datagrams as DNS messages.
+
+    @return: The number of datagrams rejected.
+    """
+    if impl is dns:
+        parse = lambda datagram: dns.Message().fromStr(datagram)
+    else:
+        parser = impl()
+        parse = parser.parseMessage
+    rejected = 0
+    for datagram in data:
+        try:
+            parse(datagram)
+        except Exception:
+            rejected += 1
+    return rejected
+
+
+
+def debugging(run):
+    """
+    Run C{run} with the parsers it creates raising the full parse errors of
+    OMeta.
+    """
+    TrampolinedParser.debug = DNSParser.debug = True
+    try:
+        return run()
+    finally:
+        TrampolinedParser.debug = DNSParser.debug = False
+
+
+
+STREAMS = [
+    ('LineOnlyReceiver', lines, lineOnlyReceiver),
+    ('LineReceiver', lines, lineReceiver),
+    ('Int8StringReceiver', strings('!B'),
+     intNStringReceiver('Int8StringReceiver')),
+    ('Int16StringReceiver', strings('!H'),
+     intNStringReceiver('Int16StringReceiver')),
+    ('Int32StringReceiver', strings('!I'),
+     intNStringReceiver('Int32StringReceiver')),
+    ('NetstringReceiver', netstrings, netstringReceiver),
+    ('BinaryBoxProtocol', boxes, binaryBoxProtocol),
+    ('SMTP', mails, smtpServer),
+    ('IMAP4Server', imapCommands, imapServer),
+]
+
+IMPLEMENTATIONS = {
+    'LineOnlyReceiver': (parseproto_basic, twisted_basic),
+    'LineReceiver': (parseproto_basic, twisted_basic),
+    'Int8StringReceiver': (parseproto_basic, twisted_basic),
+    'Int16StringReceiver': (parseproto_basic, twisted_basic),
+    'Int32StringReceiver': (parseproto_basic, twisted_basic),
+    'NetstringReceiver': (parseproto_basic, twisted_basic),
+    'BinaryBoxProtocol': (parseproto_amp, twisted_amp),
+    'SMTP': (parseproto_smtp, twisted_smtp),
+    'IMAP4Server': (parseproto_imap4, twisted_imap4),
+}
+
+# The garbage sent to each protocol, the size of the chunks it is sent in if it
+# is a stream, the implementations it is sent to and how.
+GARBAGE = [
+    ('garbage SMTP', garbageLines, 1500,
+     (parseproto_smtp, twisted_smtp), rejectedCommands),
+    ('garbage AMP', lambda n: garbage(n, 100), DATAGRAM,
+     (parseproto_amp, twisted_amp), rejectedConnections),
+    ('garbage DNS', lambda n: garbage(n, 60), DATAGRAM,
+     (DNSParser, dns), rejectedDatagrams),
+]
+
+# The sans-I/O parser of every protocol, and the event counted as a message.
+PARSERS = {
+    'LineOnlyReceiver': (basic_sansio.LineOnlyParser,
+                         basic_sansio.LineReceived),
+    'LineReceiver': (basic_sansio.LineParser, basic_sansio.LineReceived),
+    'Int8StringReceiver': (basic_sansio.Int8StringParser,
+                           basic_sansio.StringReceived),
+    'Int16StringReceiver': (basic_sansio.Int16StringParser,
+                            basic_sansio.StringReceived),
+    'Int32StringReceiver': (basic_sansio.Int32StringParser,
+                            basic_sansio.StringReceived),
+    'NetstringReceiver': (basic_sansio.NetstringParser,
+                          basic_sansio.StringReceived),
+    'BinaryBoxProtocol': (amp_sansio.BoxParser, amp_sansio.BoxReceived),
+    'SMTP': (smtp_sansio.SMTPParser, smtp_sansio.DataFinished),
+    'IMAP4Server': (imap4_sansio.IMAP4Parser, imap4_sansio.CommandReceived),
+}
+
+
+
+def timed(run, messages):
+    """
+    Run C{run} and return its timing and allocation figures.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        start = time.time()
+        received = run()
+        elapsed = time.time() - start
+        allocated = None
+        if tracemalloc is not None:
+            allocated = tracemalloc.get_traced_memory()[1] / float(messages)
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+    return received, elapsed, allocated
+
+
+
+def measureStream(makeProtocol, data, chunkSize, messages):
+    protocol, counter = makeProtocol()
+    protocol.makeConnection(proto_helpers.StringTransport())
+    chunks = [data[i:i + chunkSize] for i in range(0, len(data), chunkSize)]
+
+    def run():
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+        return counter.count
+
+    return timed(run, messages)
+
+
+
+def measureParser(parserClass, eventType, data, chunkSize, messages):
+    parser = parserClass()
+    chunks = [data[i:i + chunkSize] for i in range(0, len(data), chunkSize)]
+
+    def run():
+        received = 0
+        for chunk in chunks:
+            for event in parser.feed(chunk):
+                if type(event) is eventType:
+                    received += 1
+        return received
+
+    return timed(run, messages)
+
+
+
+def measureAsyncio(parserClass, eventType, data, chunkSize, messages):
+    """
+    Measure a parser behind an asyncio protocol reading the stream from a
+    socket, the chunks of which are written to the other end of it, one per
+    iteration of the event loop.
+    """
+    loop = (uvloop or asyncio).new_event_loop()
+    done = loop.create_future()
+    counter = Counter()
+
+    class Protocol(aio.BufferedParserProtocol):
+        received = 0
+
+        def eventReceived(self, event):
+            if type(event) is eventType:
+                counter()
+
+
+        def buffer_updated(self, nbytes):
+            aio.BufferedParserProtocol.buffer_updated(self, nbytes)
+            self.received += nbytes
+            if self.received == len(data):
+                done.set_result(counter.count)
+
+
+        def connection_lost(self, exc):
+            aio.BufferedParserProtocol.connection_lost(self, exc)
+            if not done.done():
+                done.set_result(counter.count)
+
+    chunks = [data[i:i + chunkSize] for i in range(0, len(data), chunkSize)]
+    ours, theirs = socket.socketpair()
+    reader = loop.run_until_complete(loop.create_connection(
+        lambda: Protocol(parserClass()), sock=ours))[0]
+    writer = loop.run_until_complete(loop.create_connection(
+        asyncio.Protocol, sock=theirs))[0]
+
+    def send(i):
+        if i < len(chunks):
+            writer.write(chunks[i])
+            loop.call_soon(send, i + 1)
+
+    def run():
+        loop.call_soon(send, 0)
+        return loop.run_until_complete(done)
+
+    try:
+        return timed(run, messages)
+    finally:
+        writer.close()
+        reader.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+
+
+def result(protocol, implementation, chunkSize, messages, size, figures):
+    received, elapsed, allocated = figures
+    elapsed = max(elapsed, 1e-9)
+    return {
+        'protocol': protocol,
+        'implementation': implementation,
+        'chunk_size': chunkSize,
+        'messages': messages,
+        'received': received,
+        'bytes': size,
+        'seconds': elapsed,
+        'messages_per_second': messages / elapsed,
+        'mb_per_second': size / elapsed / 1e6,
+        'us_per_message': elapsed / messages * 1e6,
+        'allocated_bytes_per_message': allocated,
+    }
+
+
+
+def run(messages, chunkSizes=CHUNK_SIZES, report=print):
+    """
+    Run every benchmark.
+
+    @param messages: The number of messages to feed each protocol; a tenth of
+        it when feeding one byte at a time.
+    @return: The list of results.
+    """
+    results = []
+    for name, payload, makeProtocol in STREAMS:
+        for chunkSize in chunkSizes:
+            n = max(1, messages // 10) if chunkSize == 1 else messages
+            data = payload(n)
+            for label, impl in zip(('parseproto', 'twisted'),
+                                   IMPLEMENTATIONS[name]):
+                if impl is None:
+                    continue
+                figures = measureStream(
+                    lambda: makeProtocol(impl), data, chunkSize, n)
+                results.append(result(name, label, chunkSize, n, len(data),
+                                      figures))
+                report(results[-1])
+            parserClass, eventType = PARSERS[name]
+            figures = measureParser(parserClass, eventType, data, chunkSize, n)
+            results.append(result(name, 'sansio', chunkSize, n, len(data),
+                                  figures))
+            report(results[-1])
+            if aio is not None:
+                figures = measureAsyncio(parserClass, eventType, data,
+                                         chunkSize, n)
+                results.append(result(name, 'uvloop' if uvloop else 'asyncio',
+                                      chunkSize, n, len(data), figures))
+                report(results[-1])
+    for name, payload, n in (('DNSParser', dnsMessages, messages),
+                             ('DNS responses', dnsResponses,
+                              max(1, messages // 10))):
+        datagrams = payload(n)
+        size = sum(len(datagram) for datagram in datagrams)
+        for label, parse, debug in (('parseproto', parseprotoDNS, False),
+                                    ('debug', parseprotoDNS, True),
+                                    ('twisted', twistedDNS, False)):
+            if debug and not DEBUGGING:
+                continue
+            # Warm up on a single datagram, for the grammar to be loaded.
+            measure = lambda: (parse(datagrams[:1]),
+                               timed(lambda: parse(datagrams) or n, n))
+            figures = (debugging(measure) if debug else measure())[1]
+            results.append(result(name, label, DATAGRAM, n, size, figures))
+            report(results[-1])
+    for name, payload, chunkSize, (ours, theirs), reject in GARBAGE:
+        if ours is None:
+            continue
+        data = payload(messages)
+        size = len(data) if chunkSize else sum(len(junk) for junk in data)
+        for label, impl, debug in (('parseproto', ours, False),
+                                   ('debug', ours, True),
+                                   ('twisted', theirs, False)):
+            if debug and not DEBUGGING:
+                continue
+            # Warm up first: the first parser of a protocol loads its grammar,
+            # and the first run is slower whichever implementation it is.
+            measure = lambda: (reject(impl, data),
+                               timed(lambda: reject(impl, data), messages))
+            figures = (debugging(measure) if debug else measure())[1]
+            results.append(result(name, label, chunkSize, messages, size,
+                                  figures))
+            report(results[-1])
+    return results
+
+
+
+def formatResult(r):
+    return "%-20s %-10s %6s %8d msgs %10.1f msg/s %8.3f MB/s %10.1f us/msg%s" % (
+        r['protocol'], r['implementation'], r['chunk_size'] or 'dgram',
+        r['messages'], r['messages_per_second'], r['mb_per_second'],
+        r['us_per_message'],
+        '' if r['allocated_bytes_per_message'] is None else
+        ' %8.0f B/msg' % (r['allocated_bytes_per_message'],))
+
+
+
+def currentCommit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def compare(old, new):
+    """
+    Print the throughput of every benchmark of C{new} relative to C{old}.
+    """
+    key = lambda r: (r['protocol'], r['implementation'], r['chunk_size'])
+    before = dict((key(r), r) for r in old['results'])
+    print("%s -> %s" % (old.get('commit'), new.get('commit')))
+    for r in new['results']:
+        previous = before.get(key(r))
+        if previous is None:
+            continue
+        print("%-20s %-10s %6s %8.2fx" % (
+            r['protocol'], r['implementation'], r['chunk_size'] or 'dgram',
+            r['messages_per_second'] / previous['messages_per_second']))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--messages', type=int, default=2000)
+    parser.add_argument('-o', '--output', help="write the results there")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    options = parser.parse_args(argv)
+    if options.compare:
+        with open(options.compare[0]) as old, open(options.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+    results = run(options.messages,
+                  report=lambda r: print(formatResult(r)))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'commit': currentCommit(),
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+
+if __name__ == '__main__':
+    main()
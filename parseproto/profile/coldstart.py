@@ -0,0 +1,73 @@
+"""
+Measure how long a fresh process takes to get every grammar ready, parsing
+them from source as getGrammar used to, and loading them from their generated
+modules.
+
+    python parseproto/profile/coldstart.py [REPEAT]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+
+GRAMMARS = [
+    ('parseproto.basic', 'line_only_receiver'),
+    ('parseproto.basic', 'line_receiver'),
+    ('parseproto.basic', 'intn_string_receiver'),
+    ('parseproto.basic', 'netstring_receiver'),
+    ('parseproto.basic', 'varint_string_receiver'),
+    ('parseproto.amp', 'amp'),
+    ('parseproto.smtp', 'smtp'),
+    ('parseproto.imap4', 'imap4'),
+]
+
+PARSED = """
+import time
+start = time.time()
+import importlib, os
+from ometa.grammar import OMeta
+for pkg, name in %r:
+    base = os.path.dirname(importlib.import_module(pkg).__file__)
+    OMeta(open(os.path.join(base, name + '.parsley')).read()).parseGrammar(name)
+base = os.path.dirname(importlib.import_module('parseproto.dns').__file__)
+OMeta.makeGrammar(open(os.path.join(base, 'grammar.parsley')).read(), 'grammar')
+print(time.time() - start)
+""" % (GRAMMARS,)
+
+GENERATED = """
+import time
+start = time.time()
+import importlib
+from parseproto.util.grammar import getGrammar, getParserClass
+for pkg, name in %r:
+    getGrammar(importlib.import_module(pkg), name)
+getParserClass(importlib.import_module('parseproto.dns'), 'grammar', {})
+print(time.time() - start)
+""" % (GRAMMARS,)
+
+
+def measure(code, repeat):
+    """
+    Run C{code} in C{repeat} fresh interpreters and return the best time it
+    printed.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+        times.append(float(out.strip().splitlines()[-1]))
+    return min(times)
+
+
+if __name__ == '__main__':
+    from parseproto.util.grammar import main
+    main()
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    parsed = measure(PARSED, repeat)
+    generated = measure(GENERATED, repeat)
+    print("parsed from source:    %.4fs" % (parsed,))
+    print("generated modules:     %.4fs" % (generated,))
+    print("speedup:               %.1fx" % (parsed / generated,))
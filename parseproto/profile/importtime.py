@@ -0,0 +1,117 @@
+"""
+Measure how long importing the protocols of each package takes, against a
+budget per package: importing a protocol must stay cheap for short-lived
+processes, which may import a protocol they never speak.
+
+Each module is imported in fresh interpreters, and the fastest import is
+reported with the budget of its package.  Where the interpreter has
+C{-X importtime} (Python 3.7 and later), the modules which took longest to
+import themselves are listed too.
+
+    python parseproto/profile/importtime.py [REPEAT]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+
+# The module imported for each package, and the time its import may take, in
+# seconds.
+BUDGETS = [
+    ('parseproto.util', 'parseproto.util.sansio', 0.05),
+    ('parseproto.basic', 'parseproto.basic.protocol', 0.5),
+    ('parseproto.amp', 'parseproto.amp.amp', 0.6),
+    ('parseproto.smtp', 'parseproto.smtp.smtp', 0.8),
+    ('parseproto.imap4', 'parseproto.imap4.imap4', 0.6),
+    ('parseproto.dns', 'parseproto.dns.protocol', 0.5),
+]
+
+# The number of modules listed from the breakdown of C{-X importtime}.
+SLOWEST = 5
+
+# Import a module with the path of this process, and print the time it took.
+IMPORT = """
+import site, sys, time
+
+for entry in %r:
+    if entry not in sys.path:
+        site.addsitedir(entry)
+
+start = time.time()
+__import__(%r)
+print(time.time() - start)
+"""
+
+
+
+def importTime(module, options=()):
+    """
+    Import C{module} in a fresh interpreter.
+
+    @param options: The options of the interpreter.
+    @return: The time the import took, in seconds, and what the interpreter
+        wrote to its standard error.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable] + list(options) +
+        ['-c', IMPORT % (sys.path, module)],
+        cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError(err.decode('utf-8', 'replace').strip()
+                           .splitlines()[-1])
+    return float(out.decode('ascii').splitlines()[-1]), err.decode('utf-8')
+
+
+
+def slowestImports(report, count=SLOWEST):
+    """
+    Find the modules which took longest to import themselves in the report of
+    C{-X importtime}.
+
+    @return: A list of the names of the modules and their own import time,
+        in microseconds, slowest first.
+    """
+    times = []
+    for line in report.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self = int(fields[0])
+        except ValueError:
+            # The header of the report.
+            continue
+        times.append((fields[2].strip(), self))
+    times.sort(key=lambda entry: entry[1], reverse=True)
+    return times[:count]
+
+
+
+def measure(repeat):
+    """
+    Import the module of every package in fresh interpreters, and print the
+    fastest import of each against its budget.
+    """
+    hasImportTime = sys.version_info >= (3, 7)
+    for package, module, budget in BUDGETS:
+        try:
+            elapsed = min(importTime(module)[0] for i in range(repeat))
+        except RuntimeError as e:
+            print("%-18s cannot be imported: %s" % (package, e))
+            continue
+        print("%-18s %8.3fs  budget %.3fs%s" % (
+            package, elapsed, budget, "  OVER" if elapsed > budget else ""))
+        if hasImportTime:
+            report = importTime(module, ['-X', 'importtime'])[1]
+            for name, self in slowestImports(report):
+                print("    %-40s %8.1fms" % (name, self / 1000.0))
+
+
+
+if __name__ == '__main__':
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -1,5 +1,6 @@
 import cProfile
 from parseproto.test.test_basic import LineReceiver, proto_helpers
+from parseproto.util.instrument import GrammarProfiler
 
 
 def test_maximumLineLength():
@@ -16,3 +17,7 @@ def test_maximumLineLength():
 
 if __name__ == '__main__':
     cProfile.run('test_maximumLineLength()', 'gogo')
+    profiler = GrammarProfiler()
+    profiler.install()
+    test_maximumLineLength()
+    print(profiler.report())
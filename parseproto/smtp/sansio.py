@@ -0,0 +1,176 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+"""
+A sans-I/O parser of the commands an SMTP client sends.
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+
+from twisted.python.compat import nativeString
+
+import parseproto.smtp
+from parseproto.basic.sansio import LineLengthExceeded, LineOnlyParser
+
+
+COMMAND, DATA, AUTH = 'COMMAND', 'DATA', 'AUTH'
+
+
+
+class CommandReceived(namedtuple('CommandReceived', 'command argument')):
+    """
+    A command was received.
+
+    @ivar command: The name of the command, in upper case.
+    @ivar argument: The rest of the command line, or the address of the
+        C{MAIL} and C{RCPT} commands.
+    """
+    __slots__ = ()
+
+
+
+class SyntaxErrorReceived(namedtuple('SyntaxErrorReceived', 'command')):
+    """
+    A command line could not be parsed.
+
+    @ivar command: The name of the command, or C{None} if the line did not
+        start with one.
+    """
+    __slots__ = ()
+
+
+
+class DataLineReceived(namedtuple('DataLineReceived', 'line')):
+    """
+    A line of the data of a message was received.
+
+    @ivar line: The line, without its delimiter nor the dot escaping it.
+    """
+    __slots__ = ()
+
+
+
+class DataFinished(namedtuple('DataFinished', '')):
+    """
+    The line ending the data of a message was received.
+    """
+    __slots__ = ()
+
+
+
+class AuthResponseReceived(namedtuple('AuthResponseReceived', 'response')):
+    """
+    A line of an authentication exchange was received.
+
+    @ivar response: The base64-encoded response, or C{'*'} to abort.
+    """
+    __slots__ = ()
+
+
+
+class SMTPParser(LineOnlyParser):
+    """
+    A parser of the commands of an SMTP session.
+
+    The parser moves to L{DATA} mode after a C{DATA} command, as if the
+    server accepted it, and back to L{COMMAND} mode at the end of the data.
+    The responses of an authentication exchange are only parsed as such in
+    L{AUTH} mode, which is up to the user of the parser to set.
+
+    @ivar mode: L{COMMAND}, L{DATA} or L{AUTH}.
+    @cvar esmtp: Whether the C{EHLO}, C{AUTH} and C{STARTTLS} extensions are
+        parsed; they are unknown commands otherwise.
+    """
+    _parsleyGrammarPKG = parseproto.smtp
+    _parsleyGrammarName = "smtp"
+    esmtp = False
+    _command = None
+    _mode = COMMAND
+
+    # make sure object is in this class's mro
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, val):
+        self._mode = val
+        self.currentRule = "line_" + val.lower()
+
+    @mode.deleter
+    def mode(self):
+        del self._mode
+
+
+    def state_COMMAND(self, cmd):
+        """
+        Select the rule parsing the rest of a command line.
+
+        @param cmd: The name of the command.
+        """
+        self._command = cmd.upper()
+        name = nativeString(cmd.lower())
+        if self._command in (b"MAIL", b"RCPT", b"DATA"):
+            self.currentRule = "cmd_" + name
+        elif self.esmtp and self._command in (b"AUTH", b"STARTTLS"):
+            self.currentRule = "cmd_" + name
+        else:
+            if self._command not in (b"HELO", b"QUIT", b"RSET") and not (
+                    self.esmtp and self._command == b"EHLO"):
+                name = "unknown"
+            self.currentRule = "cmd_others", name
+
+
+    def _commandReceived(self, rest):
+        self.eventReceived(CommandReceived(self._command, rest))
+
+
+    def sendSyntaxError(self):
+        self.eventReceived(SyntaxErrorReceived(None))
+
+
+    def lineLengthExceeded(self, line):
+        self.mode = COMMAND
+        self.eventReceived(LineLengthExceeded(line))
+
+
+    def do_MAIL(self, q, path=b""):
+        if q == "to":
+            self._commandReceived(path)
+        elif q == "notmatch":
+            self.eventReceived(SyntaxErrorReceived(self._command))
+        return False
+
+
+    def do_RCPT(self, q, path=b""):
+        if q == "rec":
+            self._commandReceived(path)
+        elif q == "notmatch":
+            self.eventReceived(SyntaxErrorReceived(self._command))
+        return False
+
+
+    def do_DATA(self, rest):
+        self._commandReceived(rest)
+        self.mode = DATA
+
+
+    do_HELO = do_EHLO = do_QUIT = do_RSET = do_UNKNOWN = _commandReceived
+    ext_AUTH = ext_STARTTLS = _commandReceived
+
+
+    def state_DATA(self, line):
+        if line is None:
+            # The line was too long, and ended the message.
+            return
+        if line == b'.':
+            self.mode = COMMAND
+            self.eventReceived(DataFinished())
+            return
+        if line[:1] == b'.':
+            line = line[1:]
+        self.eventReceived(DataLineReceived(line))
+
+
+    def state_AUTH(self, response):
+        self.eventReceived(AuthResponseReceived(response))
@@ -6,7 +6,7 @@
 Simple Mail Transfer Protocol implementation.
 """
 
-import time, re, base64, types, socket, os, random, rfc822
+import time, re, base64, types, socket, os, random
 import binascii
 import warnings
 from email.base64MIME import encode as encode_base64
@@ -19,7 +19,6 @@ from twisted.protocols import policies
 from twisted.internet import protocol
 from twisted.internet import defer
 from twisted.internet import error
-from twisted.internet import reactor
 from twisted.internet.interfaces import ITLSTransport, ISSLTransport
 from twisted.python import log
 from twisted.python import util
@@ -29,19 +28,44 @@ from twisted.python.runtime import platform
 
 # parseproto imports
 import parseproto.basic.protocol as proto_basic
+from parseproto.smtp.sansio import COMMAND, DATA, AUTH, SMTPParser
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
-# Cache the hostname (XXX Yes - this is broken)
-if platform.isMacOSX():
-    # On OS X, getfqdn() is ridiculously slow - use the
-    # probably-identical-but-sometimes-not gethostname() there.
-    DNSNAME = socket.gethostname()
-else:
-    DNSNAME = socket.getfqdn()
+# The hostname, looked up by getDNSName when it is first needed rather than
+# when this module is imported.
+_dnsName = None
+
+def getDNSName():
+    """
+    Get the name of this host, as it introduces itself to its peers.
+
+    The name is looked up on the first call, which may have to wait for the
+    resolver, and cached (XXX Yes - this is broken).  This replaces the
+    C{DNSNAME} constant, which was looked up when the module was imported.
+    """
+    global _dnsName
+    if _dnsName is None:
+        if platform.isMacOSX():
+            # On OS X, getfqdn() is ridiculously slow - use the
+            # probably-identical-but-sometimes-not gethostname() there.
+            _dnsName = socket.gethostname()
+        else:
+            _dnsName = socket.getfqdn()
+    return _dnsName
+
+
+class _DNSNameAttribute(object):
+    """
+    A class attribute defaulting to the name of this host, looked up when it
+    is first read rather than when the class is defined.  Setting the
+    attribute on an instance or a subclass overrides it as usual.
+    """
+    def __get__(self, oself, type=None):
+        return getDNSName()
 
 # Used for fast success code lookup
 SUCCESS = dict.fromkeys(xrange(200,300))
@@ -327,7 +351,8 @@ def messageid(uniq=None, N=idGenerator().next):
     else:
         uniq = '.' + uniq
 
-    return '<%s.%s.%s%s.%s@%s>' % (datetime, pid, rand, uniq, N(), DNSNAME)
+    return '<%s.%s.%s%s.%s@%s>' % (datetime, pid, rand, uniq, N(),
+                                   getDNSName())
 
 def quoteaddr(addr):
     """Turn an email address, possibly with realname part etc, into
@@ -337,6 +362,7 @@ def quoteaddr(addr):
     if isinstance(addr, Address):
         return '<%s>' % str(addr)
 
+    import rfc822
     res = rfc822.parseaddr(addr)
 
     if res == (None, None):
@@ -345,8 +371,6 @@ def quoteaddr(addr):
     else:
         return '<%s>' % str(res[1])
 
-COMMAND, DATA, AUTH = 'COMMAND', 'DATA', 'AUTH'
-
 class AddressError(SMTPError):
     "Parse error in address"
 
@@ -422,7 +446,7 @@ class Address:
         self.domain = ''.join(domain)
         if self.local != '' and self.domain == '':
             if defaultDomain is None:
-                defaultDomain = DNSNAME
+                defaultDomain = getDNSName()
             self.domain = defaultDomain
 
     dequotebs = re.compile(r'\\(.)')
@@ -501,13 +525,13 @@ class IMessage(Interface):
         semantics should be to discard the message
         """
 
-class SMTP(proto_basic.LineOnlyReceiver, policies.TimeoutMixin):
+class SMTP(SMTPParser, proto_basic.LineOnlyReceiver, policies.TimeoutMixin):
     """
     SMTP server-side protocol.
     """
 
     timeout = 600
-    host = DNSNAME
+    host = _DNSNameAttribute()
     portal = None
 
     # Control whether we log SMTP events
@@ -530,27 +554,6 @@ class SMTP(proto_basic.LineOnlyReceiver, policies.TimeoutMixin):
     # Cred cleanup function.
     _onLogout = None
 
-    # parsley grammar
-    import parseproto.smtp
-    _parsleyGrammarPKG = parseproto.smtp
-    _parsleyGrammarName = "smtp"
-
-    # make sure object is in this class's mro
-    @property
-    def mode(self):
-        return self._mode
-
-    @mode.setter
-    def mode(self, val):
-        self._mode = val
-        if self._trampolinedParser is not None:
-            self.currentRule = "line_" + val.lower()
-
-    @mode.deleter
-    def mode(self):
-        del self._mode
-
-
     def __init__(self, delivery=None, deliveryFactory=None):
         self._mode = COMMAND
         self._from = None
@@ -582,10 +585,9 @@ class SMTP(proto_basic.LineOnlyReceiver, policies.TimeoutMixin):
         "Send an SMTP code with a message."
         lines = message.splitlines()
         lastline = lines[-1:]
-        for line in lines[:-1]:
-            self.sendLine('%3.3d-%s' % (code, line))
-        self.sendLine('%3.3d %s' % (code,
-                                    lastline and lastline[0] or ''))
+        replies = ['%3.3d-%s' % (code, line) for line in lines[:-1]]
+        replies.append('%3.3d %s' % (code, lastline and lastline[0] or ''))
+        self.sendLines(replies)
 
     # def lineReceived(self, *args, **kwargs):
     #     self.resetTimeout()
@@ -610,16 +612,6 @@ class SMTP(proto_basic.LineOnlyReceiver, policies.TimeoutMixin):
         # else:
         #     self.sendSyntaxError()
 
-    def state_COMMAND(self, cmd):
-        if cmd.upper() in ("MAIL", "RCPT", "DATA"):
-            self.currentRule = "cmd_" + cmd.lower()
-        else:
-            if cmd.upper() not in ("HELO", "QUIT", "RSET"):
-                cmd = "UNKNOWN"
-            self.currentRule = "cmd_others", cmd.lower()
-        return
-
-
     def sendSyntaxError(self):
         self.sendCode(500, 'Error: bad syntax')
 
@@ -1048,7 +1040,7 @@ class SMTPFactory(protocol.ServerFactory):
     """Factory for SMTP."""
 
     # override in instances or subclasses
-    domain = DNSNAME
+    domain = _DNSNameAttribute()
     timeout = 600
     protocol = SMTP
 
@@ -1582,6 +1574,7 @@ class ESMTPClient(SMTPClient):
 
 class ESMTP(SMTP):
 
+    esmtp = True
     ctx = None
     canStartTLS = False
     startedTLS = False
@@ -1618,14 +1611,6 @@ class ESMTP(SMTP):
     #         m = getattr(self, 'ext_' + command.upper(), None)
     #     return m
 
-    def state_COMMAND(self, cmd):
-        SMTP.state_COMMAND(self, cmd)
-        if cmd.upper() in ("AUTH", "STARTTLS"):
-            self.currentRule = "cmd_" + cmd.lower()
-        elif cmd.upper() in ("EHLO",):
-            self.currentRule = "cmd_others", cmd.lower()
-        return
-
     def listExtensions(self):
         r = []
         for (c, v) in self.extensions().iteritems():
@@ -1822,7 +1807,7 @@ class SMTPSenderFactory(protocol.ClientFactory):
     Utility factory for sending emails easily.
     """
 
-    domain = DNSNAME
+    domain = _DNSNameAttribute()
     protocol = SMTPSender
 
     def __init__(self, fromEmail, toEmail, file, deferred, retries=5,
@@ -2045,6 +2030,7 @@ def sendmail(smtphost, from_addr, to_addrs, msg, senderDomainName=None, port=25)
     if senderDomainName is not None:
         factory.domain = senderDomainName
 
+    from twisted.internet import reactor
     reactor.connectTCP(smtphost, port, factory)
 
     return d
@@ -980,6 +980,19 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertTrue(transport.disconnecting)
 
 
+    def test_excessiveKeyLengthIgnoresRest(self):
+        """
+        Once L{amp.BinaryBoxProtocol} drops its connection because of a key
+        length prefix larger than 255, it ignores the data it receives, be it
+        in the same chunk or in another one.
+        """
+        protocol = amp.BinaryBoxProtocol(self)
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived('\x01\x00' + 'x' * 256)
+        protocol.dataReceived('\x00\x00' + amp.Box({"a": "b"}).serialize())
+        self.assertEqual(self.boxes, [])
+
+
     def test_excessiveKeyFailure(self):
         """
         If L{amp.BinaryBoxProtocol} disconnects because it received a key
@@ -7,13 +7,17 @@ from twisted.python.compat import iterbytes
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from twisted.protocols.test.test_basic import LPTestCaseMixin
-from twisted.internet import protocol, error, task
+from twisted.protocols.basic import StringTooLongError
+from twisted.internet import defer, interfaces, protocol, error, task
 
 
 from parseproto.basic.protocol import (
     LineOnlyReceiver, LineReceiver, IntNStringReceiver)
 from parseproto.basic.protocol import (
-    Int8StringReceiver, Int16StringReceiver, Int32StringReceiver)
+    Int8StringReceiver, Int16StringReceiver, Int32StringReceiver,
+    Int16LEStringReceiver, Int32LEStringReceiver, VarintStringReceiver,
+    NetstringReceiver)
+from parseproto.basic.sansio import UNIVERSAL_NEWLINES
 
 
 class LineOnlyTester(LineOnlyReceiver):
@@ -74,6 +78,48 @@ class LineOnlyReceiverTestCase(unittest.SynchronousTestCase):
         self.assertRaises(NotImplementedError, proto.lineReceived, 'foo')
 
 
+    def test_sendLines(self):
+        """
+        L{LineOnlyReceiver.sendLines} sends the lines in one write.
+        """
+        writes = []
+        proto = LineOnlyReceiver()
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.transport.writeSequence = writes.append
+        proto.sendLines(iter([b'foo', b'bar']))
+        proto.sendLines([])
+        self.assertEqual(writes, [[b'foo', b'\r\n', b'bar', b'\r\n']])
+
+
+    def test_linesReceived(self):
+        """
+        When L{LineOnlyReceiver.linesReceived} is set, the lines found in the
+        data of a call of C{dataReceived} are delivered to it together.
+        """
+        batches = []
+        proto = LineOnlyReceiver()
+        proto.linesReceived = batches.append
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'foo\r\nbar\r\nba')
+        proto.dataReceived(b'z')
+        proto.dataReceived(b'\r\n')
+        self.assertEqual(batches, [[b'foo', b'bar'], [b'baz']])
+
+
+    def test_linesReceivedLineTooLong(self):
+        """
+        The lines found before a line too long are delivered before it.
+        """
+        events = []
+        proto = LineOnlyReceiver()
+        proto.MAX_LENGTH = 3
+        proto.linesReceived = events.append
+        proto.lineLengthExceeded = lambda line: events.append(line)
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'foo\r\nbar\r\nlong\r\nbaz\r\n')
+        self.assertEqual(events, [[b'foo', b'bar'], b'long', [b'baz']])
+
+
 class FlippingLineTester(LineReceiver):
     """
     A line receiver that flips between line and raw data modes after one byte.
@@ -262,7 +308,6 @@ a'''
             self.assertEqual(self.rawpauseOutput1, a.received)
             clock.advance(0)
             self.assertEqual(self.rawpauseOutput2, a.received)
-    test_rawPausing.skip = "pausing implementation undecided."
 
     stop_buf = b'twiddle1\ntwiddle2\nstop\nmore\nstuff\n'
 
@@ -281,7 +326,6 @@ a'''
                 s = self.stop_buf[i * packet_size:(i + 1) * packet_size]
                 a.dataReceived(s)
             self.assertEqual(self.stop_output, a.received)
-    test_stopProducing.skip = "pausing implementation undecided."
 
     def test_lineReceiverAsProducer(self):
         """
@@ -315,7 +359,6 @@ a'''
         protocol.dataReceived(b'quux\r\n')
         self.assertEqual(protocol.line, b'quux')
         self.assertEqual(protocol.rest, b'')
-    test_clearLineBuffer.skip = "Currently not supported."
 
 
     def test_stackRecursion(self):
@@ -390,6 +433,344 @@ a'''
         self.assertRaises(NotImplementedError, proto.lineReceived, 'foo')
 
 
+    def test_sendLines(self):
+        """
+        L{LineReceiver.sendLines} sends the lines followed by the delimiter,
+        in one write.
+        """
+        transport = proto_helpers.StringTransport()
+        proto = LineTester()
+        proto.makeConnection(transport)
+        proto.sendLines([b'foo', b'bar'])
+        self.assertEqual(transport.value(), b'foo\nbar\n')
+
+
+    def test_linesReceived(self):
+        """
+        When L{LineReceiver.linesReceived} is set, the lines found in the data
+        of a call of C{dataReceived} are delivered to it together, before the
+        raw data following them.
+        """
+        class BatchingReceiver(LineReceiver):
+            delimiter = b'\n'
+
+            def connectionMade(self):
+                self.received = []
+
+            def linesReceived(self, lines):
+                self.received.append(lines)
+
+            def rawDataReceived(self, data):
+                self.received.append(data)
+                self.setLineMode(data[1:])
+
+        proto = BatchingReceiver()
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'foo\nbar\n')
+        proto.setRawMode()
+        proto.dataReceived(b'xbaz\nquux\n')
+        self.assertEqual(proto.received,
+                         [[b'foo', b'bar'], b'x', [b'baz', b'quux']])
+
+
+    def test_linesReceivedModeSwitch(self):
+        """
+        Switching to raw mode from L{LineReceiver.linesReceived} delivers the
+        data after the last line as raw data.
+        """
+        class BatchingReceiver(LineReceiver):
+            delimiter = b'\n'
+
+            def connectionMade(self):
+                self.received = []
+
+            def linesReceived(self, lines):
+                self.received.append(lines)
+                self.setRawMode()
+
+            def rawDataReceived(self, data):
+                self.received.append(data)
+
+        proto = BatchingReceiver()
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'foo\nbar\nraw')
+        self.assertEqual(proto.received, [[b'foo', b'bar'], b'r', b'a', b'w'])
+
+
+    def test_linesReceivedPausing(self):
+        """
+        Pausing from L{LineReceiver.linesReceived} stops the delivery of lines
+        until the receiver is resumed.
+        """
+        batches = []
+        proto = LineReceiver()
+        proto.makeConnection(proto_helpers.StringTransport())
+
+        def linesReceived(lines):
+            batches.append(lines)
+            proto.pauseProducing()
+        proto.linesReceived = linesReceived
+        proto.dataReceived(b'foo\r\nba')
+        proto.dataReceived(b'r\r\n')
+        self.assertEqual(batches, [[b'foo']])
+        proto.resumeProducing()
+        self.assertEqual(batches, [[b'foo'], [b'bar']])
+
+
+    def test_delimiters(self):
+        """
+        With C{delimiters} set, lines may end with any of them, whichever way
+        the data is split.  A delimiter starting a longer one ends a line
+        only once it is followed by something else.
+        """
+        data = b'foo\r\nbar\nbaz\r\rquux\r\n\n'
+        for chunkSize in (1, 2, 3, len(data)):
+            received = []
+            proto = LineReceiver()
+            proto.delimiters = UNIVERSAL_NEWLINES
+            proto.lineReceived = received.append
+            proto.makeConnection(proto_helpers.StringTransport())
+            for i in range(0, len(data), chunkSize):
+                proto.dataReceived(data[i:i + chunkSize])
+            self.assertEqual(received,
+                             [b'foo', b'bar', b'baz', b'', b'quux', b''])
+        proto.dataReceived(b'end\r')
+        self.assertEqual(received[-1], b'')
+
+
+    def test_delimitedLineReceived(self):
+        """
+        With C{delimiters} set, L{LineReceiver.delimitedLineReceived} is
+        called with every line and the delimiter which ended it.
+        """
+        received = []
+        proto = LineReceiver()
+        proto.delimiters = (b'\r\n', b'\n')
+        proto.delimitedLineReceived = lambda *args: received.append(args)
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'foo\nbar\r\nbaz\r\r\n')
+        self.assertEqual(received, [(b'foo', b'\n'), (b'bar', b'\r\n'),
+                                    (b'baz\r', b'\r\n')])
+
+
+    def test_delimitersRawMode(self):
+        """
+        With C{delimiters} set, switching to raw mode and back to line mode
+        works as with C{delimiter}.
+        """
+        proto = LineTester()
+        proto.delimiters = UNIVERSAL_NEWLINES
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'len 3\r\n\nabcfoo\r\n')
+        self.assertEqual(proto.received, [b'len 3', b'abc', b'foo'])
+
+
+    def test_delimitersLineLengthExceeded(self):
+        """
+        With C{delimiters} set, a line longer than C{MAX_LENGTH} is passed
+        to C{lineLengthExceeded}, with the data received after it.
+        """
+        exceeded = []
+        proto = LineReceiver()
+        proto.delimiters = UNIVERSAL_NEWLINES
+        proto.MAX_LENGTH = 4
+        proto.lineLengthExceeded = exceeded.append
+        proto.makeConnection(proto_helpers.StringTransport())
+        proto.dataReceived(b'abcde\nfoo')
+        self.assertEqual(exceeded, [b'abcde\nfoo'])
+
+
+class FlowControlTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the watermarks of L{LineReceiver} and L{IntNStringReceiver}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.transport = proto_helpers.StringTransport()
+        self.proto = LineTester(self.clock)
+        self.proto.clock = self.clock
+        self.proto.makeConnection(self.transport)
+
+
+    def test_buffered(self):
+        """
+        The transport is paused while more than C{highWatermark} bytes are
+        held by the paused receiver, until no more than C{lowWatermark} are.
+        """
+        self.proto.highWatermark = 8
+        self.proto.lowWatermark = 4
+        self.proto.dataReceived(b'pause\n01234\n56789')
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.clock.advance(3)
+        self.proto.resumeProducing()
+        self.assertEqual(self.proto.received, [b'pause', b'01234'])
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.proto.dataReceived(b'\n')
+        self.assertEqual(self.proto.received, [b'pause', b'01234', b'56789'])
+        self.assertEqual((self.proto.pauseCount, self.proto.pausedTime),
+                         (1, 3))
+
+
+    def test_longMessage(self):
+        """
+        A message longer than C{highWatermark} does not pause the transport
+        while it is received.
+        """
+        self.proto.highWatermark = 8
+        self.proto.dataReceived(b'0123456789')
+        self.proto.dataReceived(b'0123456789')
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.proto.dataReceived(b'\n')
+        self.assertEqual(self.proto.received, [b'01234567890123456789'])
+        proto = TestInt16()
+        proto.highWatermark = 8
+        proto.makeConnection(self.transport)
+        proto.dataReceived(b'\x00\x140123456789')
+        self.assertEqual(self.transport.producerState, 'producing')
+        proto.dataReceived(b'0123456789')
+        self.assertEqual(proto.received, [b'01234567890123456789'])
+        self.assertEqual((self.proto.pauseCount, proto.pauseCount), (0, 0))
+
+
+    def test_pending(self):
+        """
+        The transport is paused while more than C{highPendingWatermark} events
+        are pending, until no more than C{lowPendingWatermark} are.
+        """
+        proto = TestInt16()
+        proto.clock = self.clock
+        proto.highPendingWatermark = 1
+        proto.makeConnection(self.transport)
+        deferreds = [defer.Deferred() for i in range(3)]
+        proto.stringReceived = lambda string: proto.trackPending(
+            deferreds[int(string)])
+        proto.dataReceived(b'\x00\x010\x00\x011')
+        self.assertEqual(proto.pendingEvents, 2)
+        self.assertEqual(self.transport.producerState, 'paused')
+        deferreds[0].callback(None)
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.clock.advance(2)
+        deferreds[1].callback(None)
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.assertEqual((proto.pendingEvents, proto.pauseCount,
+                          proto.pausedTime), (0, 1, 2))
+
+
+    def test_applicationPause(self):
+        """
+        The transport is not resumed on catching up while the receiver itself
+        is paused, nor on resuming the receiver while falling behind.
+        """
+        proto = TestInt16()
+        proto.highPendingWatermark = 0
+        proto.clock = self.clock
+        proto.makeConnection(self.transport)
+        d = defer.Deferred()
+        proto.stringReceived = lambda string: proto.trackPending(d)
+        proto.dataReceived(b'\x00\x01a')
+        proto.pauseProducing()
+        proto.resumeProducing()
+        self.assertEqual(self.transport.producerState, 'paused')
+        proto.pauseProducing()
+        d.callback(None)
+        self.assertEqual(self.transport.producerState, 'paused')
+        proto.resumeProducing()
+        self.assertEqual(self.transport.producerState, 'producing')
+
+
+    def test_disabled(self):
+        """
+        Without watermarks, the transport is never paused.
+        """
+        self.proto.dataReceived(b'x' * 60)
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.assertEqual(self.proto.pauseCount, 0)
+
+
+
+class CorkedOutputTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the output of receivers with C{corkOutput} set.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.transport = proto_helpers.StringTransport()
+        self.writes = []
+        self.transport.writeSequence = self.writes.append
+        self.proto = LineReceiver()
+        self.proto.corkOutput = True
+        self.proto.clock = self.clock
+        self.proto.makeConnection(self.transport)
+
+
+    def test_coalesced(self):
+        """
+        The writes made during a reactor iteration are written at its end, in
+        one C{writeSequence} call.
+        """
+        self.proto.sendLine(b'foo')
+        self.proto.sendLines([b'bar', b'baz'])
+        self.proto.transport.write(b'quux')
+        self.assertEqual(self.writes, [])
+        self.clock.advance(0)
+        self.assertEqual(self.writes, [[b'foo\r\n', b'bar', b'\r\n', b'baz',
+                                        b'\r\n', b'quux']])
+        self.proto.sendLine(b'again')
+        self.clock.advance(0)
+        self.assertEqual(self.writes[1:], [[b'again\r\n']])
+
+
+    def test_loseConnection(self):
+        """
+        What was written before losing the connection is written first.
+        """
+        self.proto.sendLine(b'bye')
+        self.proto.transport.loseConnection()
+        self.assertEqual(self.writes, [[b'bye\r\n']])
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_startTLS(self):
+        """
+        What was written before starting TLS, such as the reply telling the
+        peer to start it, is written first, in the clear.
+        """
+        started = []
+        self.transport.startTLS = lambda *args: started.append(
+            (args, list(self.writes)))
+        self.proto.sendLine(b'220 Ready to start TLS')
+        self.proto.transport.startTLS(b'context')
+        self.assertEqual(started, [((b'context',),
+                                    [[b'220 Ready to start TLS\r\n']])])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_registerProducer(self):
+        """
+        What was written before registering a producer is written first.
+        """
+        producer = object()
+        self.proto.sendLine(b'header')
+        self.proto.transport.registerProducer(producer, True)
+        self.assertEqual(self.writes, [[b'header\r\n']])
+        self.assertIdentical(self.transport.producer, producer)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_interfaces(self):
+        """
+        The corked transport provides the interfaces of the transport.
+        """
+        self.assertTrue(
+            interfaces.ITransport.providedBy(self.proto.transport))
+        self.assertEqual(self.proto.transport.getPeer(),
+                         self.transport.getPeer())
+
+
+
 class TestMixin:
     def connectionMade(self):
         self.received = []
@@ -442,6 +823,19 @@ class IntNTestCaseMixin(LPTestCaseMixin):
             struct.pack(r.structFormat, 16) + b"b" * 16)
 
 
+    def test_sendStrings(self):
+        """
+        L{IntNStringReceiver.sendStrings} sends the strings with their length
+        prefix, in one write.
+        """
+        r = self.getProtocol()
+        writes = []
+        r.transport.writeSequence = writes.append
+        r.sendStrings([b"a", b"b" * 16])
+        self.assertEqual(writes, [[struct.pack(r.structFormat, 1), b"a",
+                                   struct.pack(r.structFormat, 16), b"b" * 16]])
+
+
     def test_lengthLimitExceeded(self):
         """
         When a length prefix is received which is greater than the protocol's
@@ -509,6 +903,113 @@ class Int32TestCase(unittest.SynchronousTestCase, IntNTestCaseMixin):
 
 
 
+class StreamingInt32(Int32StringReceiver):
+    """
+    A L{Int32StringReceiver} recording the strings streamed to it.
+    """
+    streaming = True
+    MAX_LENGTH = 2 ** 32
+
+    def connectionMade(self):
+        self.received = []
+
+
+    def stringStarted(self, length):
+        self.received.append(('started', length))
+
+
+    def stringChunkReceived(self, chunk):
+        self.received.append(chunk)
+
+
+    def stringFinished(self):
+        self.received.append('finished')
+
+
+
+class StreamingTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the streaming mode of L{IntNStringReceiver}.
+    """
+
+    def setUp(self):
+        self.proto = StreamingInt32()
+        self.proto.makeConnection(proto_helpers.StringTransport())
+
+
+    def test_chunks(self):
+        """
+        The data of a string is passed on as it is received, without being
+        buffered.
+        """
+        self.proto.dataReceived(b"\x00\x00\x00\x0aabc")
+        self.proto.dataReceived(b"defg")
+        self.proto.dataReceived(b"hij\x00\x00")
+        self.proto.dataReceived(b"\x00\x01k")
+        self.assertEqual(self.proto.received, [
+            ('started', 10), b"abc", b"defg", b"hij", 'finished',
+            ('started', 1), b"k", 'finished'])
+
+
+    def test_severalStrings(self):
+        """
+        Several strings received at once are streamed one after the other.
+        """
+        self.proto.dataReceived(b"\x00\x00\x00\x02ab\x00\x00\x00\x00"
+                                b"\x00\x00\x00\x01c")
+        self.assertEqual(self.proto.received, [
+            ('started', 2), b"ab", 'finished',
+            ('started', 0), 'finished',
+            ('started', 1), b"c", 'finished'])
+
+
+    def test_byteByByte(self):
+        """
+        The prefix and data of a string may be received a byte at a time.
+        """
+        for c in iterbytes(b"\x00\x00\x00\x02ab"):
+            self.proto.dataReceived(c)
+        self.assertEqual(self.proto.received,
+                         [('started', 2), b"a", b"b", 'finished'])
+
+
+    def test_pausing(self):
+        """
+        Nothing is passed on while the receiver is paused.
+        """
+        self.proto.dataReceived(b"\x00\x00\x00\x04a")
+        self.proto.pauseProducing()
+        self.proto.dataReceived(b"bc")
+        self.proto.dataReceived(b"d\x00\x00\x00\x00")
+        self.assertEqual(self.proto.received, [('started', 4), b"a"])
+        self.proto.resumeProducing()
+        self.assertEqual(self.proto.received, [
+            ('started', 4), b"a", b"bcd", 'finished',
+            ('started', 0), 'finished'])
+
+
+    def test_lengthLimitExceeded(self):
+        """
+        The length prefix is checked against C{MAX_LENGTH} in streaming mode
+        too.
+        """
+        self.proto.MAX_LENGTH = 10
+        self.proto.dataReceived(b"\x00\x00\x00\x0b")
+        self.assertEqual(self.proto.received, [])
+        self.assertTrue(self.proto.transport.disconnecting)
+
+
+    def test_notImplemented(self):
+        """
+        The streaming callbacks of L{IntNStringReceiver} are to be overridden.
+        """
+        proto = IntNStringReceiver()
+        self.assertRaises(NotImplementedError, proto.stringStarted, 1)
+        self.assertRaises(NotImplementedError, proto.stringChunkReceived, b"")
+        self.assertRaises(NotImplementedError, proto.stringFinished)
+
+
+
 class TestInt16(TestMixin, Int16StringReceiver):
     """
     A L{Int16StringReceiver} storing received strings in an array.
@@ -583,4 +1084,342 @@ class Int8TestCase(unittest.SynchronousTestCase, IntNTestCaseMixin):
         """
         r = self.getProtocol()
         tooSend = b"b" * (2**(r.prefixLength * 8) + 1)
-        self.assertRaises(AssertionError, r.sendString, tooSend)
\ No newline at end of file
+        self.assertRaises(AssertionError, r.sendString, tooSend)
+
+
+    def test_sendStringsTooLong(self):
+        """
+        L{IntNStringReceiver.sendStrings} sends nothing if one of the strings
+        is too long.
+        """
+        r = self.getProtocol()
+        tooSend = b"b" * (2 ** (r.prefixLength * 8))
+        self.assertRaises(AssertionError, r.sendStrings, [b"a", tooSend])
+        self.assertEqual(r.transport.value(), b"")
+
+
+
+class TestInt32LE(TestMixin, Int32LEStringReceiver):
+    """
+    A L{Int32LEStringReceiver} storing received strings in an array.
+
+    @ivar received: array holding received strings.
+    """
+
+
+
+class Int32LETestCase(unittest.SynchronousTestCase, IntNTestCaseMixin):
+    """
+    Test case for little-endian int32-prefixed protocol
+    """
+    protocol = TestInt32LE
+    strings = [b"a", b"b" * 16]
+    illegalStrings = [b"\x00\x00\x00\x10aaaaaa"]
+    partialStrings = [b"\x04\x00\x00", b"hello there", b""]
+
+    def test_data(self):
+        """
+        Test specific behavior of the little-endian 32-bits length.
+        """
+        r = self.getProtocol()
+        r.sendString(b"foo")
+        self.assertEqual(r.transport.value(), b"\x03\x00\x00\x00foo")
+        r.dataReceived(b"\x04\x00\x00\x00ubar")
+        self.assertEqual(r.received, [b"ubar"])
+
+
+
+class TestInt16LE(TestMixin, Int16LEStringReceiver):
+    """
+    A L{Int16LEStringReceiver} storing received strings in an array.
+
+    @ivar received: array holding received strings.
+    """
+
+
+
+class Int16LETestCase(unittest.SynchronousTestCase, IntNTestCaseMixin):
+    """
+    Test case for little-endian int16-prefixed protocol
+    """
+    protocol = TestInt16LE
+    strings = [b"a", b"b" * 16]
+    illegalStrings = [b"\x00\x10aaaaaa"]
+    partialStrings = [b"\x04", b"hello there", b""]
+
+    def test_data(self):
+        """
+        Test specific behavior of the little-endian 16-bits length.
+        """
+        r = self.getProtocol()
+        r.sendString(b"foo")
+        self.assertEqual(r.transport.value(), b"\x03\x00foo")
+        r.dataReceived(b"\x04\x00ubar")
+        self.assertEqual(r.received, [b"ubar"])
+
+
+
+class TestVarint(TestMixin, VarintStringReceiver):
+    """
+    A L{VarintStringReceiver} storing received strings in an array.
+
+    @ivar received: array holding received strings.
+    """
+    MAX_LENGTH = 1000
+
+
+
+class VarintTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{VarintStringReceiver}.
+    """
+
+    def getProtocol(self):
+        r = TestVarint()
+        r.makeConnection(proto_helpers.StringTransport())
+        return r
+
+
+    def test_receive(self):
+        """
+        Strings prefixed by their length as a varint are received, whichever
+        way the data is split.
+        """
+        data = b"\x01a\x00\x96\x01" + b"b" * 150
+        r = self.getProtocol()
+        for c in iterbytes(data):
+            r.dataReceived(c)
+        self.assertEqual(r.received, [b"a", b"", b"b" * 150])
+        r = self.getProtocol()
+        r.dataReceived(data)
+        self.assertEqual(r.received, [b"a", b"", b"b" * 150])
+
+
+    def test_send(self):
+        """
+        L{VarintStringReceiver.sendString} and
+        L{VarintStringReceiver.sendStrings} prefix the strings with their
+        length as a varint.
+        """
+        r = self.getProtocol()
+        r.sendString(b"b" * 300)
+        r.sendStrings([b"", b"a" * 127, b"c" * 128])
+        self.assertEqual(r.transport.value(),
+                         b"\xac\x02" + b"b" * 300 + b"\x00" +
+                         b"\x7f" + b"a" * 127 + b"\x80\x01" + b"c" * 128)
+
+
+    def test_tooLongSend(self):
+        """
+        A string whose length does not fit in C{prefixLength} bytes of
+        varint, seven bits each, is not sent.
+        """
+        r = self.getProtocol()
+        r.prefixLength = 1
+        r.sendString(b"a" * 127)
+        self.assertRaises(StringTooLongError, r.sendString, b"b" * 128)
+        self.assertRaises(StringTooLongError, r.sendStrings,
+                          [b"", b"c" * 128])
+        self.assertEqual(r.transport.value(), b"\x7f" + b"a" * 127)
+
+
+    def test_lengthLimitExceeded(self):
+        """
+        A varint length over C{MAX_LENGTH} is passed to
+        C{lengthLimitExceeded}, and so is the value of a varint longer than
+        C{prefixLength} bytes.
+        """
+        length = []
+        r = self.getProtocol()
+        r.lengthLimitExceeded = length.append
+        r.dataReceived(b"\xe9\x07")
+        r.dataReceived(b"\xff" * 20)
+        self.assertEqual(length[0], 1001)
+        self.assertTrue(length[1] >= 2 ** 63)
+        self.assertEqual(r.received, [])
+
+
+
+class TestNetstring(TestMixin, NetstringReceiver):
+    """
+    A L{NetstringReceiver} storing received strings in an array, and echoing
+    them.
+    """
+
+    def stringReceived(self, s):
+        self.received.append(s)
+        self.transport.write(s)
+
+
+
+class NetstringReceiverTestCase(unittest.SynchronousTestCase,
+                                LPTestCaseMixin):
+    """
+    Tests for L{NetstringReceiver}.
+    """
+    strings = [b'hello', b'world', b'how', b'are', b'you123', b':today',
+               b"a" * 515]
+
+    illegalStrings = [
+        b'9999999999999999999999', b'abc', b'4:abcde',
+        b'51:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaab,',
+        b'007:abcdefg,']
+
+    protocol = TestNetstring
+
+    def setUp(self):
+        self.transport = proto_helpers.StringTransport()
+        self.netstringReceiver = TestNetstring()
+        self.netstringReceiver.makeConnection(self.transport)
+
+
+    def test_buffer(self):
+        """
+        Strings can be received in chunks of different lengths.
+        """
+        for packet_size in range(1, 10):
+            t = proto_helpers.StringTransport()
+            a = TestNetstring()
+            a.MAX_LENGTH = 699
+            a.makeConnection(t)
+            for s in self.strings:
+                a.sendString(s)
+            out = t.value()
+            for i in range(len(out) // packet_size + 1):
+                s = out[i * packet_size:(i + 1) * packet_size]
+                if s:
+                    a.dataReceived(s)
+            self.assertEqual(a.received, self.strings)
+
+
+    def test_sendStrings(self):
+        """
+        L{NetstringReceiver.sendStrings} sends netstrings in one write.
+        """
+        writes = []
+        self.transport.writeSequence = writes.append
+        self.netstringReceiver.sendStrings([b"ab", b""])
+        self.assertEqual(writes, [[b"2:", b"ab", b",", b"0:", b"", b","]])
+
+
+    def test_receiveEmptyNetstring(self):
+        """
+        Empty netstrings (with length '0') can be received.
+        """
+        self.netstringReceiver.dataReceived(b"0:,")
+        self.assertEqual(self.netstringReceiver.received, [b""])
+
+
+    def test_receiveOneCharacter(self):
+        """
+        One-character netstrings can be received.
+        """
+        self.netstringReceiver.dataReceived(b"1:a,")
+        self.assertEqual(self.netstringReceiver.received, [b"a"])
+
+
+    def test_receiveNestedNetstring(self):
+        """
+        Netstrings with embedded netstrings. This test makes sure that
+        the parser does not become confused about the ',' and ':'
+        characters appearing inside the data portion of the netstring.
+        """
+        self.netstringReceiver.dataReceived(b"4:1:a,,")
+        self.assertEqual(self.netstringReceiver.received, [b"1:a,"])
+
+
+    def test_moreDataThanSpecified(self):
+        """
+        Netstrings containing more data than expected are refused.
+        """
+        self.netstringReceiver.dataReceived(b"2:aaa,")
+        self.assertTrue(self.transport.disconnecting)
+        self.assertTrue(self.netstringReceiver.brokenPeer)
+
+
+    def test_moreDataThanSpecifiedBorderCase(self):
+        """
+        Netstrings that should be empty according to their length
+        specification are refused if they contain data.
+        """
+        self.netstringReceiver.dataReceived(b"0:a,")
+        self.assertTrue(self.transport.disconnecting)
+
+
+    def test_missingNumber(self):
+        """
+        Netstrings without leading digits that specify the length
+        are refused.
+        """
+        self.netstringReceiver.dataReceived(b":aaa,")
+        self.assertTrue(self.transport.disconnecting)
+
+
+    def test_missingColon(self):
+        """
+        Netstrings without a colon between length specification and
+        data are refused.
+        """
+        self.netstringReceiver.dataReceived(b"3aaa,")
+        self.assertTrue(self.transport.disconnecting)
+
+
+    def test_onlyData(self):
+        """
+        Netstrings consisting only of data are refused, without waiting for
+        more.
+        """
+        self.netstringReceiver.dataReceived(b"aaa")
+        self.assertTrue(self.transport.disconnecting)
+
+
+    def test_receiveNetstringPortions(self):
+        """
+        Netstrings can be received in more than two portions, even if
+        the length specification is split across two portions.
+        """
+        for part in [b"1", b"0:01234", b"56789", b","]:
+            self.netstringReceiver.dataReceived(part)
+        self.assertEqual(self.netstringReceiver.received, [b"0123456789"])
+
+
+    def test_receiveTwoNetstrings(self):
+        """
+        A stream of two netstrings can be received in two portions,
+        where the first portion contains the complete first netstring
+        and the length specification of the second netstring.
+        """
+        self.netstringReceiver.dataReceived(b"1:a,1")
+        self.assertEqual(self.netstringReceiver.received, [b"a"])
+        self.netstringReceiver.dataReceived(b":b,")
+        self.assertEqual(self.netstringReceiver.received, [b"a", b"b"])
+
+
+    def test_maxReceiveLimit(self):
+        """
+        Netstrings with a length specification exceeding the specified
+        C{MAX_LENGTH} are refused, and netstrings of C{MAX_LENGTH} are not.
+        """
+        self.netstringReceiver.MAX_LENGTH = 12
+        self.netstringReceiver.dataReceived(b"12:" + b"a" * 12 + b",")
+        self.assertEqual(self.netstringReceiver.received, [b"a" * 12])
+        self.netstringReceiver.dataReceived(b"13:")
+        self.assertTrue(self.transport.disconnecting)
+
+
+    def test_ignoredAfterError(self):
+        """
+        The data received after an invalid netstring is ignored.
+        """
+        self.netstringReceiver.dataReceived(b"2:abc,1:a,")
+        self.netstringReceiver.dataReceived(b"1:b,")
+        self.assertEqual(self.netstringReceiver.received, [])
+
+
+    def test_stringReceivedNotImplemented(self):
+        """
+        When L{NetstringReceiver.stringReceived} is not overridden in a
+        subclass, calling it raises C{NotImplementedError}.
+        """
+        proto = NetstringReceiver()
+        self.assertRaises(NotImplementedError, proto.stringReceived, 'foo')
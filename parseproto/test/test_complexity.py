@@ -0,0 +1,411 @@
+"""
+Complexity regression tests: parsing must take work linear in the size of the
+input, however it is split into chunks.
+
+Each test parses inputs of two sizes, C{GROWTH} times apart, fed in chunks of
+1 byte, of an odd number of bytes and of an Ethernet MTU, and counts the work
+done: the rules applied, as a L{GrammarProfiler} records them, and the bytes
+looked at by the searches for delimiters.  Unlike timings, the counts are the
+same on every run and on every machine.  Quadratic behaviour, e.g. a rule
+matched again, or a search started over, whenever a chunk arrives, makes the
+work grow C{GROWTH} times more than the input, as it would under a client
+trickling its requests in one byte at a time.
+"""
+
+import struct
+
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+
+from parseproto.amp import amp
+from parseproto.basic import protocol as basic
+from parseproto.imap4 import imap4
+from parseproto.profile.benchmark import (
+    BoxCounter, Counter, CountingDelivery)
+from parseproto.smtp import smtp
+from parseproto.util import tube
+from parseproto.util.instrument import GrammarProfiler
+
+
+# The sizes of the large inputs relative to the small ones.
+GROWTH = 8
+
+# How much faster than the input the work may grow.
+SLACK = 1.5
+
+CHUNK_SIZES = [1, 7, 1500]
+
+
+
+def receiver(receiverClass, callback, **attributes):
+    """
+    Make a function building a receiver counting the calls of one of its
+    callbacks.
+    """
+    def build():
+        counter = Counter()
+        protocol = receiverClass()
+        setattr(protocol, callback, counter)
+        for name, value in attributes.items():
+            setattr(protocol, name, value)
+        return protocol, counter
+    return build
+
+
+
+def ampProtocol():
+    """
+    Make a L{amp.BinaryBoxProtocol} counting the boxes it receives.
+    """
+    counter = BoxCounter()
+    return amp.BinaryBoxProtocol(counter), counter
+
+
+
+def smtpServer():
+    """
+    Make an SMTP server counting the mails it accepts.
+    """
+    counter = CountingDelivery()
+    server = smtp.SMTP(counter)
+    server.timeout = None
+    server.MAX_LENGTH = 2 ** 20
+    return server, counter
+
+
+
+def imapServer():
+    """
+    Make an IMAP4 server counting the commands it dispatches.
+    """
+    counter = Counter()
+    server = imap4.IMAP4Server()
+    server.timeOut = None
+    server.dispatchCommand = counter
+    return server, counter
+
+
+
+def box(n, valueSize=8):
+    """
+    Serialize a box tagged C{n}, with a value of C{valueSize} bytes.
+    """
+    return amp.AmpBox({b'_command': b'Sum', b'_ask': b'%d' % (n,),
+                       b'value': b'x' * valueSize}).serialize()
+
+
+
+def mail(bodyLines=8, lineLength=40):
+    """
+    Make the commands sending a mail of C{bodyLines} lines of
+    C{lineLength} bytes.
+    """
+    return (b'MAIL FROM:<alice@example.com>\r\n'
+            b'RCPT TO:<bob@example.com>\r\n'
+            b'DATA\r\n' +
+            (b'x' * lineLength + b'\r\n') * bodyLines +
+            b'.\r\n')
+
+
+
+class CountingBuffer(bytearray):
+    """
+    The input buffer of an interpreter, counting the bytes looked at by the
+    searches for a delimiter in it: up to the end of the delimiter found, or
+    to where the search stopped.
+
+    @ivar scanned: The number of bytes looked at.
+    """
+    scanned = 0
+
+    def find(self, sub, start=0, end=None):
+        if end is None or end > len(self):
+            end = len(self)
+        found = bytearray.find(self, sub, start, end)
+        if found != -1:
+            end = found + len(sub)
+        self.scanned += max(end - start, 0)
+        return found
+
+
+
+class CountingPattern(object):
+    """
+    A compiled pattern counting the bytes its searches look at in a
+    L{CountingBuffer}.
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+
+    def search(self, data, pos, endpos):
+        match = self.pattern.search(data, pos, endpos)
+        if match is None:
+            data.scanned += max(min(endpos, len(data)) - pos, 0)
+        else:
+            data.scanned += match.end() - pos
+        return match
+
+
+
+def countScans(protocol):
+    """
+    Replace the input buffer of the interpreter of C{protocol}, which has not
+    received anything yet, with a L{CountingBuffer}.
+
+    @return: The buffer.
+    """
+    if protocol._trampolinedParser is None:
+        protocol._initializeParserProtocol()
+    interp = protocol._trampolinedParser._interp
+    buffer = CountingBuffer(interp.input.data)
+    interp.input = interp._streamType(buffer, interp.input.position)
+    return buffer
+
+
+
+class LinearParsingMixin(object):
+    """
+    Check that parsing takes work linear in the size of the input.
+    """
+
+    def setUp(self):
+        delimiterPattern = tube._delimiterPattern
+        def countingPattern(delimiters):
+            pattern, longest, prefixes = delimiterPattern(delimiters)
+            return CountingPattern(pattern), longest, prefixes
+        self.patch(tube, '_delimiterPattern', countingPattern)
+
+
+    def parseWork(self, build, data, chunkSize, expected):
+        """
+        Feed C{data} to a protocol in chunks of C{chunkSize} bytes, and return
+        the work it took: the rules applied and the bytes scanned.
+
+        @param build: A function returning a new protocol and a function
+            counting the messages it received.
+        @param expected: The number of messages in C{data}, or C{None} if
+            it depends on the chunks.
+        """
+        profiler = GrammarProfiler()
+        profiler.install()
+        try:
+            protocol, counter = build()
+            protocol.makeConnection(proto_helpers.StringTransport())
+            buffer = countScans(protocol)
+            for i in range(0, len(data), chunkSize):
+                protocol.dataReceived(data[i:i + chunkSize])
+        finally:
+            profiler.uninstall()
+        if expected is not None:
+            self.assertEqual(counter.count, expected)
+        calls = sum(stats['calls'] for rules in profiler.asDict().values()
+                    for stats in rules.values())
+        return calls + buffer.scanned
+
+
+    def assertLinear(self, build, payload, small):
+        """
+        Check that parsing C{payload(GROWTH * small)} takes at most about
+        C{GROWTH} times the work of parsing C{payload(small)}.
+
+        @param payload: A function returning the input of the given size and
+            the number of messages in it.
+        """
+        for chunkSize in CHUNK_SIZES:
+            work = []
+            for size in (small, small * GROWTH):
+                data, expected = payload(size)
+                work.append(self.parseWork(build, data, chunkSize, expected))
+            ratio = work[1] / float(work[0])
+            self.assertTrue(
+                ratio <= GROWTH * SLACK,
+                "%d times more input took %.1f times more work (%d, %d) "
+                "with chunks of %d bytes" % (
+                    GROWTH, ratio, work[0], work[1], chunkSize))
+
+
+
+class LineReceiverComplexityTestCase(LinearParsingMixin,
+                                     unittest.SynchronousTestCase):
+    """
+    Complexity of L{basic.LineOnlyReceiver} and L{basic.LineReceiver}.
+    """
+
+    def test_lineOnlyManyLines(self):
+        """
+        Many short lines are received by L{basic.LineOnlyReceiver} in linear
+        work.
+        """
+        self.assertLinear(
+            receiver(basic.LineOnlyReceiver, 'lineReceived'),
+            lambda n: (b'a line of text\r\n' * n, n), 100)
+
+
+    def test_lineOnlyLongLine(self):
+        """
+        A long line is received by L{basic.LineOnlyReceiver} in linear work,
+        the search for its delimiter resuming where it stopped.
+        """
+        self.assertLinear(
+            receiver(basic.LineOnlyReceiver, 'lineReceived',
+                     MAX_LENGTH=2 ** 20),
+            lambda n: (b'x' * n + b'\r\n', 1), 4000)
+
+
+    def test_lineManyLines(self):
+        """
+        Many short lines are received by L{basic.LineReceiver} in linear
+        work.
+        """
+        self.assertLinear(
+            receiver(basic.LineReceiver, 'lineReceived'),
+            lambda n: (b'a line of text\r\n' * n, n), 100)
+
+
+    def test_lineLongLine(self):
+        """
+        A long line is received by L{basic.LineReceiver} in linear work, the
+        search for its delimiter resuming where it stopped.
+        """
+        self.assertLinear(
+            receiver(basic.LineReceiver, 'lineReceived', MAX_LENGTH=2 ** 20),
+            lambda n: (b'x' * n + b'\r\n', 1), 4000)
+
+
+    def test_lineTooLong(self):
+        """
+        A line longer than C{MAX_LENGTH} is handed to C{lineLengthExceeded} as
+        it arrives.
+        """
+        def build():
+            protocol, counter = receiver(
+                basic.LineReceiver, 'lineLengthExceeded', MAX_LENGTH=100)()
+            protocol.lineReceived = counter
+            return protocol, counter
+        self.assertLinear(build, lambda n: (b'x' * n * 16 + b'\r\n', None),
+                          100)
+
+
+    def test_rawData(self):
+        """
+        Data received in raw mode is passed on in linear work.
+        """
+        def build():
+            protocol, counter = receiver(
+                basic.LineReceiver, 'rawDataReceived')()
+            protocol.setRawMode()
+            return protocol, counter
+        self.assertLinear(build, lambda n: (b'x' * n, n), 200)
+
+
+
+class IntNStringReceiverComplexityTestCase(LinearParsingMixin,
+                                           unittest.SynchronousTestCase):
+    """
+    Complexity of L{basic.Int32StringReceiver}.
+    """
+
+    def test_manyStrings(self):
+        """
+        Many short strings are received in linear work.
+        """
+        self.assertLinear(
+            receiver(basic.Int32StringReceiver, 'stringReceived'),
+            lambda n: ((struct.pack('!I', 10) + b'x' * 10) * n, n), 100)
+
+
+    def test_longString(self):
+        """
+        A long string is received in linear work, its bytes being counted
+        rather than searched.
+        """
+        self.assertLinear(
+            receiver(basic.Int32StringReceiver, 'stringReceived',
+                     MAX_LENGTH=2 ** 31),
+            lambda n: (struct.pack('!I', n) + b'x' * n, 1), 2000)
+
+
+
+class AMPComplexityTestCase(LinearParsingMixin,
+                            unittest.SynchronousTestCase):
+    """
+    Complexity of L{amp.BinaryBoxProtocol}.
+    """
+
+    def test_manyBoxes(self):
+        """
+        Many boxes are received in linear work.
+        """
+        self.assertLinear(
+            ampProtocol, lambda n: (b''.join(box(i) for i in range(n)), n),
+            20)
+
+
+    def test_largeValue(self):
+        """
+        A box with a large value is received in linear work.
+        """
+        self.assertLinear(
+            ampProtocol, lambda n: (box(0, n), 1), 1000)
+
+
+
+class SMTPComplexityTestCase(LinearParsingMixin,
+                             unittest.SynchronousTestCase):
+    """
+    Complexity of L{smtp.SMTP}.
+    """
+
+    def test_manyMails(self):
+        """
+        Many mails are received in linear work.
+        """
+        self.assertLinear(
+            smtpServer, lambda n: (b'HELO example.com\r\n' + mail() * n, n),
+            2)
+
+
+    def test_longMail(self):
+        """
+        A mail of many lines is received in linear work.
+        """
+        self.assertLinear(
+            smtpServer,
+            lambda n: (b'HELO example.com\r\n' + mail(bodyLines=n), 1), 20)
+
+
+    def test_longBodyLine(self):
+        """
+        A mail with a long line in its body is received in linear work.
+        """
+        self.assertLinear(
+            smtpServer,
+            lambda n: (b'HELO example.com\r\n' + mail(1, lineLength=n), 1),
+            4000)
+
+
+
+class IMAP4ComplexityTestCase(LinearParsingMixin,
+                              unittest.SynchronousTestCase):
+    """
+    Complexity of L{imap4.IMAP4Server}.
+    """
+
+    def test_manyCommands(self):
+        """
+        Many commands are received in linear work.
+        """
+        self.assertLinear(
+            imapServer,
+            lambda n: (b''.join(b'a%d NOOP\r\n' % (i,) for i in range(n)),
+                       n), 50)
+
+
+    def test_longCommand(self):
+        """
+        A command with long arguments is received in linear work.
+        """
+        self.assertLinear(
+            imapServer, lambda n: (b'a1 NOOP ' + b'x' * n + b'\r\n', 1),
+            4000)
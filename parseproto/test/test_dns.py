@@ -10,6 +10,7 @@ from __future__ import absolute_import
 
 
 from io import BytesIO
+from random import Random
 import struct
 
 
@@ -21,8 +22,11 @@ from twisted.internet.error import CannotListenError, ConnectionDone
 from twisted.test import proto_helpers
 from twisted.python.failure import Failure
 
+from ometa.runtime import ParseError
+
 # dns import from parsley-protocols
-from parseproto.dns import protocol
+from parseproto.dns import protocol, wire
+from parseproto.util.tube import ParseFailure
 
 
 class DNSParserTests(unittest.TestCase):
@@ -110,6 +114,69 @@ class DNSParserTests(unittest.TestCase):
         self.assertRaises(ValueError, self.parser.name)
 
 
+    def test_sharedGrammar(self):
+        """
+        All the L{DNSParser}s share the parser class of the grammar.
+        """
+        self.assertIs(protocol.DNSParser().grammar, self.parser.grammar)
+
+
+    def test_parseMessage(self):
+        """
+        L{DNSParser.parseMessage} parses a message with compressed names
+        without changing the data given to L{DNSParser.updateData}.
+        """
+        m = dns.Message(id=1234, answer=1)
+        m.queries = [dns.Query(b'example.com', dns.MX)]
+        m.answers = [dns.RRHeader(
+            b'example.com', dns.MX,
+            payload=dns.Record_MX(10, b'mail.example.com'))]
+        self.parser.updateData(b"\x07example\x03com\x00")
+        message = self.parser.parseMessage(m.toStr())
+        self.assertEqual(message.answers[0].payload.name.name,
+                         b'mail.example.com')
+        self.assertEqual(self.parser.name(), dns.Name(b"example.com"))
+
+
+    def test_messageTooManyRecords(self):
+        """
+        L{DNSParser.message} raises a L{ParseFailure} at the counts of the
+        header if they count more records than the data holds.
+        """
+        header = struct.pack('!6H', 1, 0, 1, 1, 0, 0)
+        self.parser.updateData(header + b'\x00' * 15)
+        failure = self.assertRaises(ParseFailure, self.parser.message)
+        self.assertEqual((failure.position, failure.rule), (4, 'message'))
+
+
+    def test_messageBadName(self):
+        """
+        L{DNSParser.message} raises a L{ParseFailure} rather than the
+        L{IndexError} or L{ValueError} of a compressed name pointing out of the
+        message, or in a loop.
+        """
+        header = struct.pack('!6H', 1, 0, 1, 0, 0, 0)
+        for pointer in (b'\xc0\xff', b'\xc0\x0c'):
+            self.parser.updateData(header + pointer + b'\x00\x01\x00\x01')
+            failure = self.assertRaises(ParseFailure, self.parser.message)
+            self.assertEqual((failure.position, failure.rule),
+                             (14, 'message'))
+
+
+    def test_messageDebug(self):
+        """
+        When debugging, L{DNSParser.message} raises whatever the grammar
+        raised.
+        """
+        self.parser.debug = True
+        header = struct.pack('!6H', 1, 0, 1, 0, 0, 0)
+        self.parser.updateData(header + b'\xc0\x0c\x00\x01\x00\x01')
+        self.assertRaises(ValueError, self.parser.message)
+        self.parser.updateData(header + b'\x00\x01')
+        error = self.assertRaises(ParseError, self.parser.message)
+        self.assertNotIsInstance(error, ParseFailure)
+
+
     def test_nameRoundTrip(self):
         """
         Encoding and then parsing the object.
@@ -150,7 +217,8 @@ class DNSParserTests(unittest.TestCase):
         stream.seek(0, 0)
         data = stream.read1(-1)
         self.parser.updateData(data)
-        self.assertEqual(record, getattr(self.parser, 'payload')(name, ttl, length))
+        self.assertEqual(record, getattr(self.parser, 'payload')(
+            getattr(dns, name), ttl, length))
 
 
     def test_SOA(self):
@@ -199,7 +267,7 @@ class DNSParserTests(unittest.TestCase):
             length = e.tell()
             e.seek(0, 0)
             self.parser.updateData(e.read1(-1))
-            rout = getattr(self.parser, 'payload')('NAPTR', None, length)
+            rout = getattr(self.parser, 'payload')(dns.NAPTR, None, length)
             self.assertEqual(rin.order, rout.order)
             self.assertEqual(rin.preference, rout.preference)
             self.assertEqual(rin.flags, rout.flags)
@@ -237,6 +305,34 @@ class DNSParserTests(unittest.TestCase):
         self._recordRoundtripTest(dns.Record_TXT(b'foo', b'bar'), 'TXT')
 
 
+    def test_SPF(self):
+        self._recordRoundtripTest(dns.Record_SPF(b'v=spf1', b'-all'), 'SPF')
+
+
+    def test_nameRecords(self):
+        """
+        The records whose payload is a single name are all read by the same
+        rule, which builds the record of their own type.
+        """
+        for name in ('CNAME', 'DNAME', 'MB', 'MD', 'MF', 'MG', 'MR', 'NS',
+                     'PTR'):
+            record = getattr(dns, 'Record_' + name)(b'example.com')
+            self._recordRoundtripTest(record, name)
+
+
+    def test_unknownType(self):
+        """
+        The payload of a record of a type Twisted does not know is read as an
+        L{dns.UnknownRecord}, while that of a type it knows but the grammar
+        does not read is not read.
+        """
+        self.parser.updateData(b'abc')
+        self.assertEqual(self.parser.payload(65280, 60, 3),
+                         dns.UnknownRecord(b'abc', ttl=60))
+        self.parser.updateData(b'abc')
+        self.assertRaises(ParseError, self.parser.payload, dns.OPT, 60, 3)
+
+
     def test_emptyQuery(self):
         """
         Test that bytes representing an empty query message can be parsed
@@ -338,6 +434,338 @@ class DNSParserTests(unittest.TestCase):
         self.assertTrue(message.answers[0].auth)
 
 
+
+# The fields of a message, which L{dns.Message} is not compared on by the
+# oldest releases of Twisted the package supports.
+MESSAGE_FIELDS = ('id', 'answer', 'opCode', 'auth', 'trunc', 'recDes',
+                  'recAv', 'rCode', 'maxSize', 'queries', 'answers',
+                  'authority', 'additional')
+
+
+
+def fields(value):
+    """
+    Get the fields of a message, or of a part of it, which L{dns.Message}
+    compares.
+
+    Unlike messages, they can be compared whatever bytes the names hold, and
+    whichever version of Twisted builds them.
+    """
+    if isinstance(value, list):
+        return [fields(item) for item in value]
+    if isinstance(value, dns.Name):
+        return value.name
+    if isinstance(value, dns.Query):
+        return (value.name.name, value.type, value.cls)
+    if isinstance(value, dns.Message):
+        return (dns.Message,) + tuple(fields(getattr(value, name))
+                                      for name in MESSAGE_FIELDS)
+    names = getattr(value, 'compareAttributes', None)
+    if names is None:
+        return value
+    return (type(value),) + tuple(fields(getattr(value, name))
+                                  for name in names)
+
+
+
+class WireDecoderTests(unittest.TestCase):
+    """
+    Tests for L{wire.decodeMessage}, against the grammar and
+    L{dns.Message.fromStr}.
+    """
+
+    def setUp(self):
+        self.grammar = protocol.DNSParser().grammar
+
+
+    def message(self, answers=(), authority=(), additional=(), auth=0):
+        """
+        Build an encoded message.
+        """
+        m = dns.Message(id=4321, answer=1, auth=auth, recDes=1, recAv=1,
+                        maxSize=0)
+        m.queries = [dns.Query(b'example.com', dns.ALL_RECORDS)]
+        m.answers, m.authority, m.additional = [
+            [dns.RRHeader(b'example.com', record.TYPE, ttl=record.ttl or 0,
+                          payload=record)
+             for record in records]
+            for records in (answers, authority, additional)]
+        return m.toStr()
+
+
+    def assertDecodedAsGrammar(self, data):
+        """
+        L{wire.decodeMessage} decodes C{data} into the message the grammar
+        and L{dns.Message.fromStr} decode it into.
+        """
+        message = wire.decodeMessage(data)
+        self.assertIsNot(message, None)
+        self.assertEqual(fields(message),
+                         fields(self.grammar(data).message()))
+        expected = dns.Message()
+        expected.fromStr(data)
+        self.assertEqual(fields(message), fields(expected))
+
+
+    def test_usualRecords(self):
+        """
+        Messages holding the usual record types, with compressed names, are
+        decoded as the grammar and L{dns.Message.fromStr} decode them.
+        """
+        self.assertDecodedAsGrammar(self.message(
+            answers=[
+                dns.Record_A('10.0.0.1', ttl=300),
+                dns.Record_AAAA('2001:db8::1', ttl=300),
+                dns.Record_CNAME(b'www.example.com', ttl=300),
+                dns.Record_MX(10, b'mail.example.com', ttl=300),
+                dns.Record_PTR(b'host.example.org', ttl=300),
+                dns.Record_SRV(1, 2, 5060, b'sip.example.com', ttl=300),
+                dns.Record_TXT(b'v=spf1 -all', b'', b'x' * 255, ttl=300),
+                dns.Record_TXT(ttl=300)],
+            authority=[
+                dns.Record_NS(b'ns1.example.com', ttl=600),
+                dns.Record_SOA(b'ns1.example.com', b'admin.example.com',
+                               2 ** 32 - 1, 7200, 3600, 1209600, 300,
+                               ttl=600)],
+            additional=[dns.Record_A('10.0.0.53', ttl=0)]))
+
+
+    def test_flags(self):
+        """
+        The flags of the header are decoded as the grammar decodes them.
+        """
+        self.assertDecodedAsGrammar(self.message(
+            answers=[dns.Record_A('10.0.0.1', ttl=300)], auth=1))
+        data = self.message()
+        for byte3 in (0x00, 0x0f, 0x82):
+            for byte4 in (0x00, 0x83):
+                self.assertDecodedAsGrammar(
+                    data[:2] + chr(byte3) + chr(byte4) + data[4:])
+
+
+    def test_unusualRecords(self):
+        """
+        A message holding records of other types is left to the grammar.
+        """
+        for record in [dns.Record_HINFO(b'cpu', b'os', ttl=300),
+                       dns.Record_NULL(b'null', ttl=300),
+                       dns.Record_WKS('10.0.0.1', 6, b'\x00\x01', ttl=300)]:
+            data = self.message(answers=[dns.Record_A('10.0.0.1', ttl=300)],
+                                additional=[record])
+            self.assertIs(wire.decodeMessage(data), None)
+            self.assertEqual(
+                self.grammar(data).message().additional[0].payload, record)
+
+
+    def test_malformed(self):
+        """
+        A message the grammar does not decode as the record types call for,
+        or rejects, is left to it.
+        """
+        data = self.message(answers=[dns.Record_A('10.0.0.1', ttl=300)])
+        # An rdlength which does not match the address, trailing data, a
+        # truncated record and a compressed name pointing out of the message.
+        for bad in [data[:-6] + b'\x00\x05' + data[-4:] + b'\x00',
+                    data + b'\x00',
+                    data[:-1],
+                    data[:12] + b'\xc0\xff' + data[-14:]]:
+            self.assertIs(wire.decodeMessage(bad), None)
+
+
+    def test_mutations(self):
+        """
+        Whatever the bytes of a message are changed to, it is either decoded
+        as the grammar decodes it, or left to the grammar.
+        """
+        data = self.message(
+            answers=[dns.Record_A('10.0.0.1', ttl=300),
+                     dns.Record_MX(10, b'mail.example.com', ttl=300),
+                     dns.Record_TXT(b'txt', b'', ttl=300)],
+            authority=[dns.Record_SOA(b'ns1.example.com', b'admin.example.com',
+                                      ttl=600)])
+        random = Random(6)
+        decoded = 0
+        for i in range(300):
+            bad = bytearray(data)
+            for j in range(random.randint(1, 3)):
+                bad[random.randrange(len(bad))] = random.randrange(256)
+            bad = bytes(bad)
+            message = wire.decodeMessage(bad)
+            if message is None:
+                continue
+            decoded += 1
+            self.assertEqual(fields(message),
+                             fields(self.grammar(bad).message()))
+        self.assertTrue(decoded > 0)
+
+
+    def test_parser(self):
+        """
+        L{protocol.DNSParser.parseMessage} decodes the usual messages without
+        the grammar.
+        """
+        parser = protocol.DNSParser()
+        parser.grammar = None
+        data = self.message(answers=[dns.Record_A('10.0.0.1', ttl=300)])
+        self.assertEqual(fields(parser.parseMessage(data)),
+                         fields(wire.decodeMessage(data)))
+
+
+
+class DecompressNameTests(unittest.TestCase):
+    """
+    Tests for L{wire.decompressName}.
+    """
+
+    # www.example.com, then mail and a pointer to example.com at 17, then a
+    # pointer to mail.example.com at 24.
+    data = b'\x03www\x07example\x03com\x00\x04mail\xc0\x04\xc0\x11'
+
+    def test_names(self):
+        """
+        L{wire.decompressName} reads the name at an offset, following its
+        pointers, and remembers the name read from every label on the way.
+        """
+        names = {}
+        self.assertEqual(wire.decompressName(self.data, 24, names),
+                         b'mail.example.com')
+        self.assertEqual(names, {24: b'mail.example.com',
+                                 17: b'mail.example.com', 22: b'example.com',
+                                 4: b'example.com', 12: b'com', 16: b''})
+        self.assertEqual(wire.decompressName(self.data, 0, names),
+                         b'www.example.com')
+        self.assertEqual(names[0], b'www.example.com')
+
+
+    def test_remembered(self):
+        """
+        A name already read is not read again.
+        """
+        names = {4: b'example.org'}
+        self.assertEqual(wire.decompressName(self.data, 17, names),
+                         b'mail.example.org')
+
+
+    def test_loop(self):
+        """
+        A name pointing back into itself, through any number of pointers,
+        raises L{ValueError}, and is not remembered.
+        """
+        names = {}
+        for data in (b'\xc0\x00', b'\x01a\xc0\x04\x01b\xc0\x00'):
+            self.assertRaises(ValueError, wire.decompressName, data, 0, names)
+        self.assertEqual(names, {})
+
+
+
+class LazyMessageTests(unittest.TestCase):
+    """
+    Tests for L{wire.LazyMessage}.
+    """
+
+    def setUp(self):
+        self.parser = protocol.DNSParser()
+        self.parsed = []
+
+
+    def parse(self, data):
+        """
+        Parse a message with the grammar, recording it.
+        """
+        self.parsed.append(data)
+        return self.parser.grammar(data).message()
+
+
+    def message(self, records, trunc=0):
+        """
+        Build an encoded message with C{records} as answers.
+        """
+        m = dns.Message(id=4321, answer=1, trunc=trunc, maxSize=0)
+        m.queries = [dns.Query(b'example.com', dns.ALL_RECORDS)]
+        m.answers = [dns.RRHeader(b'example.com', record.TYPE, ttl=300,
+                                  payload=record)
+                     for record in records]
+        return m.toStr()
+
+
+    def test_records(self):
+        """
+        The header and the queries of a L{wire.LazyMessage} are decoded at
+        once, and its records when first read, by the grammar if they need
+        it.
+        """
+        data = self.message([dns.Record_A('10.0.0.1', ttl=300),
+                             dns.Record_HINFO(b'cpu', b'os', ttl=300)])
+        message = wire.LazyMessage(data, self.parse)
+        self.assertEqual((message.id, message.queries),
+                         (4321, [dns.Query(b'example.com', dns.ALL_RECORDS)]))
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(message.answers, self.parse(data).answers)
+        self.assertEqual(self.parsed, [data, data])
+        self.assertEqual(fields(message), fields(self.parse(data)))
+
+
+    def test_usualRecords(self):
+        """
+        A L{wire.LazyMessage} holding only the usual record types is decoded
+        without the grammar.
+        """
+        data = self.message([dns.Record_A('10.0.0.1', ttl=300),
+                             dns.Record_MX(10, b'mail.example.com', ttl=300)])
+        message = wire.LazyMessage(data, self.parse)
+        message.decodeRecords()
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(fields(message), fields(wire.decodeMessage(data)))
+
+
+    def test_truncated(self):
+        """
+        A truncated L{wire.LazyMessage} holds the records which fit in it, as
+        L{dns.Message.fromStr} decodes it.
+        """
+        records = [dns.Record_A('10.0.0.1', ttl=300),
+                   dns.Record_HINFO(b'cpu', b'os', ttl=300),
+                   dns.Record_A('10.0.0.2', ttl=300)]
+        data = self.message(records, trunc=1)[:-2]
+        expected = dns.Message()
+        expected.fromStr(data)
+        self.assertEqual(len(expected.answers), 2)
+        self.assertEqual(fields(wire.LazyMessage(data, self.parse)),
+                         fields(expected))
+
+
+    def test_malformed(self):
+        """
+        A L{wire.LazyMessage} whose records cannot be found raises the
+        L{ParseError} of the grammar when created, and one whose records
+        cannot be decoded has empty sections when they are first read.
+        """
+        data = self.message([dns.Record_A('10.0.0.1', ttl=300)])
+        self.assertRaises(ParseError, wire.LazyMessage, data[:-1],
+                          self.parser.parseMessage)
+        # The name of the answer points back into itself.
+        looped = data[:29] + b'\xc0\x1d' + data[31:]
+        message = wire.LazyMessage(looped, self.parser.parseMessage)
+        self.assertRaises(ParseFailure, message.decodeRecords)
+        message = wire.LazyMessage(looped, self.parser.parseMessage)
+        self.assertEqual(
+            (message.answers, message.authority, message.additional),
+            ([], [], []))
+
+
+    def test_debug(self):
+        """
+        When debugging, L{protocol.DNSParser.parseMessage} decodes the whole
+        of a lazy message with the grammar.
+        """
+        self.parser.debug = True
+        data = self.message([dns.Record_A('10.0.0.1', ttl=300)])
+        message = self.parser.parseMessage(data, lazy=True)
+        self.assertIsInstance(message, wire.LazyMessage)
+        self.assertEqual(fields(message), fields(self.parse(data)))
+
+
+
 class TestController(object):
     """
     Pretend to be a DNS query processor for a DNSDatagramProtocol.
@@ -388,6 +816,18 @@ class DNSDatagramProtocolTestCases(unittest.TestCase):
         self.assertEqual(self.controller.messages, [])
 
 
+    def test_malformedPacket(self):
+        """
+        A datagram which is not a DNS message, even one with a compressed name
+        pointing out of it, is dropped without logging an error.
+        """
+        header = struct.pack('!6H', 1, 0, 1, 0, 0, 0)
+        for datagram in (header * 2, header + b'\xc0\xff\x00\x01\x00\x01'):
+            self.proto.datagramReceived(
+                datagram, address.IPv4Address('UDP', '127.0.0.1', 12345))
+        self.assertEqual(self.controller.messages, [])
+
+
     def test_simpleQuery(self):
         """
         Test content received after a query.
@@ -404,6 +844,85 @@ class DNSDatagramProtocolTestCases(unittest.TestCase):
         return d
 
 
+    def answer(self, id):
+        """
+        Build an encoded answer to a query, whose record names point back
+        into themselves.
+        """
+        m = dns.Message(id=id, answer=1)
+        m.answers = [dns.RRHeader(b'foo', payload=dns.Record_A('1.2.3.4'))]
+        data = m.toStr()
+        return data[:12] + b'\xc0\x0c' + data[17:]
+
+
+    def test_malformedRecords(self):
+        """
+        An answer whose records cannot be decoded is dropped, and the query
+        still waits for its answer.
+        """
+        d = self.proto.query(('127.0.0.1', 21345), [dns.Query(b'foo')])
+        id = next(iter(self.proto.liveMessages))
+        self.proto.datagramReceived(self.answer(id), ('127.0.0.1', 21345))
+        self.assertIn(id, self.proto.liveMessages)
+        self.assertEqual(self.controller.messages, [])
+        self.clock.advance(10)
+        return self.assertFailure(d, dns.DNSQueryTimeoutError)
+
+
+    def test_resentQueryAnswer(self):
+        """
+        An answer to a query sent again, which is no longer waited for, is
+        dropped without its records being decoded.
+        """
+        logged = []
+        self.patch(protocol.log, 'msg', logged.append)
+        self.proto.resends[1234] = 1
+        self.proto.datagramReceived(self.answer(1234), ('127.0.0.1', 21345))
+        self.assertEqual((self.controller.messages, logged), ([], []))
+
+
+    def test_truncatedAnswer(self):
+        """
+        A truncated answer is delivered with the records which fit in it,
+        decoded when first read.
+        """
+        d = self.proto.query(('127.0.0.1', 21345), [dns.Query(b'foo')])
+        id = next(iter(self.proto.liveMessages))
+        m = dns.Message(id=id, answer=1, trunc=1)
+        m.answers = [
+            dns.RRHeader(b'foo', payload=dns.Record_A('1.2.3.4', ttl=0)),
+            dns.RRHeader(b'foo', payload=dns.Record_A('1.2.3.5', ttl=0))]
+        self.proto.datagramReceived(m.toStr()[:-2], ('127.0.0.1', 21345))
+        def cb(result):
+            self.assertTrue(result.trunc)
+            self.assertNotIdentical(result._spans, None)
+            self.assertEqual(result.answers, m.answers[:1])
+        return d.addCallback(cb)
+
+
+    def test_malformedTruncatedAnswer(self):
+        """
+        A truncated answer whose records cannot be decoded is delivered, for
+        the query to be sent again over TCP, and its sections are empty when
+        read.
+        """
+        logged = []
+        self.patch(wire.log, 'msg', logged.append)
+        d = self.proto.query(('127.0.0.1', 21345), [dns.Query(b'foo')])
+        id = next(iter(self.proto.liveMessages))
+        data = self.answer(id)
+        data = data[:2] + chr(ord(data[2]) | 0x02) + data[3:]
+        self.proto.datagramReceived(data, ('127.0.0.1', 21345))
+        def cb(result):
+            self.assertTrue(result.trunc)
+            self.assertEqual(
+                (result.answers, result.authority, result.additional),
+                ([], [], []))
+            self.assertEqual(logged, [
+                "Dropped the malformed records of DNS message %d" % (id,)])
+        return d.addCallback(cb)
+
+
     def test_queryTimeout(self):
         """
         Test that query timeouts after some seconds.
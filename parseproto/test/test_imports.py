@@ -0,0 +1,94 @@
+"""
+Importing the protocols of each package must stay cheap for short-lived
+processes, which may import a protocol they never speak: Parsley, the reactor
+and the resolver must not be used at import time.
+
+Each module is imported in a fresh interpreter, which checks exactly what the
+import used.  How long the imports take is measured by
+C{parseproto/profile/importtime.py}, against a budget per package.
+"""
+
+import os
+import subprocess
+import sys
+
+from twisted.trial import unittest
+
+
+# The module imported for each package.
+MODULES = {
+    'parseproto.util': 'parseproto.util.sansio',
+    'parseproto.basic': 'parseproto.basic.protocol',
+    'parseproto.amp': 'parseproto.amp.amp',
+    'parseproto.smtp': 'parseproto.smtp.smtp',
+    'parseproto.imap4': 'parseproto.imap4.imap4',
+    'parseproto.dns': 'parseproto.dns.protocol',
+}
+
+# The modules which no package may import at import time.
+LAZY = ['ometa', 'parsley', 'twisted.internet.reactor']
+
+# Import a module with the path of this process, failing if it looks the
+# host name up, and print the lazy modules it imported.
+IMPORT = """
+import site, socket, sys
+
+for entry in %r:
+    if entry not in sys.path:
+        site.addsitedir(entry)
+
+def lookup(*args):
+    raise RuntimeError("host name looked up at import time")
+socket.getfqdn = socket.gethostname = lookup
+
+__import__(%r)
+print(' '.join(name for name in %r if name in sys.modules))
+"""
+
+
+
+def importedLazily(module):
+    """
+    Import C{module} in a fresh interpreter.
+
+    @return: The names of the modules of L{LAZY} it imported.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    out = subprocess.check_output(
+        [sys.executable, '-c', IMPORT % (sys.path, module, LAZY)], cwd=root)
+    return out.decode('ascii').split()
+
+
+
+class LazyImportTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for what importing the packages of parseproto does.
+    """
+
+    def assertImportsLazily(self, package):
+        self.assertEqual(importedLazily(MODULES[package]), [])
+
+
+    def test_util(self):
+        self.assertImportsLazily('parseproto.util')
+
+
+    def test_basic(self):
+        self.assertImportsLazily('parseproto.basic')
+
+
+    def test_amp(self):
+        self.assertImportsLazily('parseproto.amp')
+
+
+    def test_smtp(self):
+        self.assertImportsLazily('parseproto.smtp')
+
+
+    def test_imap4(self):
+        self.assertImportsLazily('parseproto.imap4')
+
+
+    def test_dns(self):
+        self.assertImportsLazily('parseproto.dns')
@@ -0,0 +1,346 @@
+"""
+Tests for the sans-I/O parsers of parseproto.
+"""
+
+from __future__ import absolute_import
+
+import struct
+
+from twisted.names import dns
+from twisted.protocols import amp as twisted_amp
+from twisted.trial import unittest
+
+from parseproto.amp.sansio import BoxParser, BoxReceived
+from parseproto.basic.sansio import (
+    Int16StringParser, Int32LEStringParser, Int32StringParser,
+    InvalidNetstring,
+    LengthLimitExceeded, LineLengthExceeded, LineOnlyParser, LineParser,
+    LineReceived, NetstringParser, RawDataReceived, StringChunkReceived,
+    StringFinished, StringReceived, StringStarted, UNIVERSAL_NEWLINES,
+    VarintStringParser)
+from parseproto.dns.sansio import (
+    DNSDatagramParser, DNSStreamParser, MessageReceived)
+from parseproto.imap4 import sansio as imap4
+from parseproto.smtp import sansio as smtp
+
+
+
+def feedBytes(parser, data):
+    """
+    Feed C{data} to C{parser} one byte at a time.
+
+    @return: All the events returned.
+    """
+    events = []
+    for i in range(len(data)):
+        events.extend(parser.feed(data[i:i + 1]))
+    return events
+
+
+
+class LineParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{LineOnlyParser} and L{LineParser}.
+    """
+
+    def test_lineOnly(self):
+        """
+        L{LineOnlyParser.feed} returns the lines received so far, once.
+        """
+        parser = LineOnlyParser()
+        self.assertEqual(parser.feed(b'foo\r\nbar\r\nba'),
+                         [LineReceived(b'foo'), LineReceived(b'bar')])
+        self.assertEqual(parser.feed(b'z'), [])
+        self.assertEqual(parser.feed(b'\r\n'), [LineReceived(b'baz')])
+
+
+    def test_chunks(self):
+        """
+        The events do not depend on how the data is split.
+        """
+        data = b'foo\r\n\r\nbar\r\n'
+        self.assertEqual(feedBytes(LineParser(), data),
+                         LineParser().feed(data))
+
+
+    def test_tooLong(self):
+        """
+        A line longer than C{MAX_LENGTH} is a L{LineLengthExceeded} event.
+        """
+        parser = LineOnlyParser()
+        parser.MAX_LENGTH = 3
+        self.assertEqual(parser.feed(b'abcd\r\nabc\r\n'),
+                         [LineLengthExceeded(b'abcd'), LineReceived(b'abc')])
+
+
+    def test_rawMode(self):
+        """
+        After L{LineParser.setRawMode}, the data received is returned as
+        L{RawDataReceived} events, until L{LineParser.setLineMode}.
+        """
+        parser = LineParser()
+        parser.delimiter = b'\n'
+        self.assertEqual(parser.feed(b'foo\n'), [LineReceived(b'foo')])
+        parser.setRawMode()
+        events = parser.feed(b'raw')
+        self.assertEqual(set(type(event) for event in events),
+                         set([RawDataReceived]))
+        self.assertEqual(b''.join(event.data for event in events), b'raw')
+        parser.setLineMode()
+        self.assertEqual(parser.feed(b'bar\n'), [LineReceived(b'bar')])
+
+
+
+    def test_delimiters(self):
+        """
+        With C{delimiters} set, lines may end with any of them.
+        """
+        parser = LineParser()
+        parser.delimiters = UNIVERSAL_NEWLINES
+        self.assertEqual(feedBytes(parser, b'foo\nbar\r\nbaz\rq'), [
+            LineReceived(b'foo'), LineReceived(b'bar'), LineReceived(b'baz')])
+
+
+
+class IntNStringParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{IntNStringParser} and its subclasses.
+    """
+
+    def test_strings(self):
+        """
+        Length-prefixed strings are L{StringReceived} events.
+        """
+        data = struct.pack('!I', 3) + b'foo' + struct.pack('!I', 0)
+        self.assertEqual(feedBytes(Int32StringParser(), data),
+                         [StringReceived(b'foo'), StringReceived(b'')])
+
+
+    def test_otherPrefixes(self):
+        """
+        The length prefix may be little-endian, or a varint.
+        """
+        data = struct.pack('<I', 3) + b'foo' + struct.pack('<I', 0)
+        self.assertEqual(feedBytes(Int32LEStringParser(), data),
+                         [StringReceived(b'foo'), StringReceived(b'')])
+        data = b'\x03foo\x80\x01' + b'x' * 128
+        self.assertEqual(feedBytes(VarintStringParser(), data),
+                         [StringReceived(b'foo'), StringReceived(b'x' * 128)])
+
+
+    def test_streaming(self):
+        """
+        In streaming mode, strings are returned as they are received.
+        """
+        parser = Int16StringParser()
+        parser.streaming = True
+        self.assertEqual(parser.feed(b'\x00\x05ab'),
+                         [StringStarted(5), StringChunkReceived(b'ab')])
+        self.assertEqual(parser.feed(b'cde\x00\x01f'), [
+            StringChunkReceived(b'cde'), StringFinished(),
+            StringStarted(1), StringChunkReceived(b'f'), StringFinished()])
+
+
+    def test_lengthLimitExceeded(self):
+        """
+        A length prefix larger than C{MAX_LENGTH} is a L{LengthLimitExceeded}
+        event.
+        """
+        parser = Int16StringParser()
+        parser.MAX_LENGTH = 10
+        self.assertEqual(parser.feed(struct.pack('!H', 11)),
+                         [LengthLimitExceeded(11)])
+
+
+
+class NetstringParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{NetstringParser}.
+    """
+
+    def test_strings(self):
+        """
+        Netstrings are L{StringReceived} events.
+        """
+        self.assertEqual(feedBytes(NetstringParser(), b'3:foo,0:,'),
+                         [StringReceived(b'foo'), StringReceived(b'')])
+
+
+    def test_invalid(self):
+        """
+        Invalid data is an L{InvalidNetstring} event, after which nothing is
+        parsed.
+        """
+        parser = NetstringParser()
+        self.assertEqual(parser.feed(b'1:a,x1:b,'),
+                         [StringReceived(b'a'), InvalidNetstring()])
+        self.assertEqual(parser.feed(b'1:c,'), [])
+
+
+
+class BoxParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{BoxParser}.
+    """
+
+    def test_boxes(self):
+        """
+        AMP boxes are L{BoxReceived} events holding their keys and values.
+        """
+        first = {b'_command': b'Sum', b'a': b'1'}
+        second = {b'_answer': b'1', b'total': b'3'}
+        data = (twisted_amp.AmpBox(first).serialize() +
+                twisted_amp.AmpBox(second).serialize())
+        self.assertEqual(feedBytes(BoxParser(), data),
+                         [BoxReceived(first), BoxReceived(second)])
+
+
+
+class SMTPParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{smtp.SMTPParser}.
+    """
+
+    def test_session(self):
+        """
+        Commands are L{smtp.CommandReceived} events, and the data following
+        C{DATA} is returned line by line, unescaped.
+        """
+        data = (b'HELO example.com\r\n'
+                b'MAIL FROM:<alice@example.com>\r\n'
+                b'RCPT TO:<bob@example.com>\r\n'
+                b'DATA\r\n'
+                b'Subject: hi\r\n'
+                b'..dot\r\n'
+                b'.\r\n'
+                b'QUIT\r\n')
+        self.assertEqual(feedBytes(smtp.SMTPParser(), data), [
+            smtp.CommandReceived(b'HELO', b'example.com'),
+            smtp.CommandReceived(b'MAIL', b'<alice@example.com>'),
+            smtp.CommandReceived(b'RCPT', b'<bob@example.com>'),
+            smtp.CommandReceived(b'DATA', b''),
+            smtp.DataLineReceived(b'Subject: hi'),
+            smtp.DataLineReceived(b'.dot'),
+            smtp.DataFinished(),
+            smtp.CommandReceived(b'QUIT', b''),
+        ])
+
+
+    def test_unknownCommand(self):
+        """
+        Unknown commands are returned with their name, and extensions are
+        unknown commands unless C{esmtp} is set.
+        """
+        parser = smtp.SMTPParser()
+        self.assertEqual(parser.feed(b'EHLO example.com\r\n'),
+                         [smtp.CommandReceived(b'EHLO', b'example.com')])
+        self.assertEqual(parser.feed(b'NOOP\r\n'),
+                         [smtp.CommandReceived(b'NOOP', b'')])
+
+
+    def test_syntaxError(self):
+        """
+        A malformed address is a L{smtp.SyntaxErrorReceived} event.
+        """
+        parser = smtp.SMTPParser()
+        self.assertEqual(parser.feed(b'MAIL TO:<bob@example.com>\r\n')[0],
+                         smtp.SyntaxErrorReceived(b'MAIL'))
+
+
+    def test_auth(self):
+        """
+        The responses of an authentication exchange are returned in
+        L{smtp.AUTH} mode.
+        """
+        parser = smtp.SMTPParser()
+        parser.esmtp = True
+        self.assertEqual(parser.feed(b'AUTH PLAIN\r\n'),
+                         [smtp.CommandReceived(b'AUTH', b'PLAIN')])
+        parser.mode = smtp.AUTH
+        self.assertEqual(parser.feed(b'Zm9v\r\n'),
+                         [smtp.AuthResponseReceived(b'Zm9v')])
+
+
+
+class IMAP4ParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{imap4.IMAP4Parser}.
+    """
+
+    def test_commands(self):
+        """
+        Commands are L{imap4.CommandReceived} events.
+        """
+        self.assertEqual(
+            imap4.IMAP4Parser().feed(b'a1 noop\r\na2 SELECT INBOX\r\n'), [
+                imap4.CommandReceived(b'a1', b'NOOP', b''),
+                imap4.CommandReceived(b'a2', b'SELECT', b'INBOX')])
+
+
+    def test_literal(self):
+        """
+        A literal announced at the end of a line is a
+        L{imap4.LiteralReceived} event, and the rest of the command a
+        L{imap4.ContinuationReceived} event.
+        """
+        data = b'a1 LOGIN {5}\r\nalice {6}\r\nsecret\r\na2 NOOP\r\n'
+        self.assertEqual(feedBytes(imap4.IMAP4Parser(), data), [
+            imap4.CommandReceived(b'a1', b'LOGIN', b'{5}'),
+            imap4.LiteralReceived(b'alice'),
+            imap4.ContinuationReceived(b' {6}'),
+            imap4.LiteralReceived(b'secret'),
+            imap4.ContinuationReceived(b''),
+            imap4.CommandReceived(b'a2', b'NOOP', b''),
+        ])
+
+
+    def test_idle(self):
+        """
+        The line ending an C{IDLE} command is a
+        L{imap4.ContinuationReceived} event.
+        """
+        self.assertEqual(
+            imap4.IMAP4Parser().feed(b'a1 IDLE\r\nDONE\r\na2 NOOP\r\n'), [
+                imap4.CommandReceived(b'a1', b'IDLE', b''),
+                imap4.ContinuationReceived(b'DONE'),
+                imap4.CommandReceived(b'a2', b'NOOP', b'')])
+
+
+
+class DNSParserTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{DNSDatagramParser} and L{DNSStreamParser}.
+    """
+
+    def setUp(self):
+        message = dns.Message(id=1234, answer=1)
+        message.queries = [dns.Query(b'example.com', dns.A)]
+        message.answers = [dns.RRHeader(
+            b'example.com', payload=dns.Record_A('10.0.0.1', ttl=60))]
+        self.message = message.toStr()
+
+
+    def assertMessage(self, event):
+        self.assertIsInstance(event, MessageReceived)
+        self.assertEqual(event.message.id, 1234)
+        self.assertEqual(event.message.answers[0].payload.dottedQuad(),
+                         '10.0.0.1')
+
+
+    def test_datagram(self):
+        """
+        L{DNSDatagramParser.feed} returns the message in a datagram.
+        """
+        [event] = DNSDatagramParser().feed(self.message)
+        self.assertMessage(event)
+
+
+    def test_stream(self):
+        """
+        L{DNSStreamParser} returns the length-prefixed messages of a stream.
+        """
+        data = (struct.pack('!H', len(self.message)) + self.message) * 2
+        events = feedBytes(DNSStreamParser(), data)
+        self.assertEqual(len(events), 2)
+        for event in events:
+            self.assertMessage(event)
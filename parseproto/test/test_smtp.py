@@ -714,6 +714,23 @@ class SMTPHelperTestCase(unittest.TestCase):
             bytes.decode('xtext'))
 
 
+    def test_getDNSName(self):
+        """
+        L{smtp.getDNSName} looks the name of the host up on its first call
+        only, and is the default name of a server.
+        """
+        lookups = []
+        def lookup():
+            lookups.append(None)
+            return 'mail.example.com'
+        self.patch(smtp.socket, 'getfqdn', lookup)
+        self.patch(smtp.socket, 'gethostname', lookup)
+        self.patch(smtp, '_dnsName', None)
+        self.assertEqual(smtp.getDNSName(), 'mail.example.com')
+        self.assertEqual(smtp.SMTP().host, 'mail.example.com')
+        self.assertEqual(len(lookups), 1)
+
+
 
 class NoticeTLSClient(MyESMTPClient):
     tls = False
@@ -1069,6 +1086,22 @@ class SMTPServerTestCase(unittest.TestCase):
         self.assertIn("ESMTP", t.value())
 
 
+    def test_multilineReplyWrittenOnce(self):
+        """
+        The lines of a multiline reply are written to the transport in one
+        C{writeSequence} call.
+        """
+        s = smtp.SMTP()
+        t = StringTransport()
+        s.makeConnection(t)
+        writes = []
+        t.writeSequence = writes.append
+        s.sendCode(250, 'first\nsecond\nlast')
+        s.connectionLost(error.ConnectionDone())
+        self.assertEqual(writes, [['250-first', '\r\n', '250-second', '\r\n',
+                                   '250 last', '\r\n']])
+
+
     def test_acceptSenderAddress(self):
         """
         Test that a C{MAIL FROM} command with an acceptable address is
@@ -0,0 +1,98 @@
+# -*- test-case-name: parseproto.util.test.test_aio -*-
+"""
+asyncio protocols driving the sans-I/O parsers of parseproto.
+
+These run the grammars of parseproto on an asyncio event loop, including
+uvloop's, instead of the Twisted reactor::
+
+    class Echo(aio.BufferedParserProtocol):
+        parserFactory = LineParser
+
+        def eventReceived(self, event):
+            self.transport.write(event.line + b'\\r\\n')
+
+    loop.create_server(Echo, host, port)
+
+Any of the parsers may be used: L{LineParser
+<parseproto.basic.sansio.LineParser>} and L{Int32StringParser
+<parseproto.basic.sansio.Int32StringParser>} for the basic protocols,
+L{BoxParser <parseproto.amp.sansio.BoxParser>} for AMP, L{SMTPParser
+<parseproto.smtp.sansio.SMTPParser>} and L{IMAP4Parser
+<parseproto.imap4.sansio.IMAP4Parser>} for the servers.
+
+Events are delivered as soon as the grammar recognizes them, so that a
+protocol may change the mode of its parser for the data following an event,
+as the Twisted protocols do from their callbacks.
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+
+
+
+class ParserProtocol(asyncio.Protocol):
+    """
+    An asyncio protocol feeding the data it receives to a sans-I/O parser.
+
+    @ivar parser: The parser, whose events are delivered to
+        L{eventReceived}.
+    @type parser: L{parseproto.util.sansio.Parser}
+    @ivar transport: The transport of the connection, or C{None} when it is
+        not connected.
+    @cvar parserFactory: The callable creating the parser when none is
+        given.
+    """
+    transport = None
+    parserFactory = None
+
+    def __init__(self, parser=None):
+        if parser is None:
+            parser = self.parserFactory()
+        self.parser = parser
+        parser.eventReceived = self.eventReceived
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+    def data_received(self, data):
+        self.parser.dataReceived(data)
+
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+
+    def eventReceived(self, event):
+        """
+        Override this for when the parser recognizes an event.
+        """
+        raise NotImplementedError
+
+
+
+class BufferedParserProtocol(ParserProtocol, asyncio.BufferedProtocol):
+    """
+    An asyncio protocol receiving data into a buffer allocated once for the
+    lifetime of the connection, and feeding it to a sans-I/O parser from
+    there.
+
+    The data is copied out of the buffer as C{bytes} before it is parsed,
+    since the parser may pass it on in its events, such as the chunks of a
+    streamed string, which must not change when the buffer is reused.
+
+    @cvar bufferSize: The size of the buffer.
+    """
+    bufferSize = 65536
+    _buffer = None
+
+    def get_buffer(self, sizehint):
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(self.bufferSize))
+        return self._buffer
+
+
+    def buffer_updated(self, nbytes):
+        self.parser.dataReceived(bytes(self._buffer[:nbytes]))
@@ -0,0 +1,386 @@
+# -*- test-case-name: parseproto.util.test.test_grammar -*-
+"""
+A process-wide registry of compiled Parsley grammars.
+
+Every parsley-driven protocol needs the term tree of its grammar before it can
+parse anything, and L{DNSParser<parseproto.dns.protocol.DNSParser>} needs a
+parser class generated from its grammar.  Both are expensive to build, so they
+are built once per process and shared by every protocol instance.
+
+They are also compiled ahead of time into Python modules, much like C{.pyc}
+files: the module for C{<package>/<name>.parsley} is written to
+C{<package>/_generated/<name>.py} and records the digest of the grammar source
+and the Parsley version it was built with.  A module which does not match the
+current source or Parsley is rebuilt on first use.  Run this module as a
+script to build the modules of a source tree::
+
+    python -m parseproto.util.grammar [DIRECTORY ...]
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import imp
+import os
+import py_compile
+import sys
+import tempfile
+import threading
+
+import parsley
+from ometa.builder import moduleFromGrammar, writePython
+from ometa.grammar import OMeta
+from ometa.runtime import OMetaBase
+
+
+
+def grammarPath(pkg, name):
+    """
+    Locate the source of a grammar shipped inside a package.
+
+    @param pkg: The package containing the grammar.
+    @param name: The name of the grammar, without the C{.parsley} extension.
+
+    @return: The absolute path of the grammar source.
+    """
+    base = os.path.dirname(os.path.abspath(pkg.__file__))
+    return os.path.join(base, name + ".parsley")
+
+
+
+def generatedPath(path):
+    """
+    Locate the generated module of a grammar.
+
+    @param path: The path of the grammar source.
+
+    @return: The path of the generated Python module.
+    """
+    base, filename = os.path.split(path)
+    name = os.path.splitext(filename)[0]
+    return os.path.join(base, "_generated", name + ".py")
+
+
+
+def _writeTerm(term):
+    """
+    Write the body of a function which rebuilds a term tree.
+
+    Every node is bound to its own local variable, children first, so that the
+    generated code never nests deeper than one call.
+
+    @return: A list of source lines ending with a C{return} of the root.
+    """
+    lines = []
+    tags = {}
+
+    def visit(t):
+        args = [visit(a) for a in t.args]
+        tag = tags.get(t.tag.name)
+        if tag is None:
+            tag = tags[t.tag.name] = "_tag%d" % (len(tags),)
+            lines.append("    %s = Tag(%r)" % (tag, t.tag.name))
+        var = "_t%d" % (len(lines),)
+        lines.append("    %s = Term(%s, %r, (%s), None)" % (
+            var, tag, t.data, "".join(a + ", " for a in args)))
+        return var
+
+    lines.append("    return %s" % (visit(term),))
+    return lines
+
+
+
+def _digest(src):
+    """
+    Get the SHA-1 hex digest of a grammar source, read as text on Python 3.
+    """
+    if not isinstance(src, bytes):
+        src = src.encode("utf-8")
+    return hashlib.sha1(src).hexdigest()
+
+
+
+def generateModule(src, name):
+    """
+    Compile a grammar into the source of a Python module.
+
+    The module defines C{SOURCE_DIGEST}, C{PARSLEY_VERSION}, the term tree of
+    the grammar as C{grammar} and the C{createParserClass} function Parsley
+    generates for it.  Parsley does not quote every literal correctly, so
+    C{createParserClass} is left out when its code does not compile.
+
+    @param src: The grammar source.
+    @param name: The name of the grammar.
+
+    @return: The source of the module.
+    """
+    tree = OMeta(src).parseGrammar(name)
+    parser = writePython(tree, src)
+    try:
+        compile(parser, name, "exec")
+    except SyntaxError:
+        parser = "# createParserClass omitted: Parsley generated invalid code."
+    return "\n".join([
+        "# Generated by parseproto.util.grammar from %s.parsley, do not edit."
+        % (name,),
+        "from __future__ import absolute_import",
+        "",
+        "from terml.nodes import Term, Tag",
+        "",
+        "SOURCE_DIGEST = %r" % (_digest(src),),
+        "PARSLEY_VERSION = %r" % (parsley.__version__,),
+        "",
+        "",
+        "def _grammar():",
+    ] + _writeTerm(tree) + [
+        "",
+        "grammar = _grammar()",
+        "del _grammar",
+        "",
+        "",
+        parser,
+        "",
+    ])
+
+
+
+def _writeModule(path, source):
+    """
+    Atomically write a generated module, creating its package if needed.
+
+    @raise EnvironmentError: If the module cannot be written.
+    """
+    base = os.path.dirname(path)
+    if not os.path.isdir(base):
+        os.makedirs(base)
+    init = os.path.join(base, "__init__.py")
+    if not os.path.exists(init):
+        open(init, "w").close()
+    fd, tmp = tempfile.mkstemp(dir=base, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(source)
+        os.chmod(tmp, 0o644)
+        if os.path.exists(path + "c"):
+            os.remove(path + "c")
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+
+def compileGrammar(path):
+    """
+    Build and byte-compile the generated module of a grammar unless it is up
+    to date.
+
+    @param path: The path of the grammar source.
+
+    @return: C{True} if the module was (re)built.
+    """
+    with open(path) as f:
+        src = f.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    target = generatedPath(path)
+    module = _loadGenerated(target, "_parseproto_generated_" + name,
+                            _digest(src))
+    if module is not None:
+        return False
+    _writeModule(target, generateModule(src, name))
+    py_compile.compile(target, doraise=True)
+    return True
+
+
+
+def compileTree(root):
+    """
+    Build the generated modules of every grammar found under a directory.
+
+    @param root: The directory to search.
+
+    @return: The paths of the grammars whose modules were (re)built.
+    """
+    built = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.endswith(".parsley"):
+                path = os.path.join(dirpath, filename)
+                if compileGrammar(path):
+                    built.append(path)
+    return built
+
+
+
+def _loadGenerated(path, modname, digest):
+    """
+    Load a generated module if it matches the grammar source and Parsley.
+
+    @return: The module, or C{None} if it is missing or stale.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        module = imp.load_source(modname, path)
+    except Exception:
+        return None
+    if (getattr(module, "SOURCE_DIGEST", None) != digest or
+            getattr(module, "PARSLEY_VERSION", None) != parsley.__version__):
+        return None
+    return module
+
+
+
+class _GrammarEntry(object):
+    """
+    A grammar held by the registry.
+
+    @ivar stamp: The C{(mtime, size)} of the source when it was last checked.
+    @ivar digest: The SHA-1 hex digest of the source.
+    @ivar module: The generated module of the grammar.
+    """
+    def __init__(self, stamp, digest, module):
+        self.stamp = stamp
+        self.digest = digest
+        self.module = module
+
+
+
+class GrammarRegistry(object):
+    """
+    A thread-safe cache of compiled grammars, keyed by package, grammar name
+    and source.
+
+    A grammar is loaded the first time it is asked for, from its generated
+    module if that is up to date and by compiling (and saving) it otherwise.
+    Later lookups only C{stat} the source file: an unchanged modification time
+    and size returns the cached grammar, and a changed one re-reads the source,
+    which is compiled again only if its digest differs.
+
+    @ivar writeGenerated: Whether freshly compiled grammars are saved as
+        generated modules.  Failing to save them is not an error.
+    """
+    writeGenerated = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+
+    def _getModule(self, pkg, name):
+        """
+        Get the generated module of a grammar, compiling it if needed.
+        """
+        path = grammarPath(pkg, name)
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+        key = (pkg.__name__, name)
+        entry = self._entries.get(key)
+        if entry is not None and entry.stamp == stamp:
+            return entry.module
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == stamp:
+                return entry.module
+            with open(path) as f:
+                src = f.read()
+            digest = _digest(src)
+            if entry is not None and entry.digest == digest:
+                entry.stamp = stamp
+            else:
+                entry = _GrammarEntry(stamp, digest,
+                                      self._loadModule(path, key, src, digest))
+                self._entries[key] = entry
+        return entry.module
+
+
+    def _loadModule(self, path, key, src, digest):
+        """
+        Load the generated module of a grammar, building it if it is stale.
+        """
+        modname = "%s._generated.%s" % key
+        target = generatedPath(path)
+        module = _loadGenerated(target, modname, digest)
+        if module is not None:
+            return module
+        source = generateModule(src, key[1])
+        if self.writeGenerated:
+            try:
+                _writeModule(target, source)
+            except EnvironmentError:
+                pass
+        return moduleFromGrammar(source, key[1], modname, target)
+
+
+    def getGrammar(self, pkg, name):
+        """
+        Get the term tree of a grammar.
+
+        @param pkg: The package containing the grammar.
+        @param name: The name of the grammar.
+
+        @return: The term tree of the grammar.
+        """
+        return self._getModule(pkg, name).grammar
+
+
+    def getParserClass(self, pkg, name, globals, superclass=OMetaBase):
+        """
+        Get a parser class for a grammar, as L{ometa.grammar.loadGrammar}
+        does.
+
+        @param pkg: The package containing the grammar.
+        @param name: The name of the grammar.
+        @param globals: The names accessible from the grammar.
+        @param superclass: The base class of the parser class.
+
+        @return: A new parser class.
+        """
+        return self._getModule(pkg, name).createParserClass(superclass, globals)
+
+
+    def invalidate(self, pkg=None, name=None):
+        """
+        Drop cached grammars so that they are loaded again on next use.
+
+        Protocol instances which already hold a grammar keep using it.
+
+        @param pkg: If given, only drop the grammars of this package.
+        @param name: If given, only drop the grammars with this name.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if pkg is not None and key[0] != pkg.__name__:
+                    continue
+                if name is not None and key[1] != name:
+                    continue
+                del self._entries[key]
+
+
+
+_registry = GrammarRegistry()
+
+getGrammar = _registry.getGrammar
+getParserClass = _registry.getParserClass
+invalidateGrammars = _registry.invalidate
+
+
+
+def main(argv=None):
+    """
+    Build the generated modules of the grammars under the given directories,
+    or under the C{parseproto} package if none are given.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        import parseproto
+        argv = [os.path.dirname(os.path.abspath(parseproto.__file__))]
+    for root in argv:
+        for path in compileTree(root):
+            print("compiled", path)
+
+
+
+if __name__ == "__main__":
+    main()
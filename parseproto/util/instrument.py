@@ -0,0 +1,161 @@
+# -*- test-case-name: parseproto.util.test.test_instrument -*-
+"""
+Opt-in profiling of the grammar rules matched by trampolined parsers.
+
+A L{GrammarProfiler} records, for every rule of every grammar, how many times
+it was applied, the time spent matching it, the bytes it consumed and how many
+times it failed, making its caller backtrack.  Once installed, it records the
+rules matched by every parser created from then on::
+
+    from parseproto.util.instrument import GrammarProfiler
+    profiler = GrammarProfiler()
+    profiler.install()
+    ...
+    print(profiler.report())
+
+To get reports from a running server, install the profiler with
+L{installSignalHandler} instead: on C{SIGUSR1}, the report is logged and the
+statistics are written as JSON to the given path.
+"""
+
+from __future__ import absolute_import
+
+import json
+import signal
+import timeit
+
+from twisted.python import log
+
+from parseproto.util.tube import TrampolinedParser
+
+
+
+class RuleStats(object):
+    """
+    The statistics of a grammar rule.
+
+    @ivar calls: The number of times the rule was applied.
+    @ivar time: The time spent matching the rule, including the rules it
+        applies, in seconds.
+    @ivar consumed: The number of bytes consumed by the successful matches of
+        the rule.
+    @ivar backtracks: The number of times the rule failed to match.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.consumed = 0
+        self.backtracks = 0
+
+
+    def asDict(self):
+        return {'calls': self.calls, 'time': self.time,
+                'consumed': self.consumed, 'backtracks': self.backtracks}
+
+
+
+class GrammarProfiler(object):
+    """
+    Statistics of the rules matched by trampolined parsers.
+
+    @cvar clock: The function giving the current time.
+    """
+    clock = staticmethod(timeit.default_timer)
+
+    def __init__(self):
+        self._stats = {}
+
+
+    def getStats(self, grammarName, ruleName):
+        """
+        Get the statistics of a rule, creating them on its first call.
+
+        @rtype: L{RuleStats}
+        """
+        key = (grammarName, ruleName)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = RuleStats()
+        return stats
+
+
+    def reset(self):
+        """
+        Drop the statistics recorded so far.
+        """
+        self._stats.clear()
+
+
+    def install(self):
+        """
+        Record the rules matched by the parsers created from now on.
+        """
+        TrampolinedParser.profiler = self
+
+
+    def uninstall(self):
+        """
+        Stop profiling the parsers created from now on, if this profiler was
+        installed.
+        """
+        if TrampolinedParser.profiler is self:
+            TrampolinedParser.profiler = None
+
+
+    def asDict(self):
+        """
+        Get the statistics recorded, keyed by grammar name and then by rule
+        name.
+        """
+        result = {}
+        for (grammarName, ruleName), stats in self._stats.items():
+            result.setdefault(grammarName, {})[ruleName] = stats.asDict()
+        return result
+
+
+    def toJSON(self):
+        """
+        Get the statistics recorded as a JSON document.
+
+        @rtype: C{str}
+        """
+        return json.dumps(self.asDict(), indent=2, sort_keys=True)
+
+
+    def report(self):
+        """
+        Format the statistics recorded as a table, most expensive rules
+        first.
+
+        @rtype: C{str}
+        """
+        lines = ["%-24s %-20s %10s %10s %12s %10s" % (
+            "grammar", "rule", "calls", "time (s)", "bytes", "backtracks")]
+        entries = sorted(self._stats.items(),
+                         key=lambda item: (-item[1].time, item[0]))
+        for (grammarName, ruleName), stats in entries:
+            lines.append("%-24s %-20s %10d %10.4f %12d %10d" % (
+                grammarName, ruleName, stats.calls, stats.time,
+                stats.consumed, stats.backtracks))
+        return "\n".join(lines)
+
+
+
+def installSignalHandler(profiler, path=None, signum=signal.SIGUSR1):
+    """
+    Install C{profiler} and dump its statistics whenever the process receives
+    C{signum}: the report is logged, and written as JSON to C{path} if given.
+
+    @type profiler: L{GrammarProfiler}
+    @param path: The file to write the statistics to.
+    @param signum: The signal to dump the statistics on.
+    """
+    def dump(signum, frame):
+        log.msg("Grammar profile:\n" + profiler.report())
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(profiler.toJSON())
+
+    profiler.install()
+    signal.signal(signum, dump)
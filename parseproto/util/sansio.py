@@ -0,0 +1,88 @@
+# -*- test-case-name: parseproto.test.test_sansio -*-
+"""
+The base of the sans-I/O parsers of parseproto.
+
+A sans-I/O parser runs the grammar of a protocol over bytes it is given,
+without a transport or a reactor, and turns what the grammar recognizes into
+events::
+
+    parser = LineOnlyParser()
+    for event in parser.feed(data):
+        ...
+
+The grammars call back into the object parsing, as in the receiver of a
+L{TrampolinedParser}.  A parser implements these callbacks by recording
+events; the Twisted protocols of parseproto are parsers which override them
+to act on the connection instead, so that they only add the transport to the
+parser they are built on.
+"""
+
+from __future__ import absolute_import
+
+
+
+class Parser(object):
+    """
+    A parser running a grammar over the bytes it is fed.
+
+    @cvar _parsleyGrammarPKG: The package containing the grammar.
+    @cvar _parsleyGrammarName: The name of the grammar.
+    @ivar currentRule: The rule of the grammar matched next, or a tuple of
+        the rule and its arguments.
+    """
+    _trampolinedParser = None
+    _parsleyGrammarName = b''
+    _parsleyGrammarPKG = None
+    _bindings = {}
+    _events = None
+    currentRule = "initial"
+
+    def _initializeParserProtocol(self):
+        # Parsley is only imported once there is something to parse, so that
+        # importing a protocol does not cost a process which never speaks it.
+        from parseproto.util.grammar import getGrammar
+        from parseproto.util.tube import TrampolinedParser
+        self._trampolinedParser = TrampolinedParser(
+            grammar=getGrammar(self._parsleyGrammarPKG, self._parsleyGrammarName),
+            receiver=self,
+            bindings=self._bindings
+        )
+
+
+    def dataReceived(self, data):
+        """
+        Parse C{data}, calling back for everything the grammar recognizes.
+        """
+        if self._trampolinedParser is None:
+            self._initializeParserProtocol()
+        self._trampolinedParser.receive(data)
+
+
+    def eventReceived(self, event):
+        """
+        Record an event, to be returned by the next call of L{feed}.
+        """
+        if self._events is None:
+            self._events = []
+        self._events.append(event)
+
+
+    def feed(self, data):
+        """
+        Parse C{data}.
+
+        @param data: The bytes received.
+        @type data: C{bytes}
+
+        @return: The events recognized in the data fed so far and not yet
+            returned, in the order they were recognized.
+        @rtype: C{list}
+        """
+        self.dataReceived(data)
+        events, self._events = self._events, None
+        return events or []
+
+
+    # this is a utility function.
+    def showArg(self, *args):
+        print(args)
@@ -0,0 +1,208 @@
+from __future__ import absolute_import
+
+from twisted.protocols import amp as twisted_amp
+from twisted.trial import unittest
+
+from parseproto.amp.sansio import BoxParser, BoxReceived
+from parseproto.basic.sansio import (
+    Int32StringParser, LineParser, LineReceived, RawDataReceived,
+    StringChunkReceived, StringFinished, StringReceived, StringStarted)
+from parseproto.imap4 import sansio as imap4
+from parseproto.profile.benchmark import lines, measureAsyncio
+from parseproto.smtp import sansio as smtp
+
+try:
+    from parseproto.util import aio
+except ImportError:
+    aio = None
+    skipAsyncio = "asyncio is not available"
+    ParserProtocol = BufferedParserProtocol = object
+else:
+    skipAsyncio = None
+    ParserProtocol = aio.ParserProtocol
+    BufferedParserProtocol = aio.BufferedParserProtocol
+
+
+
+class RecordingMixin(object):
+    """
+    Record the events received, and the mode changes some of them call for.
+    """
+    def __init__(self, parser=None):
+        super(RecordingMixin, self).__init__(parser)
+        self.events = []
+
+
+    def eventReceived(self, event):
+        self.events.append(event)
+        if event == LineReceived(b'raw'):
+            self.parser.setRawMode()
+
+
+
+class Recording(RecordingMixin, ParserProtocol):
+    pass
+
+
+
+class BufferedRecording(RecordingMixin, BufferedParserProtocol):
+    bufferSize = 8
+
+
+
+def receive(protocol, data):
+    """
+    Receive C{data} into the buffer of C{protocol}, as much as it holds at a
+    time.
+    """
+    while data:
+        buf = protocol.get_buffer(-1)
+        n = min(len(buf), len(data))
+        buf[:n] = data[:n]
+        data = data[n:]
+        protocol.buffer_updated(n)
+
+
+
+class ParserProtocolTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{aio.ParserProtocol}.
+    """
+    skip = skipAsyncio
+
+    def test_connection(self):
+        """
+        The transport is set while the protocol is connected.
+        """
+        protocol = Recording(LineParser())
+        transport = object()
+        protocol.connection_made(transport)
+        self.assertIs(protocol.transport, transport)
+        protocol.connection_lost(None)
+        self.assertIs(protocol.transport, None)
+
+
+    def test_parserFactory(self):
+        """
+        Without a parser, the protocol creates one with C{parserFactory}.
+        """
+        class LineRecording(Recording):
+            parserFactory = LineParser
+
+        protocol = LineRecording()
+        protocol.data_received(b'foo\r\n')
+        self.assertIsInstance(protocol.parser, LineParser)
+        self.assertEqual(protocol.events, [LineReceived(b'foo')])
+
+
+    def test_modeSwitch(self):
+        """
+        Events are delivered while the data is parsed, so that the mode of the
+        parser can change for the rest of it.
+        """
+        protocol = Recording(LineParser())
+        protocol.data_received(b'raw\r\nfoo\r\n')
+        self.assertEqual(protocol.events[0], LineReceived(b'raw'))
+        self.assertEqual(
+            b''.join(event.data for event in protocol.events[1:]),
+            b'foo\r\n')
+        self.assertEqual(set(type(event) for event in protocol.events[1:]),
+                         set([RawDataReceived]))
+
+
+
+class BufferedParserProtocolTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{aio.BufferedParserProtocol}, with the parsers of every
+    protocol.
+    """
+    skip = skipAsyncio
+
+    def test_buffer(self):
+        """
+        The same buffer is returned for every read.
+        """
+        protocol = BufferedRecording(LineParser())
+        self.assertIs(protocol.get_buffer(-1), protocol.get_buffer(100))
+        self.assertEqual(len(protocol.get_buffer(-1)), 8)
+
+
+    def test_lines(self):
+        protocol = BufferedRecording(LineParser())
+        receive(protocol, b'a line longer than the buffer\r\nfoo\r\n')
+        self.assertEqual(protocol.events, [
+            LineReceived(b'a line longer than the buffer'),
+            LineReceived(b'foo')])
+
+
+    def test_strings(self):
+        protocol = BufferedRecording(Int32StringParser())
+        receive(protocol, b'\x00\x00\x00\x0asome bytes\x00\x00\x00\x00')
+        self.assertEqual(protocol.events, [StringReceived(b'some bytes'),
+                                           StringReceived(b'')])
+
+
+    def test_streamedStrings(self):
+        """
+        The chunks of a streamed string are C{bytes}, which the data received
+        into the buffer afterwards does not change.
+        """
+        parser = Int32StringParser()
+        parser.streaming = True
+        protocol = BufferedRecording(parser)
+        receive(protocol, b'\x00\x00\x00\x0asome bytes')
+        receive(protocol, b'\x00\x00\x00\x08overwrit')
+        end = protocol.events.index(StringFinished())
+        self.assertEqual(protocol.events[0], StringStarted(10))
+        chunks = [event.chunk for event in protocol.events[1:end]]
+        self.assertEqual(set(type(chunk) for chunk in chunks), set([bytes]))
+        self.assertEqual(b''.join(chunks), b'some bytes')
+
+
+    def test_boxes(self):
+        box = {b'_command': b'Sum', b'a': b'1'}
+        protocol = BufferedRecording(BoxParser())
+        receive(protocol, twisted_amp.AmpBox(box).serialize())
+        self.assertEqual(protocol.events, [BoxReceived(box)])
+
+
+    def test_smtp(self):
+        protocol = BufferedRecording(smtp.SMTPParser())
+        receive(protocol, b'HELO example.com\r\n'
+                          b'MAIL FROM:<alice@example.com>\r\n'
+                          b'RCPT TO:<bob@example.com>\r\n'
+                          b'DATA\r\nhi\r\n.\r\n')
+        self.assertEqual(protocol.events, [
+            smtp.CommandReceived(b'HELO', b'example.com'),
+            smtp.CommandReceived(b'MAIL', b'<alice@example.com>'),
+            smtp.CommandReceived(b'RCPT', b'<bob@example.com>'),
+            smtp.CommandReceived(b'DATA', b''),
+            smtp.DataLineReceived(b'hi'),
+            smtp.DataFinished()])
+
+
+    def test_imap4(self):
+        protocol = BufferedRecording(imap4.IMAP4Parser())
+        receive(protocol, b'a1 LOGIN {5}\r\nalice secret\r\n')
+        self.assertEqual(protocol.events, [
+            imap4.CommandReceived(b'a1', b'LOGIN', b'{5}'),
+            imap4.LiteralReceived(b'alice'),
+            imap4.ContinuationReceived(b' secret')])
+
+
+
+class EventLoopTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the parsers on an event loop, as the benchmark runs them.
+    """
+    skip = skipAsyncio
+
+    def test_socketPair(self):
+        """
+        The lines written to one end of a socket pair, a few bytes at a time,
+        are all received by a L{aio.BufferedParserProtocol} reading the other
+        end on an event loop.
+        """
+        received = measureAsyncio(LineParser, LineReceived, lines(100), 7,
+                                  100)[0]
+        self.assertEqual(received, 100)
@@ -0,0 +1,223 @@
+from __future__ import absolute_import
+
+import os
+
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+
+from ometa.grammar import OMeta
+
+import parseproto.basic
+from parseproto.basic.protocol import LineOnlyReceiver, LineReceiver
+from parseproto.util.grammar import (
+    GrammarRegistry, _digest, compileTree, getGrammar, generatedPath)
+
+
+
+class FakePackage(object):
+    """
+    A stand-in for a package holding grammars in a temporary directory.
+    """
+    def __init__(self, name, path):
+        self.__name__ = name
+        self.__file__ = os.path.join(path, '__init__.py')
+
+
+
+class GrammarRegistryTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{parseproto.util.grammar.GrammarRegistry}.
+    """
+
+    def setUp(self):
+        self.base = FilePath(self.mktemp())
+        self.base.makedirs()
+        self.pkg = FakePackage('fakepkg', self.base.path)
+        self.source = self.base.child('g.parsley')
+        self.source.setContent(b"initial = 'a'")
+        self.registry = GrammarRegistry()
+
+
+    def test_cached(self):
+        """
+        Looking a grammar up twice returns the very same term tree.
+        """
+        first = self.registry.getGrammar(self.pkg, 'g')
+        self.assertIs(self.registry.getGrammar(self.pkg, 'g'), first)
+
+
+    def test_sourceChanged(self):
+        """
+        A grammar whose source changed on disk is parsed again.
+        """
+        first = self.registry.getGrammar(self.pkg, 'g')
+        self.source.setContent(b"initial = 'bb'")
+        second = self.registry.getGrammar(self.pkg, 'g')
+        self.assertNotEqual(first, second)
+        self.assertIs(self.registry.getGrammar(self.pkg, 'g'), second)
+
+
+    def test_touchedOnly(self):
+        """
+        A grammar whose source was touched without being changed is not parsed
+        again.
+        """
+        first = self.registry.getGrammar(self.pkg, 'g')
+        os.utime(self.source.path, (0, 0))
+        self.assertIs(self.registry.getGrammar(self.pkg, 'g'), first)
+
+
+    def test_invalidate(self):
+        """
+        L{GrammarRegistry.invalidate} drops the cached grammars.
+        """
+        first = self.registry.getGrammar(self.pkg, 'g')
+        self.registry.invalidate()
+        self.assertIsNot(self.registry.getGrammar(self.pkg, 'g'), first)
+
+
+    def test_invalidateByName(self):
+        """
+        L{GrammarRegistry.invalidate} only drops the grammars matching the
+        given package and name.
+        """
+        self.base.child('h.parsley').setContent(b"initial = 'b'")
+        g = self.registry.getGrammar(self.pkg, 'g')
+        h = self.registry.getGrammar(self.pkg, 'h')
+        self.registry.invalidate(self.pkg, 'h')
+        self.assertIs(self.registry.getGrammar(self.pkg, 'g'), g)
+        self.assertIsNot(self.registry.getGrammar(self.pkg, 'h'), h)
+        self.registry.invalidate(parseproto.basic)
+        self.assertIs(self.registry.getGrammar(self.pkg, 'g'), g)
+
+
+    def test_parserClass(self):
+        """
+        L{GrammarRegistry.getParserClass} returns a parser class for the
+        grammar which sees the given globals.
+        """
+        self.source.setContent(b"initial = 'a' -> VALUE")
+        parserClass = self.registry.getParserClass(
+            self.pkg, 'g', {'VALUE': 42})
+        self.assertEqual(parserClass('a').apply('initial')[0], 42)
+
+
+
+class GeneratedModuleTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the generated modules of L{parseproto.util.grammar}.
+    """
+
+    def setUp(self):
+        self.base = FilePath(self.mktemp())
+        self.base.makedirs()
+        self.pkg = FakePackage('fakegenpkg', self.base.path)
+        self.source = self.base.child('g.parsley')
+        self.source.setContent(b"initial = 'a' (~'b' anything)*:x -> x")
+        self.generated = FilePath(generatedPath(self.source.path))
+
+
+    def test_written(self):
+        """
+        Compiling a grammar saves a generated module holding the same term
+        tree as parsing the grammar.
+        """
+        grammar = GrammarRegistry().getGrammar(self.pkg, 'g')
+        self.assertTrue(self.generated.exists())
+        self.assertTrue(self.generated.sibling('__init__.py').exists())
+        self.assertEqual(
+            grammar, OMeta(self.source.getContent().decode('ascii')).parseGrammar('g'))
+
+
+    def test_loaded(self):
+        """
+        An up to date generated module is loaded instead of compiling the
+        grammar again.
+        """
+        GrammarRegistry().getGrammar(self.pkg, 'g')
+        self.generated.setContent(
+            self.generated.getContent().replace(b"'b'", b"'c'"))
+        compiled = self.generated.siblingExtension('c')
+        if compiled.exists():
+            compiled.remove()
+        grammar = GrammarRegistry().getGrammar(self.pkg, 'g')
+        self.assertEqual(
+            grammar, OMeta(u"initial = 'a' (~'c' anything)*:x -> x"
+                           ).parseGrammar('g'))
+
+
+    def test_stale(self):
+        """
+        A generated module built from another source is rebuilt.
+        """
+        GrammarRegistry().getGrammar(self.pkg, 'g')
+        self.source.setContent(b"initial = 'z'")
+        grammar = GrammarRegistry().getGrammar(self.pkg, 'g')
+        self.assertEqual(grammar, OMeta(u"initial = 'z'").parseGrammar('g'))
+        self.assertIn(b"'z'", self.generated.getContent())
+
+
+    def test_textDigest(self):
+        """
+        The digest of a grammar source read as text is that of its UTF-8
+        encoding, so that a generated module is up to date however its source
+        is read.
+        """
+        src = u"initial = '\xe9'"
+        self.assertEqual(_digest(src), _digest(src.encode('utf-8')))
+
+
+    def test_notWritten(self):
+        """
+        A registry whose C{writeGenerated} is false compiles grammars in
+        memory only.
+        """
+        registry = GrammarRegistry()
+        registry.writeGenerated = False
+        registry.getGrammar(self.pkg, 'g')
+        self.assertFalse(self.generated.exists())
+
+
+    def test_compileTree(self):
+        """
+        L{compileTree} builds the modules of the grammars under a directory
+        which are not up to date.
+        """
+        sub = self.base.child('sub')
+        sub.makedirs()
+        sub.child('h.parsley').setContent(b"initial = 'h'")
+        self.assertEqual(
+            sorted(compileTree(self.base.path)),
+            sorted([self.source.path, sub.child('h.parsley').path]))
+        self.assertTrue(FilePath(generatedPath(self.source.path)).exists())
+        self.assertEqual(compileTree(self.base.path), [])
+
+
+
+class SharedGrammarTestCase(unittest.SynchronousTestCase):
+    """
+    Protocol instances share the grammars of the process-wide registry.
+    """
+
+    def test_sharedBetweenInstances(self):
+        """
+        Two receivers of the same class use the same grammar.
+        """
+        a, b = LineReceiver(), LineReceiver()
+        a._initializeParserProtocol()
+        b._initializeParserProtocol()
+        self.assertIs(a._trampolinedParser.grammar,
+                      b._trampolinedParser.grammar)
+        self.assertIs(a._trampolinedParser.grammar,
+                      getGrammar(parseproto.basic, 'line_receiver'))
+
+
+    def test_distinctGrammars(self):
+        """
+        Receivers with different grammars do not share them.
+        """
+        a, b = LineReceiver(), LineOnlyReceiver()
+        a._initializeParserProtocol()
+        b._initializeParserProtocol()
+        self.assertIsNot(a._trampolinedParser.grammar,
+                         b._trampolinedParser.grammar)
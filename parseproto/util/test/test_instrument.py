@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+
+import json
+import signal
+
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+
+from ometa.grammar import OMeta
+
+from parseproto.util.instrument import GrammarProfiler, installSignalHandler
+from parseproto.util.tube import TrampolinedParser
+
+
+
+class Receiver(object):
+    def __init__(self):
+        self.received = []
+
+    def receive(self, data):
+        self.received.append(data)
+
+
+
+class GrammarProfilerTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for L{parseproto.util.instrument.GrammarProfiler}.
+    """
+
+    def setUp(self):
+        self.grammar = OMeta(r"""
+            digits = <digit+>:d -> int(d)
+            word = <letter+>
+            item = digits:n ';' -> receiver.receive(n)
+                 | word:w ';' -> receiver.receive(w)
+            initial = item
+        """).parseGrammar('Counted')
+        self.profiler = GrammarProfiler()
+        self.profiler.install()
+        self.addCleanup(self.profiler.uninstall)
+
+
+    def test_recorded(self):
+        """
+        Every rule applied is recorded with its calls, the bytes it consumed,
+        and the number of times it failed.
+        """
+        receiver = Receiver()
+        parser = TrampolinedParser(self.grammar, receiver, {})
+        parser.receive(b'12;ab;3')
+        parser.receive(b'4;')
+        self.assertEqual(receiver.received, [12, b'ab', 34])
+        stats = self.profiler.asDict()['Counted']
+        self.assertEqual(stats['initial']['calls'], 3)
+        self.assertEqual(stats['initial']['consumed'], 9)
+        self.assertEqual(stats['digits']['calls'], 3)
+        self.assertEqual(stats['digits']['backtracks'], 1)
+        self.assertEqual(stats['digits']['consumed'], 4)
+        self.assertEqual(stats['word']['calls'], 1)
+        self.assertEqual(stats['word']['consumed'], 2)
+
+
+    def test_time(self):
+        """
+        The time of a rule is measured with the clock of the profiler while
+        the rule is being matched.
+        """
+        ticks = iter(range(100))
+        self.profiler.clock = lambda: next(ticks)
+        parser = TrampolinedParser(self.grammar, Receiver(), {})
+        parser.receive(b'1;')
+        stats = self.profiler.getStats('Counted', 'initial')
+        self.assertTrue(stats.time > 0)
+        self.assertTrue(
+            stats.time >= self.profiler.getStats('Counted', 'digits').time)
+
+
+    def test_notInstalled(self):
+        """
+        Parsers created while no profiler is installed record nothing.
+        """
+        self.profiler.uninstall()
+        TrampolinedParser(self.grammar, Receiver(), {}).receive(b'1;')
+        self.assertEqual(self.profiler.asDict(), {})
+
+
+    def test_reports(self):
+        """
+        The statistics can be reported as a table or as JSON.
+        """
+        TrampolinedParser(self.grammar, Receiver(), {}).receive(b'1;')
+        self.assertEqual(json.loads(self.profiler.toJSON()),
+                         self.profiler.asDict())
+        report = self.profiler.report().splitlines()
+        self.assertEqual(report[0].split(), [
+            'grammar', 'rule', 'calls', 'time', '(s)', 'bytes',
+            'backtracks'])
+        self.assertEqual(sorted(line.split()[1] for line in report[1:]),
+                         ['digit', 'digits', 'initial', 'item'])
+
+
+    def test_reset(self):
+        """
+        L{GrammarProfiler.reset} drops the statistics recorded.
+        """
+        TrampolinedParser(self.grammar, Receiver(), {}).receive(b'1;')
+        self.profiler.reset()
+        self.assertEqual(self.profiler.asDict(), {})
+
+
+    def test_signalHandler(self):
+        """
+        L{installSignalHandler} installs the profiler and writes its
+        statistics on the signal.
+        """
+        path = FilePath(self.mktemp())
+        self.addCleanup(signal.signal, signal.SIGUSR1,
+                        signal.getsignal(signal.SIGUSR1))
+        profiler = GrammarProfiler()
+        installSignalHandler(profiler, path.path)
+        self.addCleanup(profiler.uninstall)
+        TrampolinedParser(self.grammar, Receiver(), {}).receive(b'1;')
+        signal.getsignal(signal.SIGUSR1)(signal.SIGUSR1, None)
+        self.assertEqual(json.loads(path.getContent()), profiler.asDict())
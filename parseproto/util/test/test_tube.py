@@ -1,12 +1,15 @@
 from __future__ import absolute_import
 
+import struct
+
 from twisted.trial import unittest
 from twisted.python.compat import iterbytes
 
 
 from ometa.grammar import OMeta
+from ometa.runtime import ParseError
 
-from parseproto.util.tube import TrampolinedParser
+from parseproto.util.tube import ParseFailure, TrampolinedParser, _getRules
 
 
 
@@ -59,7 +62,7 @@ class TrampolinedParserTestCase(unittest.SynchronousTestCase):
         for c in iterbytes(buf):
             trampolinedParser.receive(c)
         self.assertEqual(receiver.received, [b'foo', b'bar', b'foo'])
-        trampolinedParser.receive('\r\n')
+        trampolinedParser.receive(b'\r\n')
         self.assertEqual(receiver.received, [b'foo', b'bar', b'foo', b'bar'])
 
 
@@ -72,8 +75,284 @@ class TrampolinedParserTestCase(unittest.SynchronousTestCase):
             initial = digit:d (-> int(d)+SMALL_INT):val -> receiver.receive(val)
         """
         bindings = {'SMALL_INT': 3}
-        TrampolinedParser(self._parseGrammar(grammar), receiver, bindings).receive('0')
+        TrampolinedParser(self._parseGrammar(grammar), receiver, bindings).receive(b'0')
         self.assertEqual(receiver.received, [3])
 
 
 
+
+
+    def test_interpreterReused(self):
+        """
+        The parser keeps one interpreter, rewound after every matched rule.
+        """
+        receiver = TrampolinedReceiver()
+        trampolinedParser = TrampolinedParser(self.grammar, receiver, {})
+        interp = trampolinedParser._interp
+        trampolinedParser.receive(b'foo\r\nbar\r\nba')
+        trampolinedParser.receive(b'z\r\n')
+        self.assertEqual(receiver.received, [b'foo', b'bar', b'baz'])
+        self.assertIs(trampolinedParser._interp, interp)
+
+
+    def test_consumedInputDropped(self):
+        """
+        Input consumed by matched rules is eventually dropped, while input
+        not consumed yet is kept.
+        """
+        receiver = TrampolinedReceiver()
+        trampolinedParser = TrampolinedParser(self.grammar, receiver, {})
+        trampolinedParser._interp.compactThreshold = 10
+        trampolinedParser.receive(b'foo\r\n' * 10 + b'ba')
+        self.assertTrue(len(trampolinedParser._interp.input.data) < 10)
+        trampolinedParser.receive(b'r\r\n')
+        self.assertEqual(receiver.received, [b'foo'] * 10 + [b'bar'])
+
+
+    def test_receiverCurrentRule(self):
+        """
+        After each matched rule, the parser goes on with the receiver's
+        C{currentRule}.
+        """
+        class SwitchingReceiver(TrampolinedReceiver):
+            currentRule = 'initial'
+            def receive(self, data):
+                TrampolinedReceiver.receive(self, data)
+                self.currentRule = 'other'
+
+        grammar = self._parseGrammar(r"""
+            initial = <letter+>:val ';' -> receiver.receive(val)
+            other = <digit+>:val ';' -> receiver.receive(int(val))
+        """)
+        receiver = SwitchingReceiver()
+        trampolinedParser = TrampolinedParser(grammar, receiver, {})
+        trampolinedParser.receive(b'abc;12;3')
+        trampolinedParser.receive(b'4;')
+        self.assertEqual(receiver.received, [b'abc', 12, 34])
+
+
+    def test_bufferedInPlace(self):
+        """
+        Received data is appended in place to a single C{bytearray}, while the
+        values bound by the grammar are C{bytes}.
+        """
+        receiver = TrampolinedReceiver()
+        trampolinedParser = TrampolinedParser(self.grammar, receiver, {})
+        data = trampolinedParser._interp.input.data
+        trampolinedParser.receive(b'foo\r\nba')
+        trampolinedParser.receive(b'r')
+        self.assertIsInstance(data, bytearray)
+        self.assertIs(trampolinedParser._interp.input.data, data)
+        self.assertEqual(receiver.received, [b'foo'])
+        self.assertIsInstance(receiver.received[0], bytes)
+
+
+    def test_pausedReceiver(self):
+        """
+        Data fed while the receiver is paused is only parsed once it resumes.
+        """
+        receiver = TrampolinedReceiver()
+        receiver.paused = True
+        trampolinedParser = TrampolinedParser(self.grammar, receiver, {})
+        trampolinedParser.receive(b'foo\r\nbar\r\n')
+        self.assertEqual(receiver.received, [])
+        receiver.paused = False
+        trampolinedParser.parse()
+        self.assertEqual(receiver.received, [b'foo', b'bar'])
+
+
+    def test_clear(self):
+        """
+        L{TrampolinedParser.clear} drops and returns the unparsed data,
+        including the input partially matched by the current rule.
+        """
+        receiver = TrampolinedReceiver()
+        trampolinedParser = TrampolinedParser(self.grammar, receiver, {})
+        trampolinedParser.receive(b'foo\r\nbar')
+        self.assertEqual(trampolinedParser.clear(), b'bar')
+        trampolinedParser.receive(b'baz\r\n')
+        self.assertEqual(receiver.received, [b'foo', b'baz'])
+
+
+
+class IntrinsicsTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the intrinsics of L{parserproto.util.tube}.
+    """
+
+    grammar = r"""
+        delimiter = '\r\n'
+        dynamic = exactly(receiver.delimiter)
+        line = <(~delimiter anything)*>:l delimiter -> receiver.receive(l)
+        short = <(~dynamic anything){0, 4}>:l dynamic -> receiver.receive(l)
+        string = anything:c (-> ord(c) - 48):n <anything{n}>:s
+            -> receiver.receive(s)
+        both = <(~delimiter ~' ' anything)*>:l delimiter -> receiver.receive(l)
+        unpacked = unpack(receiver.struct):n <anything{n}>:s
+            -> receiver.receive((n, s))
+        number = varint(receiver.maxBytes):n -> receiver.receive(n)
+        anyLine = scanUntilAny(receiver.delimiters 4):l -> receiver.receive(l)
+            | anything:c -> receiver.receive(c)
+        word = <letter+>:w digit:d delimiter -> receiver.receive((w, d))
+    """
+
+    def setUp(self):
+        self.parsed = OMeta(self.grammar).parseGrammar('Grammar')
+
+
+    def _rules(self, intrinsics):
+        return dict((name, repr(rule)) for name, rule in
+                    _getRules(self.parsed, intrinsics).items())
+
+
+    def test_recognized(self):
+        """
+        Delimited and fixed length reads are replaced by intrinsics.
+        """
+        rules = self._rules(True)
+        self.assertIn('ScanUntil(Exactly', rules['line'])
+        self.assertIn('ScanUntil(Action("receiver.delimiter"), 4)',
+                      rules['short'])
+        self.assertIn('Take("n")', rules['string'])
+        self.assertNotIn('ConsumedBy', rules['line'])
+
+
+    def test_notRecognized(self):
+        """
+        Other patterns are left to the interpreter, as is everything when
+        intrinsics are not used.
+        """
+        self.assertIn('ConsumedBy', self._rules(True)['both'])
+        rules = self._rules(False)
+        self.assertNotIn('ScanUntil', repr(rules))
+        self.assertNotIn('Take', repr(rules))
+
+
+    def _parse(self, rule, data, chunkSize, intrinsics):
+        receiver = TrampolinedReceiver()
+        receiver.currentRule = rule
+        receiver.delimiter = b'\r\n'
+        receiver.struct = struct.Struct('<H')
+        receiver.maxBytes = 3
+        receiver.delimiters = (b'\r\n', b'\r', b'\n', b'--')
+        class Parser(TrampolinedParser):
+            pass
+        Parser.intrinsics = intrinsics
+        parser = Parser(self.parsed, receiver, {})
+        for i in range(0, len(data), chunkSize):
+            parser.receive(data[i:i + chunkSize])
+        return receiver.received
+
+
+    def test_sameResults(self):
+        """
+        The intrinsics match the same input as the interpreter, whichever way
+        it is split.
+        """
+        cases = [
+            ('line', b'foo\r\nb\rar\r\n\r\nbaz'),
+            ('short', b'foo\r\nf\rb\r\n\r\nfoob\r\n'),
+            ('string', b'3abc09123456789'),
+            ('both', b'foo\r\nbar\r\n\r\nbaz'),
+        ]
+        for rule, data in cases:
+            expected = self._parse(rule, data, len(data), False)
+            for chunkSize in range(1, 6):
+                self.assertEqual(
+                    self._parse(rule, data, chunkSize, True), expected)
+
+
+    def test_unpack(self):
+        """
+        C{unpack} matches the field of a L{struct.Struct} and returns its
+        value.
+        """
+        data = b'\x03\x00abc\x00\x00\x01\x00d'
+        for chunkSize in range(1, 6):
+            self.assertEqual(self._parse('unpacked', data, chunkSize, True),
+                             [(3, b'abc'), (0, b''), (1, b'd')])
+
+
+    def test_varint(self):
+        """
+        C{varint} matches a base 128 integer, least significant group first,
+        of at most as many bytes as given.
+        """
+        data = b'\x00\x7f\xac\x02\xff\xff\xff\x01'
+        for chunkSize in range(1, 6):
+            self.assertEqual(self._parse('number', data, chunkSize, True),
+                             [0, 127, 300, 2 ** 21 - 1, 1])
+
+
+    def test_letterAndDigit(self):
+        """
+        C{letter} and C{digit} match a byte of the input, and return it as
+        C{bytes}.
+        """
+        data = b'ab1\r\n'
+        for chunkSize in range(1, 6):
+            self.assertEqual(self._parse('word', data, chunkSize, True),
+                             [(b'ab', b'1')])
+
+
+    def test_scanUntilAny(self):
+        """
+        C{scanUntilAny} matches up to the first of several delimiters, the
+        longest one where one starts another, and returns the input before
+        it with the delimiter.  It does not match if no delimiter starts
+        within the limit.
+        """
+        data = b'a\r\nb\rc\nd--\r\r\nabcd\nabcde\n'
+        expected = [(b'a', b'\r\n'), (b'b', b'\r'), (b'c', b'\n'),
+                    (b'd', b'--'), (b'', b'\r'), (b'', b'\r\n'),
+                    (b'abcd', b'\n'), b'a', (b'bcde', b'\n')]
+        for chunkSize in range(1, 6):
+            self.assertEqual(self._parse('anyLine', data, chunkSize, True),
+                             expected)
+
+
+
+class ParseFailureTestCase(unittest.SynchronousTestCase):
+    """
+    Tests for the parse errors of L{parserproto.util.tube.TrampolinedParser}.
+    """
+
+    grammar = r"""
+        command = ('GET' | 'PUT') ' ' <letter+>:name '\n'
+            -> receiver.receive(name)
+    """
+
+    def _receive(self, data, debug):
+        receiver = TrampolinedReceiver()
+        receiver.currentRule = 'command'
+        class Parser(TrampolinedParser):
+            pass
+        Parser.debug = debug
+        parser = Parser(OMeta(self.grammar).parseGrammar('Grammar'),
+                        receiver, {})
+        error = self.assertRaises(ParseError, parser.receive, data)
+        self.assertEqual(receiver.received, [b'foo'])
+        return error
+
+
+    def test_failure(self):
+        """
+        Input which does not match raises a L{ParseFailure} at the furthest
+        offset from the start of the rule any alternative reached, with the
+        name of the rule.
+        """
+        failure = self._receive(b'GET foo\nPUX bar\n', False)
+        self.assertIsInstance(failure, ParseFailure)
+        self.assertEqual((failure.position, failure.rule), (2, 'command'))
+
+
+    def test_debug(self):
+        """
+        When debugging, input which does not match raises the L{ParseError}
+        of OMeta, at the position in the input of the parser and with what
+        the furthest alternatives expected.
+        """
+        error = self._receive(b'GET foo\nPUX bar\n', True)
+        self.assertNotIsInstance(error, ParseFailure)
+        self.assertEqual((error.position, error.error),
+                         (10, [('expected', None, 'PUT')]))
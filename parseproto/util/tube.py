@@ -1,62 +1,886 @@
-# from ometa.interp import TrampolinedGrammarInterpreter, _feed_me
-#
-# class TrampolinedParser:
-#     """
-#     A parser that incrementally parses incoming data.
-#     """
-#
-#     currentRule = 'initial'
-#     def __init__(self, grammar, receiver, bindings):
-#         """
-#         Initializes the parser.
-#
-#         @param grammar: The grammar used to parse the incoming data.
-#         @param receiver: Responsible for logic operation on the parsed data.
-#             Typically, the logic operation will be invoked inside the grammar,
-#             e.g., rule = expr1 expr2 (-> receiver.doSomeStuff())
-#         @param bindings: The namespace that can be accessed inside the grammar.
-#         """
-#         self.grammar = grammar
-#         self.bindings = dict(bindings)
-#         self.bindings['receiver'] = self.receiver = receiver
-#         self._setupInterp()
-#
-#
-#     def _setupInterp(self):
-#         """
-#         Resets the parser. The parser will begin parsing with the rule named
-#         'initial'.
-#         """
-#         if isinstance(self.currentRule, basestring):
-#             self.currentRule = (self.currentRule, None, ())
-#         elif isinstance(self.currentRule, (tuple, list)):
-#             self.currentRule = (self.currentRule[0], None, self.currentRule[-1])
-#         else:
-#             raise ValueError("Wrong rule format.")
-#         self._interp = TrampolinedGrammarInterpreter(
-#             grammar=self.grammar, rule=self.currentRule, callback=None,
-#             globals=self.bindings)
-#
-#
-#     def setNextRule(self, nextRule):
-#         self.currentRule = nextRule
-#
-#
-#     def receive(self, data):
-#         """
-#         Receive the incoming data and begin parsing. The parser will parse the
-#         data incrementally according to the 'currentRule' rule in the grammar.
-#
-#         @param data: The raw data received.
-#         """
-#         while data:
-#             # try:
-#             status = self._interp.receive(data)
-#             # except Exception as e:
-#                 # maybe we should raise it?
-#                 # raise e
-#             # else:
-#             if status is _feed_me:
-#                     return
-#             data = ''.join(self._interp.input.data[self._interp.input.position:])
-#             self._setupInterp()
\ No newline at end of file
+# -*- test-case-name: parseproto.util.test.test_tube -*-
+"""
+Incremental parsing of byte streams with Parsley grammars.
+"""
+
+from __future__ import absolute_import
+
+import re
+import string
+
+from ometa.interp import (
+    TrampolinedGrammarInterpreter, _feed_me, decomposeGrammar)
+from ometa.runtime import EOFError, InputStream, ParseError, expected
+from terml.nodes import Tag, Term
+
+
+# The one-byte string of every byte value, so that reading a byte from the
+# input does not allocate.
+_byteChars = [bytes(bytearray([i])) for i in range(256)]
+
+# The bytes the letter and digit rules of OMeta match.
+_letters = frozenset(_byteChars[ord(c)] for c in string.ascii_letters)
+_digits = frozenset(_byteChars[ord(c)] for c in string.digits)
+
+# The decomposed rules of every grammar seen, keyed by the id of the grammar
+# and whether intrinsics are used. The grammar is kept alongside so that its
+# id cannot be reused.
+_rulesCache = {}
+
+_nullTerm = Term(Tag('null'), None, (), None)
+
+# The error returned along with a match, when only failures are reported, and
+# so with no position of its own.
+_matched = ParseError(None, None, None)
+
+# The pattern searched for by scanUntilAny for every set of delimiters seen,
+# with the length of their longest delimiter and those of them starting
+# another one.
+_delimiterPatterns = {}
+
+
+
+def _literal(term, rules, seen=()):
+    """
+    Find the string an expression matches, if it only ever matches a string
+    known before matching it: a literal, C{exactly(<python expression>)}, or a
+    rule without arguments made of either.
+
+    @return: The C{Exactly} term of the literal, the C{Action} term of the
+        expression giving the string, or C{None}.
+    """
+    name = term.tag.name
+    if name in ('Or', 'And') and len(term.args[0].args) == 1:
+        return _literal(term.args[0].args[0], rules, seen)
+    if name == 'Exactly':
+        return term
+    if name == 'Apply':
+        ruleName, args = term.args[0].data, term.args[2].args
+        if (ruleName == 'exactly' and len(args) == 1
+                and args[0].tag.name == 'Action'):
+            return args[0]
+        if not args and ruleName in rules and ruleName not in seen:
+            return _literal(rules[ruleName], rules, seen + (ruleName,))
+    return None
+
+
+
+def _literalBytes(literal):
+    """
+    Get the bytes a literal of a grammar matches, which is read as text on
+    Python 3.
+    """
+    if isinstance(literal, bytes):
+        return literal
+    return literal.encode('latin-1')
+
+
+
+def _isAnything(term):
+    return term.tag.name == 'Apply' and term.args[0].data == 'anything'
+
+
+
+def _intrinsic(expr, rules):
+    """
+    Find an intrinsic matching the same input as C{<expr>}.
+
+    C{<(~delimiter anything)*>} and C{<(~delimiter anything){0, max}>} become
+    C{ScanUntil(delimiter, max)} when C{delimiter} is a L{_literal}, and
+    C{<anything{n}>} becomes C{Take(n)}.
+
+    @return: The term of the intrinsic, or C{None}.
+    """
+    name = expr.tag.name
+    if name == 'Many':
+        body, limit = expr.args[0], _nullTerm
+    elif name == 'Repeat':
+        low, high, body = expr.args
+        if _isAnything(body) and (low.tag.name, low.data) == (
+                high.tag.name, high.data):
+            return Term(Tag('Take'), None, (low,), expr.span)
+        if (low.tag.name, low.data) != ('.int.', 0):
+            return None
+        limit = high
+    else:
+        return None
+    if body.tag.name != 'And' or len(body.args[0].args) != 2:
+        return None
+    avoid, consume = body.args[0].args
+    if avoid.tag.name != 'Not' or not _isAnything(consume):
+        return None
+    delimiter = _literal(avoid.args[0], rules)
+    if delimiter is None:
+        return None
+    return Term(Tag('ScanUntil'), None, (delimiter, limit), expr.span)
+
+
+
+def _withIntrinsics(term, rules):
+    """
+    Replace the expressions of C{term} which have an intrinsic with it.
+    """
+    if term.tag.name == 'ConsumedBy':
+        intrinsic = _intrinsic(term.args[0], rules)
+        if intrinsic is not None:
+            return intrinsic
+    if not term.args:
+        return term
+    return Term(term.tag, term.data,
+                tuple(_withIntrinsics(arg, rules) for arg in term.args),
+                term.span)
+
+
+
+def _getRules(grammar, intrinsics=True):
+    """
+    Get the rules of a grammar, decomposing it only the first time.
+
+    @param intrinsics: Whether to replace the expressions which have an
+        intrinsic with it.
+    """
+    key = (id(grammar), intrinsics)
+    cached = _rulesCache.get(key)
+    if cached is None:
+        rules = decomposeGrammar(grammar)
+        if intrinsics:
+            rules = dict((name, _withIntrinsics(rule, rules))
+                         for name, rule in rules.items())
+        cached = (grammar, rules)
+        _rulesCache[key] = cached
+    return cached[1]
+
+
+
+def _delimiterPattern(delimiters):
+    """
+    Get the pattern finding any of C{delimiters}, the longest of those
+    starting at the same place, with the length of the longest delimiter and
+    the delimiters starting another one.
+    """
+    delimiters = tuple(delimiters)
+    try:
+        return _delimiterPatterns[delimiters]
+    except KeyError:
+        pass
+    byLength = sorted(delimiters, key=len, reverse=True)
+    pattern = re.compile(b'|'.join(re.escape(d) for d in byLength))
+    prefixes = frozenset(d for d in delimiters for other in delimiters
+                         if len(other) > len(d) and other.startswith(d))
+    result = _delimiterPatterns[delimiters] = (
+        pattern, len(byLength[0]), prefixes)
+    return result
+
+
+
+class ParseFailure(ParseError):
+    """
+    A parse error recording only where the input stopped matching and the rule
+    being matched.
+
+    Unlike the errors of OMeta, it does not say what the input was expected
+    to be instead, which takes merging what every alternative tried expected:
+    rejecting malformed input costs one of them per message rather than a
+    few per byte.
+
+    @ivar position: The offset at which matching failed, from where the rule
+        started matching.
+    @ivar rule: The name of the rule being matched.
+    """
+
+    def __init__(self, position, rule):
+        ParseError.__init__(self, None, position, None)
+        self.rule = rule
+
+
+    def formatError(self):
+        return "Parse failure at offset %s matching %r" % (
+            self.position, self.rule)
+
+
+
+# What alternatives fail with while a rule is matched, when only the failure
+# of the rule is reported.
+_failed = ParseFailure(None, None)
+
+
+
+class _InputStream(InputStream):
+    """
+    An input stream over a C{bytearray} which does not copy its data to report
+    the end of input.
+
+    The data of a rewindable interpreter outlives the rules matched against
+    it, so anything proportional to its size must not happen per character.
+    Nor is a parse error created for every position, as its interpreter only
+    reports where matching failed.
+    """
+
+    def __init__(self, data, position):
+        self.data = data
+        self.position = position
+        self.memo = {}
+        self.tl = None
+
+
+    def head(self):
+        if self.position >= len(self.data):
+            raise EOFError(self.data, self.position + 1)
+        return _byteChars[self.data[self.position]], _matched
+
+
+    def nullError(self, msg=None):
+        if msg:
+            return ParseError(self.data, self.position, msg)
+        return _matched
+
+
+    def tail(self):
+        if self.tl is None:
+            self.tl = self.__class__(self.data, self.position + 1)
+        return self.tl
+
+
+    def advanceBy(self, n):
+        return self.__class__(self.data, self.position + n)
+
+
+    def prev(self):
+        return self.__class__(self.data, self.position - 1)
+
+
+
+class _DebugInputStream(_InputStream):
+    """
+    An input stream with the parse error of every position, for the
+    interpreters reporting the full errors of OMeta.
+    """
+
+    __init__ = InputStream.__init__
+    nullError = InputStream.nullError
+
+
+    def head(self):
+        if self.position >= len(self.data):
+            raise EOFError(self.data, self.position + 1)
+        return _byteChars[self.data[self.position]], self.error
+
+
+
+class _RewindableInterpreter(TrampolinedGrammarInterpreter):
+    """
+    A trampolined interpreter which, once a rule is matched, can be rewound to
+    match another one from where the previous one stopped.
+
+    The input is kept in a single C{bytearray} for the lifetime of the
+    interpreter: received data is appended to it in place, and the input
+    consumed by a rule is copied out of it only when the grammar binds it.
+    Consumed input is dropped only once it makes up most of the buffer, so
+    that rewinding neither allocates a new buffer nor copies what is still
+    unparsed. Since the buffer outlives every rule, parse errors refer to it
+    instead of holding a copy of it.
+
+    Unless it is debugging, the interpreter only reports where matching
+    failed: the furthest position anything failed to match at is recorded as
+    the rule is matched, every expression failing with the same exception,
+    and a L{ParseFailure} at that position is only built if the rule fails.
+
+    @cvar compactThreshold: The minimum amount of consumed input to drop.
+    @ivar debug: Whether rules fail with the errors of OMeta, which say what
+        every alternative tried expected.
+    @ivar furthest: The furthest position anything failed to match at since
+        the current rule started matching, unless debugging.
+    """
+    compactThreshold = 4096
+
+    def __init__(self, grammar, rules, globals, debug=False):
+        self.debug = debug
+        if debug:
+            self._streamType = _DebugInputStream
+        else:
+            self._streamType = _InputStream
+        self.grammar = grammar
+        self.rules = rules
+        self.globals = globals
+        self.callback = None
+        self.position = 0
+        self.currentResult = None
+        self._spanStart = 0
+        self._localsStack = []
+        self.input = self._streamType(bytearray(), 0)
+        self.ruleStart = self.furthest = 0
+        self.rule = None
+        self.next = None
+        self.started = False
+        self.ended = True
+
+
+    def rewind(self, rule, position=None):
+        """
+        Prepare to match C{rule}, starting where the last match stopped.
+
+        @param rule: The name of the rule, or a tuple of the name and the
+            arguments of the rule.
+        @param position: The offset in the input to start matching from, if
+            not where the last match stopped.
+        """
+        data = self.input.data
+        if position is None:
+            position = self.input.position
+        if position >= self.compactThreshold and position * 2 >= len(data):
+            del data[:position]
+            position = 0
+        self.input = self._streamType(data, position)
+        self.ruleStart = self.furthest = position
+        self._localsStack = []
+        self.rule = rule
+        self.next = self.setNext(rule)
+        self.started = False
+        self.ended = False
+
+
+    @property
+    def remaining(self):
+        """
+        The amount of input received but not consumed yet.
+        """
+        return len(self.input.data) - self.input.position
+
+
+    def feed(self, data):
+        """
+        Append data to the input.
+        """
+        self.input.data += data
+
+
+    def truncate(self, position):
+        """
+        Drop the input from C{position} on.
+
+        @return: The input dropped.
+        @rtype: C{bytes}
+        """
+        data = self.input.data
+        dropped = bytes(data[position:])
+        del data[position:]
+        return dropped
+
+
+    def parse_ConsumedBy(self, expr):
+        """
+        Match C{expr} and copy the input it consumed out of the buffer.
+        """
+        start = self.input.position
+        for x in self._eval(expr):
+            if x is _feed_me:
+                yield x
+        end = self.input.position
+        yield memoryview(self.input.data)[start:end].tobytes(), x[1]
+
+
+    def _count(self, term):
+        """
+        Get the value of a bound of a repetition: a number, a local name, or
+        C{None} for no bound.
+        """
+        if term.tag.name == '.int.':
+            return term.data
+        if term.tag.name == 'null':
+            return None
+        return self._localsStack[-1][term.data]
+
+
+    def _consume(self, end):
+        """
+        Advance the input to C{end} and copy the input consumed out of it.
+        """
+        start = self.input.position
+        self.input = self._streamType(self.input.data, end)
+        return memoryview(self.input.data)[start:end].tobytes()
+
+
+    def parse_ScanUntil(self, delimiter, limit):
+        """
+        Consume the input up to the next delimiter, or up to C{limit} bytes if
+        no delimiter is found before. Intrinsic for
+        C{<(~delimiter anything){0, limit}>}.
+
+        When the input runs out, the search resumes from where it stopped
+        once more is received, so that scanning a line received in many
+        chunks takes time linear in its length.
+        """
+        if delimiter.tag.name == 'Exactly':
+            wanted = _literalBytes(delimiter.args[0].data)
+        else:
+            wanted = eval(delimiter.args[0].data, self.globals,
+                          self._localsStack[-1])
+        limit = self._count(limit)
+        data = self.input.data
+        start = searchFrom = self.input.position
+        if limit is None:
+            stop = None
+        else:
+            # A delimiter starting at the limit would not be looked for.
+            stop = start + limit + len(wanted) - 1
+        while True:
+            if stop is None:
+                end = data.find(wanted, searchFrom)
+            else:
+                end = data.find(wanted, searchFrom, stop)
+            if end != -1:
+                break
+            if stop is not None and len(data) >= stop:
+                end = start + limit
+                break
+            # Resume the search where a delimiter received in part may start,
+            # so that no byte is looked at more than len(wanted) times.
+            searchFrom = max(searchFrom, len(data) - len(wanted) + 1)
+            yield _feed_me
+        yield self._consume(end), self.input.nullError()
+
+
+    def parse_Take(self, count):
+        """
+        Consume C{count} bytes. Intrinsic for C{<anything{count}>}.
+
+        The bytes are only copied once they have all been received.
+        """
+        count = max(self._count(count), 0)
+        while self.remaining < count:
+            yield _feed_me
+        yield (self._consume(self.input.position + count),
+               self.input.nullError())
+
+
+    def parse_Exactly(self, spec):
+        """
+        Match the literal C{spec}, compared with the input where it lies
+        rather than byte by byte.
+        """
+        wanted = _literalBytes(spec.data)
+        data = self.input.data
+        start = self.input.position
+        while True:
+            got = data[start:start + len(wanted)]
+            if got != wanted[:len(got)]:
+                # Fail where the input differs, as OMeta does.
+                i = 0
+                while got[i:i + 1] == wanted[i:i + 1]:
+                    i += 1
+                self.input = self._streamType(data, start + i)
+                self._fail(expected, None, spec.data)
+            if len(got) == len(wanted):
+                break
+            yield _feed_me
+        self.input = self._streamType(data, start + len(wanted))
+        yield wanted, self.input.nullError()
+
+
+    def parse_Or(self, expr):
+        """
+        Match the first alternative of C{expr} which matches.
+
+        Unless debugging, the errors of the alternatives are not merged, as
+        where they failed is already recorded.
+        """
+        if self.debug:
+            for x in TrampolinedGrammarInterpreter.parse_Or(self, expr):
+                yield x
+            return
+        start = self.input
+        for subexpr in expr.args:
+            try:
+                for x in self._eval(subexpr):
+                    if x is _feed_me:
+                        yield x
+                yield x
+                return
+            except ParseError:
+                self.input = start
+        raise _failed
+
+
+    def rule_exactly(self, wanted):
+        """
+        Match the string C{wanted}.
+        """
+        data = self.input.data
+        start = self.input.position
+        while True:
+            got = data[start:start + len(wanted)]
+            if got != wanted[:len(got)]:
+                self._fail(expected, None, wanted)
+            if len(got) == len(wanted):
+                break
+            yield _feed_me
+        self.input = self._streamType(data, start + len(wanted))
+        yield wanted, self.input.nullError()
+
+
+    def rule_unpack(self, struct):
+        """
+        Match the bytes of the single field of C{struct}, a L{struct.Struct},
+        and return its value.
+
+        The field is decoded where it lies in the input, without being
+        copied out first.
+        """
+        while self.remaining < struct.size:
+            yield _feed_me
+        data = self.input.data
+        position = self.input.position
+        value, = struct.unpack_from(data, position)
+        self.input = self._streamType(data, position + struct.size)
+        yield value, self.input.nullError()
+
+
+    def rule_varint(self, maxBytes):
+        """
+        Match an unsigned integer encoded in base 128 as in protocol buffers:
+        least significant group first, with the high bit of every byte but
+        the last one set.
+
+        At most C{maxBytes} bytes are read: a longer integer is cut short,
+        and its value is then at least C{2 ** (7 * (maxBytes - 1))}.
+        """
+        data = self.input.data
+        position = end = self.input.position
+        value = shift = 0
+        while True:
+            while end >= len(data):
+                yield _feed_me
+            byte = data[end]
+            end += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80 or end - position >= maxBytes:
+                break
+            shift += 7
+        self.input = self._streamType(data, end)
+        yield value, self.input.nullError()
+
+
+    def rule_scanUntilAny(self, delimiters, limit):
+        """
+        Consume the input up to the first of C{delimiters}, which is to start
+        at most C{limit} bytes ahead, and the delimiter.
+
+        The input is scanned once for all the delimiters.  Where one of them
+        starts another, as C{b'\\r'} starts C{b'\\r\\n'}, the longest one
+        found is matched: a delimiter ending the input received so far is
+        only matched once it is known not to be the start of another.
+
+        @return: The input before the delimiter, and the delimiter.
+        """
+        pattern, longest, prefixes = _delimiterPattern(delimiters)
+        data = self.input.data
+        start = searchFrom = self.input.position
+        stop = start + limit + longest
+        while True:
+            match = pattern.search(data, searchFrom, stop)
+            if match is not None:
+                if match.start() > start + limit:
+                    break
+                delimiter = bytes(match.group())
+                if match.end() < len(data) or delimiter not in prefixes:
+                    line = self._consume(match.start())
+                    self.input = self._streamType(data, match.end())
+                    yield (line, delimiter), self.input.nullError()
+                    return
+                searchFrom = match.start()
+            elif len(data) >= stop:
+                break
+            else:
+                # Resume the search where a delimiter received in part may
+                # start.
+                searchFrom = max(searchFrom, len(data) - longest + 1)
+            yield _feed_me
+        self._fail(expected, None, delimiters)
+
+
+    if bytes is not str:
+        def _apply(self, rule, ruleName, args):
+            """
+            Apply a rule to some arguments, passing them to a rule implemented
+            in Python which takes them, as OMeta does.
+
+            Parsley only finds the arguments such a rule takes through the
+            C{func_code} of Python 2, and pushes them onto the input of the
+            rule instead on Python 3.
+            """
+            if args:
+                code = getattr(rule, '__code__', None)
+                if code is not None and code.co_argcount - 1 == len(args):
+                    return self._applyDirectly(rule, args)
+            return TrampolinedGrammarInterpreter._apply(self, rule, ruleName,
+                                                        args)
+
+
+        def _applyDirectly(self, rule, args):
+            for x in rule(*args):
+                if x is _feed_me:
+                    yield x
+            yield x
+
+
+    def rule_letter(self):
+        """
+        Match a single letter, as a byte rather than a character.
+        """
+        return self._matchByte(_letters, "letter")
+
+
+    def rule_digit(self):
+        """
+        Match a single digit, as a byte rather than a character.
+        """
+        return self._matchByte(_digits, "digit")
+
+
+    def _matchByte(self, accepted, name):
+        try:
+            val, p = self.input.head()
+        except EOFError:
+            yield _feed_me
+            val, p = self.input.head()
+        if val not in accepted:
+            self._fail(expected, name)
+        self.input = self.input.tail()
+        yield val, p
+
+
+    def _fail(self, message, *args):
+        """
+        Fail to match at the current position.
+
+        @param message: A function returning the message of the parse error
+            from C{args}, which is only called when debugging.
+        """
+        if self.debug:
+            raise self.input.nullError().withMessage(message(*args))
+        self._mismatch()
+
+
+    def _mismatch(self):
+        """
+        Record that the input does not match at the current position, and
+        raise L{_failed}.
+        """
+        # Arguments are pushed onto the input as complex positions.
+        position = self.input.position.real
+        if position > self.furthest:
+            self.furthest = position
+        raise _failed
+
+
+    def err(self, e):
+        """
+        Raise a parse error without joining the whole input into it, or only
+        record where it happened unless debugging.
+        """
+        if self.debug:
+            raise e
+        self._mismatch()
+
+
+    def resume(self):
+        """
+        Resume matching the current rule with the input fed so far.
+
+        @return: C{_feed_me} if the rule needs more input, C{None} once it is
+            matched.
+
+        @raise ParseError: If the rule does not match; a L{ParseFailure}
+            unless debugging.
+        """
+        self.started = True
+        try:
+            for x in self.next:
+                if x is _feed_me:
+                    return x
+        except ParseError:
+            if self.debug:
+                raise
+            rule = self.rule
+            if isinstance(rule, tuple):
+                rule = rule[0]
+            raise ParseFailure(self.furthest - self.ruleStart, rule)
+        self.ended = True
+
+
+
+class _ProfilingInterpreter(_RewindableInterpreter):
+    """
+    A rewindable interpreter which records the calls of every rule in a
+    profiler.
+
+    The time of a call of a rule includes the rules it applies, but not the
+    time spent waiting for input.
+    """
+
+    def __init__(self, grammar, rules, globals, profiler, debug=False):
+        _RewindableInterpreter.__init__(self, grammar, rules, globals, debug)
+        self.profiler = profiler
+        self.grammarName = grammar.args[0].data
+
+
+    def apply(self, ruleName, codeName, args):
+        stats = self.profiler.getStats(self.grammarName, ruleName)
+        stats.calls += 1
+        clock = self.profiler.clock
+        # Arguments are pushed onto the input as complex positions.
+        start = int(self.input.position.real)
+        rule = _RewindableInterpreter.apply(self, ruleName, codeName, args)
+        while True:
+            began = clock()
+            try:
+                x = next(rule)
+            except StopIteration:
+                return
+            except ParseError:
+                stats.backtracks += 1
+                raise
+            finally:
+                stats.time += clock() - began
+            if x is not _feed_me:
+                stats.consumed += int(self.input.position.real) - start
+            yield x
+
+
+
+class TrampolinedParser(object):
+    """
+    A parser that incrementally parses incoming data.
+
+    One interpreter is kept for the lifetime of the parser: whenever a rule is
+    matched it is rewound to match the receiver's C{currentRule} (or the
+    parser's own, if the receiver has none) against the rest of the input.
+
+    @cvar intrinsics: Whether the common patterns of the grammar are matched
+        with the intrinsics of the interpreter instead of being interpreted.
+    @cvar profiler: The L{GrammarProfiler
+        <parseproto.util.instrument.GrammarProfiler>} recording the rules
+        matched by the parsers created from then on, if any.
+    @cvar debug: Whether the parsers created from then on raise the full
+        L{ParseError} of OMeta when the input does not match, saying what was
+        expected instead, rather than a L{ParseFailure}.
+    """
+
+    currentRule = 'initial'
+    intrinsics = True
+    profiler = None
+    debug = False
+    _parsing = False
+
+    def __init__(self, grammar, receiver, bindings):
+        """
+        Initializes the parser.
+
+        @param grammar: The grammar used to parse the incoming data.
+        @param receiver: Responsible for logic operation on the parsed data.
+            Typically, the logic operation will be invoked inside the grammar,
+            e.g., rule = expr1 expr2 (-> receiver.doSomeStuff())
+        @param bindings: The namespace that can be accessed inside the grammar.
+        """
+        self.grammar = grammar
+        self.bindings = dict(bindings)
+        self.bindings['receiver'] = self.receiver = receiver
+        rules = _getRules(grammar, self.intrinsics)
+        if self.profiler is None:
+            self._interp = _RewindableInterpreter(
+                grammar, rules, self.bindings, self.debug)
+        else:
+            self._interp = _ProfilingInterpreter(
+                grammar, rules, self.bindings, self.profiler, self.debug)
+        self._setupInterp()
+
+
+    def _setupInterp(self):
+        """
+        Rewinds the interpreter to begin parsing with the next rule.
+        """
+        self._interp.rewind(
+            getattr(self.receiver, 'currentRule', self.currentRule))
+
+
+    def setNextRule(self, nextRule):
+        self.currentRule = nextRule
+
+
+    @property
+    def remaining(self):
+        """
+        The amount of data received but not consumed yet by the interpreter.
+        """
+        return self._interp.remaining
+
+
+    def feed(self, data):
+        """
+        Append incoming data to the input without parsing it.
+
+        @param data: The raw data received.
+        """
+        self._interp.feed(data)
+
+
+    def parse(self):
+        """
+        Parse the data fed so far, according to the 'currentRule' rule in the
+        grammar, until it runs out or the receiver is paused.
+
+        The receiver is only checked for pausing between two rules. Data fed
+        while parsing, e.g. from a callback of the grammar, is parsed by the
+        running call rather than by a nested one.
+        """
+        if self._parsing:
+            return
+        interp = self._interp
+        if not interp.started:
+            # The rule to match next may have changed since the last match,
+            # e.g. if the receiver was switched to another mode.
+            rule = getattr(self.receiver, 'currentRule', self.currentRule)
+            if rule != interp.rule:
+                interp.rewind(rule)
+        self._parsing = True
+        try:
+            while interp.remaining and not getattr(
+                    self.receiver, 'paused', False):
+                if interp.resume() is _feed_me:
+                    return
+                self._setupInterp()
+        finally:
+            self._parsing = False
+
+
+    def receive(self, data):
+        """
+        Receive the incoming data and begin parsing. The parser will parse the
+        data incrementally according to the 'currentRule' rule in the grammar.
+
+        @param data: The raw data received.
+        """
+        self._interp.feed(data)
+        self.parse()
+
+
+    def clear(self):
+        """
+        Drop the data received but not parsed yet.
+
+        From within a callback of the grammar, this is the data after the
+        input matched so far. Otherwise, this includes the input partially
+        matched by the current rule, which is matched again from scratch
+        against the data received from then on.
+
+        @return: The data dropped.
+        @rtype: C{bytes}
+        """
+        interp = self._interp
+        if self._parsing:
+            return interp.truncate(interp.input.position)
+        dropped = interp.truncate(interp.ruleStart)
+        interp.rewind(
+            getattr(self.receiver, 'currentRule', self.currentRule),
+            interp.ruleStart)
+        return dropped
@@ -1,4 +1,19 @@
+import sys
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class build_py_grammars(build_py):
+    """
+    Build the packages, then compile their Parsley grammars ahead of time.
+    """
+    def run(self):
+        build_py.run(self)
+        if not self.dry_run:
+            self.spawn([sys.executable, '-m', 'parseproto.util.grammar',
+                        self.build_lib])
+
 
 setup(
     name='parsley-protocols',
@@ -8,7 +23,11 @@ setup(
     license='MIT',
     author='Shiyao Ma',
     author_email='i@introo.me',
-    packages=['parseproto', 'parseproto.test'],
+    packages=['parseproto', 'parseproto.amp', 'parseproto.basic',
+              'parseproto.dns', 'parseproto.imap4', 'parseproto.smtp',
+              'parseproto.profile', 'parseproto.util', 'parseproto.test'],
+    package_data={'': ['*.parsley']},
+    cmdclass={'build_py': build_py_grammars},
     install_requires=[
         'twisted >= 13.0.0',
         # 'parsley >= 1.1',